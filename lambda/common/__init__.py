@@ -0,0 +1,3 @@
+"""
+Shared helpers packaged with every Smart Door Lambda function
+"""
@@ -0,0 +1,50 @@
+"""
+Tuned botocore client settings shared by all handlers
+Per-service connect/read timeouts sized for a visitor waiting at the door,
+adaptive retries, TCP keep-alive and a connection pool sized to the handler
+"""
+
+import os
+
+# Retry mode and attempts (first call included) for every client
+RETRY_MODE = os.environ.get('AWS_RETRY_MODE', 'adaptive')
+MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '3'))
+
+# Connections kept per client; handlers with a thread pool raise it
+DEFAULT_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '10'))
+
+# service -> (connect timeout, read timeout) in seconds. botocore's default is
+# 60s for both, longer than any of the functions may run. A read timeout only
+# needs to cover the slowest normal response: a stalled call is cut off and
+# retried on a fresh connection instead of holding the visitor up.
+SERVICE_TIMEOUTS = {
+    'dynamodb': (1, 2),
+    'dynamodbstreams': (1, 2),
+    'sns': (2, 5),
+    'sqs': (2, 5),
+    's3': (2, 10),
+    'rekognition': (2, 10),
+    'kinesisvideo': (2, 5),
+    'kinesis-video-media': (2, 15),
+    'kinesis-video-archived-media': (2, 15)
+}
+DEFAULT_TIMEOUTS = (2, 10)
+
+
+def client_config(service: str, max_pool_connections: int = None, **overrides):
+    """
+    Build the botocore Config for a service client
+    overrides are any other Config arguments and take precedence
+    """
+    from botocore.config import Config
+
+    connect_timeout, read_timeout = SERVICE_TIMEOUTS.get(service, DEFAULT_TIMEOUTS)
+    settings = {
+        'connect_timeout': connect_timeout,
+        'read_timeout': read_timeout,
+        'retries': {'mode': RETRY_MODE, 'max_attempts': MAX_ATTEMPTS},
+        'max_pool_connections': max_pool_connections or DEFAULT_POOL_CONNECTIONS,
+        'tcp_keepalive': True
+    }
+    settings.update(overrides)
+    return Config(**settings)
@@ -0,0 +1,129 @@
+"""
+Lazy AWS client registry shared by all handlers
+Clients, resources and DynamoDB tables are created on first use from a
+single shared boto3 session, so a cold start only pays for what it calls.
+Every client gets the tuned settings from common.aws_config and has its
+calls timed by common.metrics
+"""
+
+import threading
+
+from common.aws_config import client_config
+from common.metrics import metrics
+
+
+class ClientRegistry:
+    """
+    Creates and caches boto3 clients and resources from one session.
+    boto3 itself is only imported when the first client is needed.
+    """
+
+    def __init__(self):
+        self._session = None
+        self._cache = {}
+        self._overrides = {}
+        self._lock = threading.RLock()
+        self.max_pool_connections = None  # None: common.aws_config default
+
+    def _get_session(self):
+        if self._session is None:
+            import boto3
+            self._session = boto3.session.Session()
+        return self._session
+
+    def _get(self, key, create):
+        # Fast path without the lock once the object exists
+        if key in self._overrides:
+            return self._overrides[key]
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is None:
+                cached = create()
+                self._cache[key] = cached
+            return cached
+
+    def configure(self, max_pool_connections: int = None):
+        """
+        Size the connection pool of clients created from now on, e.g. to the
+        number of threads a handler runs; call at import, before first use
+        """
+        self.max_pool_connections = max_pool_connections
+
+    def _config(self, service: str, config=None):
+        tuned = client_config(service, self.max_pool_connections)
+        return tuned.merge(config) if config is not None else tuned
+
+    def client(self, service: str, **kwargs):
+        """
+        Return a client for service, built once per distinct set of kwargs
+        A config kwarg is merged over the tuned defaults
+        """
+        key = ('client', service, tuple(sorted(kwargs.items())))
+        if ('client', service) in self._overrides:
+            return self._overrides[('client', service)]
+        return self._get(key, lambda: metrics.watch(self._get_session().client(
+            service, **{**kwargs, 'config': self._config(service, kwargs.get('config'))}
+        )))
+
+    def resource(self, service: str):
+        """
+        Return a resource for service
+        """
+        return self._get(('resource', service), lambda: metrics.watch(self._get_session().resource(
+            service, config=self._config(service)
+        )))
+
+    def table(self, name: str):
+        """
+        Return a DynamoDB Table resource
+        """
+        return self._get(('table', name), lambda: self.resource('dynamodb').Table(name))
+
+    def override(self, kind: str, name: str, obj):
+        """
+        Substitute a local stand-in, e.g. override('client', 'sns', fake_sns)
+        Used by benchmarks and local tools; never set in deployed code
+        """
+        with self._lock:
+            self._overrides[(kind, name)] = obj
+
+    def reset(self):
+        """
+        Drop every cached object and override (next use re-creates them)
+        """
+        with self._lock:
+            self._cache.clear()
+            self._overrides.clear()
+            self._session = None
+
+    def lazy_client(self, service: str, **kwargs):
+        return LazyProxy(lambda: self.client(service, **kwargs))
+
+    def lazy_resource(self, service: str):
+        return LazyProxy(lambda: self.resource(service))
+
+    def lazy_table(self, name: str):
+        return LazyProxy(lambda: self.table(name))
+
+
+class LazyProxy:
+    """
+    Module-level stand-in for a client or table that resolves through the
+    registry on every attribute access, so handlers keep their
+    `s3_client.put_object(...)` call sites while creation is deferred
+    """
+
+    __slots__ = ('_resolve',)
+
+    def __init__(self, resolve):
+        object.__setattr__(self, '_resolve', resolve)
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+
+# Process-wide registry shared by every module in the deployment package
+registry = ClientRegistry()
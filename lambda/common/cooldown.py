@@ -0,0 +1,80 @@
+"""
+Notification cooldowns shared by LF1 and the SMS dispatcher
+Keeps a warm in-process TTL/LRU cache in front of a conditional-write
+record in DynamoDB, so concurrent invocations agree on who may notify
+"""
+
+import time
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+
+
+class CooldownCache:
+    """
+    Grants at most one notification per key inside a cooldown window.
+
+    The local cache answers repeat detections on a warm container without
+    any I/O. On a local miss the claim is made with a conditional put in
+    DynamoDB, which only succeeds if no unexpired record exists for the key.
+    """
+
+    def __init__(self, table, window_seconds: int, max_entries: int = 1024):
+        self.table = table
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> expiry (epoch seconds)
+
+    def acquire(self, key: str) -> bool:
+        """
+        Try to claim the cooldown for a key.
+        Returns True if the caller should notify, False if inside the window.
+        """
+        now = int(time.time())
+
+        expires_at = self._entries.get(key)
+        if expires_at is not None:
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                return False
+            del self._entries[key]
+
+        expires_at = now + self.window_seconds
+        try:
+            self.table.put_item(
+                Item={
+                    'cooldownKey': key,
+                    'ttl': expires_at
+                },
+                ConditionExpression='attribute_not_exists(cooldownKey) OR #ttl <= :now',
+                ExpressionAttributeNames={'#ttl': 'ttl'},
+                ExpressionAttributeValues={':now': now},
+                ReturnValuesOnConditionCheckFailure='ALL_OLD'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                # Fail open: a missed de-dup is better than a missed visitor
+                print(f"Error claiming cooldown for {key}: {str(e)}")
+                return True
+            existing = e.response.get('Item', {})
+            held_until = existing.get('ttl', {}).get('N')
+            self._remember(key, int(held_until) if held_until else expires_at)
+            return False
+
+        self._remember(key, expires_at)
+        return True
+
+    def release(self, key: str):
+        """
+        Give up a claim, e.g. when the notification it guarded failed
+        """
+        self._entries.pop(key, None)
+        try:
+            self.table.delete_item(Key={'cooldownKey': key})
+        except Exception as e:
+            print(f"Error releasing cooldown for {key}: {str(e)}")
+
+    def _remember(self, key: str, expires_at: int):
+        self._entries[key] = expires_at
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
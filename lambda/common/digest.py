@@ -0,0 +1,186 @@
+"""
+Owner alert digests for bursts of unknown visitors
+Alerts for one owner and door that arrive close together are collected in
+a single item in the cooldowns table and sent as one message
+"""
+
+import re
+import time
+import uuid
+from botocore.exceptions import ClientError
+
+from common.cooldown import CooldownCache
+
+# Actions returned by OwnerDigest.add
+SEND_NOW = 'send_now'        # First alert after a quiet window: send it alone
+FLUSH_LATER = 'flush_later'  # Opened a digest: schedule its flush after the window
+FLUSH_NOW = 'flush_now'      # Filled the digest: flush it at once
+APPENDED = 'appended'        # Joined a digest whose flush is already scheduled
+
+# A digest whose flush never ran is replaced this long after its window
+STALE_GRACE_SECONDS = 300
+
+
+class OwnerDigest:
+    """
+    Coalesces owner alerts per owner and door.
+
+    The first alert after a quiet window_seconds goes out on its own. Later
+    alerts are appended to a digest item; the alert that opens the digest
+    schedules a flush window_seconds later and the one that brings it to
+    max_events asks for an immediate flush. A flush takes the whole digest
+    with one conditional delete, so every alert is sent exactly once, and
+    restores it if the alerts could not be queued. Alerts carry an ID, so
+    adding one again (e.g. on a Kinesis retry) does not repeat it.
+    """
+
+    def __init__(self, table, window_seconds: int = 30, max_events: int = 5):
+        self.table = table
+        self.window_seconds = window_seconds
+        self.max_events = max_events
+        self.leading = CooldownCache(table, window_seconds)
+
+    def add(self, key: str, alert_id: str, alert: dict):
+        """
+        Record an alert for key (e.g. "<owner>#<door>"), identified by alert_id
+        Returns (action, window_id); window_id names the digest to flush.
+        An alert already in the digest returns the action it got when added,
+        so a retried caller schedules its flush again
+        """
+        if self.leading.acquire(f"alert#{key}"):
+            return SEND_NOW, None
+
+        now = int(time.time())
+        values = {
+            ':alert': [{**alert, 'alertId': alert_id}],
+            ':id': alert_id,
+            ':ids': {alert_id},
+            ':window': uuid.uuid4().hex,
+            ':ttl': now + self.window_seconds + STALE_GRACE_SECONDS,
+            ':now': now,
+            ':one': 1
+        }
+        # Append to the open digest; a stale one (its flush was lost) is replaced
+        updates = (
+            ('SET alerts = list_append(alerts, :alert) ADD alertCount :one, alertIds :ids',
+             'attribute_exists(windowId) AND #ttl > :now AND NOT contains(alertIds, :id)'),
+            ('SET alerts = :alert, alertCount = :one, alertIds = :ids, windowId = :window, #ttl = :ttl',
+             'attribute_not_exists(windowId) OR #ttl <= :now')
+        )
+        for update, condition in updates * 2:
+            try:
+                item = self.table.update_item(
+                    Key={'cooldownKey': self._key(key)},
+                    UpdateExpression=update,
+                    ConditionExpression=condition,
+                    ExpressionAttributeNames={'#ttl': 'ttl'},
+                    ExpressionAttributeValues={
+                        name: value for name, value in values.items()
+                        if name in re.findall(r':\w+', f"{update} {condition}")
+                    },
+                    ReturnValues='ALL_NEW'
+                )['Attributes']
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                continue
+            return self._action(int(item['alertCount'])), item['windowId']
+
+        # Already in the open digest: repeat the action it got when added
+        item = self.table.get_item(Key={'cooldownKey': self._key(key)}, ConsistentRead=True).get('Item', {})
+        for position, existing in enumerate(item.get('alerts', []), 1):
+            if existing.get('alertId') == alert_id:
+                return self._action(position), item['windowId']
+
+        # Lost every race against concurrent flushes: send the alert alone
+        return SEND_NOW, None
+
+    def _action(self, count: int) -> str:
+        """
+        Action for the alert that brought a digest to count alerts
+        """
+        if count >= self.max_events:
+            return FLUSH_NOW if count == self.max_events else APPENDED
+        return FLUSH_LATER if count == 1 else APPENDED
+
+    def take(self, key: str, window_id: str) -> list:
+        """
+        Remove the digest if it is still window_id and return its alerts
+        """
+        try:
+            response = self.table.delete_item(
+                Key={'cooldownKey': self._key(key)},
+                ConditionExpression='windowId = :window',
+                ExpressionAttributeValues={':window': window_id},
+                ReturnValues='ALL_OLD'
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            return []
+        return response.get('Attributes', {}).get('alerts', [])
+
+    def restore(self, key: str, window_id: str, alerts: list):
+        """
+        Put back alerts taken from window_id that could not be sent
+        They rejoin the open digest if another one started meanwhile, or
+        recreate window_id for the retried flush to take again
+        """
+        if not alerts:
+            return
+        ids = {alert['alertId'] for alert in alerts if alert.get('alertId')}
+        update = (
+            'SET alerts = list_append(if_not_exists(alerts, :none), :alerts), '
+            'windowId = if_not_exists(windowId, :window), #ttl = if_not_exists(#ttl, :ttl) '
+            'ADD alertCount :count' + (', alertIds :ids' if ids else '')
+        )
+        values = {
+            ':none': [],
+            ':alerts': alerts,
+            ':window': window_id,
+            ':ttl': int(time.time()) + self.window_seconds + STALE_GRACE_SECONDS,
+            ':count': len(alerts)
+        }
+        if ids:
+            values[':ids'] = ids
+        self.table.update_item(
+            Key={'cooldownKey': self._key(key)},
+            UpdateExpression=update,
+            ExpressionAttributeNames={'#ttl': 'ttl'},
+            ExpressionAttributeValues=values
+        )
+
+    def _key(self, key: str) -> str:
+        return f"digest#{key}"
+
+
+def format_alerts(alerts: list, door_id: str):
+    """
+    Owner SMS text, email subject and email body for one or more alerts
+    Each alert is {'approvalLink', 'photoUrl', 'detectedAt'}
+    """
+    if len(alerts) == 1:
+        alert = alerts[0]
+        sms = (
+            f"🚪 Smart Door Alert!\n"
+            f"An unknown visitor is at your door.\n"
+            f"Approve access: {alert['approvalLink']}"
+        )
+        email = (
+            f"An unknown visitor is at your door.\n\n"
+            f"Approve access: {alert['approvalLink']}\n\n"
+            f"Photo: {alert['photoUrl']}"
+        )
+        return sms, "Smart Door: Unknown Visitor", email
+
+    sms_lines = [f"🚪 Smart Door: {len(alerts)} unknown visitors at door {door_id}."]
+    email_lines = [f"{len(alerts)} unknown visitors came to door {door_id}:", ""]
+    for number, alert in enumerate(alerts, 1):
+        sms_lines.append(f"{number}. {alert['approvalLink']}")
+        email_lines.extend([
+            f"{number}. {alert.get('detectedAt', '')}",
+            f"   Approve access: {alert['approvalLink']}",
+            f"   Photo: {alert['photoUrl']}",
+            ""
+        ])
+    return '\n'.join(sms_lines), f"Smart Door: {len(alerts)} Unknown Visitors", '\n'.join(email_lines)
@@ -0,0 +1,94 @@
+"""
+Door-to-SMS latency trace
+A detection's trace holds when the camera captured the frame, when Kinesis
+Video Streams received it, when the Rekognition result reached the Kinesis
+stream and when LF1 started on it; it travels with the SMS through the
+outbox and each hop is recorded with common.metrics by the function that
+sees it end
+"""
+
+from common.metrics import metrics
+
+# Who the SMS is for
+VISITOR = 'visitor'  # A known visitor's OTP
+OWNER = 'owner'  # The owner's unknown-visitor alert
+
+# A producer timestamp more than CLOCK_TOLERANCE_SECONDS ahead of the KVS
+# server timestamp, or MAX_CAMERA_LAG_SECONDS behind it, comes from a
+# skewed camera clock and is not used
+CLOCK_TOLERANCE_SECONDS = 1.0
+MAX_CAMERA_LAG_SECONDS = 60
+
+# Hops as (start, end) trace timestamps, grouped by the timestamp that
+# completes them: LF1 sets handledAt when it queues or publishes the SMS
+# and publishedAt is set once SNS accepts it (in LF4 with the outbox).
+# startedAt is capturedAt, or ingestedAt when the camera clock is unusable
+HOPS = {
+    'handledAt': {
+        'camera_to_kvs': ('capturedAt', 'ingestedAt'),
+        'kvs_to_rekognition': ('ingestedAt', 'arrivedAt'),
+        'kinesis_queueing': ('arrivedAt', 'handlerAt'),
+        'handler': ('handlerAt', 'handledAt')
+    },
+    'publishedAt': {
+        'sms_queue': ('handledAt', 'publishedAt'),
+        'end_to_end': ('startedAt', 'publishedAt')
+    }
+}
+
+
+def start_trace(input_info: dict, record: dict, received_at: float) -> dict:
+    """
+    Trace of a detection in a Kinesis record, as epoch seconds
+    capturedAt is the producer timestamp of the frame (the camera's clock),
+    ingestedAt its KVS server timestamp and arrivedAt the record's
+    approximate arrival time; each is left out when the record lacks it.
+    A producer timestamp that disagrees with the server's is dropped, so
+    the end-to-end time starts at ingestion instead
+    """
+    trace = {'handlerAt': received_at}
+    kinesis_video = input_info.get('KinesisVideo', {})
+    offset = float(kinesis_video.get('FrameOffsetInSeconds', 0))
+    for name, field in (('capturedAt', 'ProducerTimestamp'), ('ingestedAt', 'ServerTimestamp')):
+        if kinesis_video.get(field) is not None:
+            trace[name] = float(kinesis_video[field]) + offset
+    if 'capturedAt' in trace and 'ingestedAt' in trace:
+        lag = trace['ingestedAt'] - trace['capturedAt']
+        if not -CLOCK_TOLERANCE_SECONDS <= lag <= MAX_CAMERA_LAG_SECONDS:
+            del trace['capturedAt']
+            metrics.count('CameraClockSkewed')
+    started_at = trace.get('capturedAt', trace.get('ingestedAt'))
+    if started_at is not None:
+        trace['startedAt'] = started_at
+    arrival = record.get('kinesis', {}).get('approximateArrivalTimestamp')
+    if arrival is not None:
+        trace['arrivedAt'] = float(arrival)
+    return trace
+
+
+def for_recipient(trace: dict, kind: str):
+    """
+    The trace of an SMS to a VISITOR or the OWNER, or None without a trace
+    """
+    return {**trace, 'kind': kind} if trace else None
+
+
+def record_hops(trace: dict, handled_at: float = None, published_at: float = None) -> dict:
+    """
+    Set handledAt and/or publishedAt on a traced SMS and record the hops
+    they complete as stages door_to_sms.<kind>.<hop>. Hops are clamped at
+    0 ms, since the capture time comes from the camera's clock.
+    Returns the updated trace, to pass on with the SMS
+    """
+    if not trace:
+        return trace
+    trace = dict(trace)
+    kind = trace.get('kind', VISITOR)
+    for name, at in (('handledAt', handled_at), ('publishedAt', published_at)):
+        if at is None:
+            continue
+        trace[name] = at
+        for hop, (start, end) in HOPS[name].items():
+            if start in trace and end in trace:
+                metrics.record(f"door_to_sms.{kind}.{hop}", max(0.0, (trace[end] - trace[start]) * 1000))
+    return trace
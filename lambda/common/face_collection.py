@@ -0,0 +1,199 @@
+"""
+Rekognition face collections shared by the handlers
+Faces are indexed into the base collection until it holds max_faces, then
+into numbered shard collections; searches fan out across the shards
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+# Shard n > 0 of collection "<base>" is "<base>-shard-<n>"
+SHARD_SEPARATOR = '-shard-'
+
+
+class FaceCollections:
+    """
+    A base collection and its shards, with their state cached per container.
+
+    Shard 0 is the base collection itself, so the stream processor and the
+    faces indexed before sharding keep working unchanged. The shard list and
+    the active shard's face count are refreshed from Rekognition every
+    state_ttl_seconds; in between, faces indexed by this container are added
+    to the cached count. Other containers' writes show up on refresh, so
+    max_faces is a soft limit.
+    """
+
+    def __init__(self, rekognition, base_id: str, max_faces: int = 1000000,
+                 state_ttl_seconds: int = 300, max_workers: int = 4):
+        self.rekognition = rekognition
+        self.base_id = base_id
+        self.max_faces = max_faces
+        self.state_ttl_seconds = state_ttl_seconds
+        self.max_workers = max_workers
+        self._shards = None  # Collection IDs ordered by shard number
+        self._listed_at = 0.0
+        self._counts = {}  # collection ID -> (face count, checked at)
+        self._lock = threading.Lock()
+
+    def shard_id(self, number: int) -> str:
+        return self.base_id if number == 0 else f"{self.base_id}{SHARD_SEPARATOR}{number}"
+
+    def shard_number(self, collection_id: str):
+        """
+        Shard number of a collection ID, or None if it is not one of ours
+        """
+        if collection_id == self.base_id:
+            return 0
+        prefix = f"{self.base_id}{SHARD_SEPARATOR}"
+        suffix = collection_id[len(prefix):]
+        if collection_id.startswith(prefix) and suffix.isdigit():
+            return int(suffix)
+        return None
+
+    def shards(self) -> list:
+        """
+        Collection IDs of every existing shard, listed at most once per TTL
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._shards is not None and now - self._listed_at < self.state_ttl_seconds:
+                return list(self._shards)
+
+        numbers = set()
+        kwargs = {}
+        while True:
+            response = self.rekognition.list_collections(**kwargs)
+            for collection_id in response.get('CollectionIds', []):
+                number = self.shard_number(collection_id)
+                if number is not None:
+                    numbers.add(number)
+            if not response.get('NextToken'):
+                break
+            kwargs['NextToken'] = response['NextToken']
+
+        with self._lock:
+            self._shards = [self.shard_id(number) for number in sorted(numbers)]
+            self._listed_at = now
+            return list(self._shards)
+
+    def face_count(self, collection_id: str):
+        """
+        Faces in a collection, described at most once per TTL
+        Returns None if the collection does not exist
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._counts.get(collection_id)
+            if cached and now - cached[1] < self.state_ttl_seconds:
+                return cached[0]
+        try:
+            count = self.rekognition.describe_collection(CollectionId=collection_id)['FaceCount']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+            return None
+        with self._lock:
+            self._counts[collection_id] = (count, now)
+        return count
+
+    def active_shard(self) -> str:
+        """
+        The shard new faces go to, creating the next one once it is full
+        """
+        shards = self.shards()
+        if not shards:
+            return self._create(0)
+        latest = shards[-1]
+        count = self.face_count(latest)
+        if count is None:
+            # Deleted since it was listed
+            self.invalidate()
+            return self._create(self.shard_number(latest))
+        if count >= self.max_faces:
+            return self._create(self.shard_number(latest) + 1)
+        return latest
+
+    def index_faces(self, **kwargs) -> dict:
+        """
+        IndexFaces into the active shard; kwargs are its arguments without
+        CollectionId. The response gains the 'CollectionId' used.
+        """
+        collection_id = self.active_shard()
+        try:
+            response = self.rekognition.index_faces(CollectionId=collection_id, **kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+            self.invalidate()
+            collection_id = self.active_shard()
+            response = self.rekognition.index_faces(CollectionId=collection_id, **kwargs)
+
+        indexed = len(response.get('FaceRecords', []))
+        with self._lock:
+            cached = self._counts.get(collection_id)
+            if cached:
+                self._counts[collection_id] = (cached[0] + indexed, cached[1])
+        return {**response, 'CollectionId': collection_id}
+
+    def search(self, image: dict, threshold: float = 80, max_faces: int = 1, exclude=()) -> list:
+        """
+        Search the shards not in exclude in parallel for the largest face in
+        image; returns the best max_faces matches, each with its 'CollectionId'
+        """
+        targets = [collection_id for collection_id in self.shards() if collection_id not in exclude]
+        if not targets:
+            return []
+
+        def search_shard(collection_id):
+            try:
+                response = self.rekognition.search_faces_by_image(
+                    CollectionId=collection_id,
+                    Image=image,
+                    FaceMatchThreshold=threshold,
+                    MaxFaces=max_faces
+                )
+            except ClientError as e:
+                # A shard deleted since listing, or no face in the image
+                if e.response['Error']['Code'] in ('ResourceNotFoundException', 'InvalidParameterException'):
+                    return []
+                raise
+            return [{**match, 'CollectionId': collection_id} for match in response.get('FaceMatches', [])]
+
+        if len(targets) == 1:
+            results = [search_shard(targets[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(targets))) as pool:
+                results = list(pool.map(search_shard, targets))
+
+        matches = [match for shard_matches in results for match in shard_matches]
+        matches.sort(key=lambda match: match.get('Similarity', 0), reverse=True)
+        return matches[:max_faces]
+
+    def invalidate(self):
+        """
+        Forget the cached shard list and face counts
+        """
+        with self._lock:
+            self._shards = None
+            self._counts.clear()
+
+    def _create(self, number: int) -> str:
+        collection_id = self.shard_id(number)
+        try:
+            self.rekognition.create_collection(CollectionId=collection_id)
+            print(f"Created collection: {collection_id}")
+            created = True
+        except ClientError as e:
+            # Another container created it first
+            if e.response['Error']['Code'] != 'ResourceAlreadyExistsException':
+                raise
+            created = False
+        with self._lock:
+            if self._shards is not None and collection_id not in self._shards:
+                self._shards.append(collection_id)
+                self._shards.sort(key=self.shard_number)
+            if created:
+                self._counts[collection_id] = (0, time.monotonic())
+        return collection_id
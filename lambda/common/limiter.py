@@ -0,0 +1,228 @@
+"""
+Rate limiter shared by the handlers
+Token buckets per subject (e.g. source IP, door or phone number) are kept in
+warm-container memory and reconciled with shared counters in DynamoDB, so
+excess work is shed before it reaches a table or SNS. LF3 sheds /validate
+requests (with failure lockouts) and LF4 paces SMS sends with it
+"""
+
+import time
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+
+# Rejection reasons returned by RateLimiter.check
+RATE_LIMITED = 'rate_limited'
+LOCKED = 'locked'
+
+SYNC_ATTEMPTS = 3
+
+
+class Limit:
+    """
+    Limits for one kind of subject (e.g. source IP or door)
+    rate/burst shape the local token bucket; window_max caps requests per
+    window_seconds across all containers; lockout opts the subject into
+    failure streaks and lockouts (RateLimiter.record_failure)
+    """
+
+    def __init__(self, rate: float, burst: int, window_seconds: int, window_max: int,
+                 lockout: bool = False):
+        self.rate = rate
+        self.burst = burst
+        self.window_seconds = window_seconds
+        self.window_max = window_max
+        self.lockout = lockout
+
+
+class RateLimiter:
+    """
+    Admits or sheds requests per subject before the work they ask for.
+
+    Each subject has a local token bucket. Local hits are added to a shared
+    per-window counter every sync_every requests or sync_seconds, and the
+    same write returns the subject's lockout if it has one, so a warm
+    container answers most requests, including rejections, without I/O.
+    For limits with lockout set, failure streaks lock a subject out for
+    lockout_base_seconds, doubling with every further failure up to
+    lockout_max_seconds; other limits only rate-limit. With table None
+    the limiter works from local state only.
+    """
+
+    def __init__(self, table, limits: dict, lockout_threshold: int = 5,
+                 lockout_base_seconds: int = 30, lockout_max_seconds: int = 3600,
+                 sync_every: int = 10, sync_seconds: float = 5.0,
+                 max_entries: int = 4096, clock=time.time):
+        self.table = table
+        self.limits = limits
+        self.lockout_threshold = lockout_threshold
+        self.lockout_base_seconds = lockout_base_seconds
+        self.lockout_max_seconds = lockout_max_seconds
+        self.sync_every = sync_every
+        self.sync_seconds = sync_seconds
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()  # "kind#value" -> local subject state
+
+    def check(self, subjects: dict):
+        """
+        Take one request for every subject, e.g. {'ip': '1.2.3.4', 'door': 'front'}
+        Returns (reason, retry_after_seconds); reason is None if admitted
+        """
+        now = self.clock()
+        for kind, value in subjects.items():
+            limit = self.limits.get(kind)
+            if limit is None or not value:
+                continue
+            entry = self._entry(kind, value, limit, now)
+
+            blocked_until = max(entry['lockedUntil'], entry['blockedUntil'])
+            if blocked_until > now:
+                return self._rejection(entry, blocked_until - now)
+
+            entry['tokens'] = min(limit.burst, entry['tokens'] + (now - entry['updated']) * limit.rate)
+            entry['updated'] = now
+            if entry['tokens'] < 1:
+                return RATE_LIMITED, (1 - entry['tokens']) / limit.rate
+            entry['tokens'] -= 1
+            entry['pending'] += 1
+
+            if (
+                entry['syncedAt'] is None
+                or entry['pending'] >= self.sync_every
+                or now - entry['syncedAt'] >= self.sync_seconds
+            ):
+                self._sync(kind, value, limit, entry, now)
+                blocked_until = max(entry['lockedUntil'], entry['blockedUntil'])
+                if blocked_until > now:
+                    return self._rejection(entry, blocked_until - now)
+
+        return None, 0
+
+    def record_failure(self, kind: str, value: str):
+        """
+        Count a failed validation; may start or extend a lockout
+        """
+        limit = self.limits.get(kind)
+        if limit is None or not limit.lockout or not value:
+            return
+        now = self.clock()
+        entry = self._entry(kind, value, limit, now)
+        entry['failures'] += 1
+        try:
+            item = {} if self.table is None else self.table.update_item(
+                Key={'cooldownKey': self._key(kind, value)},
+                UpdateExpression='ADD failures :one SET #ttl = :ttl',
+                ExpressionAttributeNames={'#ttl': 'ttl'},
+                ExpressionAttributeValues={':one': 1, ':ttl': int(now + self.lockout_max_seconds)},
+                ReturnValues='ALL_NEW'
+            ).get('Attributes', {})
+            entry['failures'] = int(item.get('failures', entry['failures']))
+        except Exception as e:
+            print(f"Error recording failure for {kind} {value}: {str(e)}")
+
+        excess = entry['failures'] - self.lockout_threshold
+        if excess < 0:
+            return
+        locked_until = now + min(self.lockout_base_seconds * 2 ** excess, self.lockout_max_seconds)
+        entry['lockedUntil'] = locked_until
+        try:
+            if self.table is not None:
+                self.table.update_item(
+                    Key={'cooldownKey': self._key(kind, value)},
+                    UpdateExpression='SET lockedUntil = :until',
+                    ExpressionAttributeValues={':until': int(locked_until)}
+                )
+        except Exception as e:
+            print(f"Error storing lockout for {kind} {value}: {str(e)}")
+        print(f"Locked out {kind} {value} for {int(locked_until - now)}s after {entry['failures']} failures")
+
+    def record_success(self, kind: str, value: str):
+        """
+        Clear the failure streak of a subject after a valid code
+        """
+        entry = self._entries.get(f"{kind}#{value}")
+        if entry is None or not entry['failures']:
+            return
+        entry['failures'] = 0
+        if self.table is None:
+            return
+        try:
+            self.table.update_item(
+                Key={'cooldownKey': self._key(kind, value)},
+                UpdateExpression='SET failures = :zero REMOVE lockedUntil',
+                ExpressionAttributeValues={':zero': 0}
+            )
+        except Exception as e:
+            print(f"Error clearing failures for {kind} {value}: {str(e)}")
+
+    def _key(self, kind: str, value: str) -> str:
+        return f"limit#{kind}#{value}"
+
+    def _entry(self, kind: str, value: str, limit: Limit, now: float) -> dict:
+        local_key = f"{kind}#{value}"
+        entry = self._entries.get(local_key)
+        if entry is None:
+            entry = {
+                'tokens': float(limit.burst), 'updated': now, 'pending': 0, 'syncedAt': None,
+                'blockedUntil': 0, 'lockedUntil': 0, 'failures': 0
+            }
+            self._entries[local_key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(local_key)
+        return entry
+
+    def _rejection(self, entry: dict, retry_after: float):
+        reason = LOCKED if entry['lockedUntil'] >= entry['blockedUntil'] else RATE_LIMITED
+        return reason, retry_after
+
+    def _sync(self, kind: str, value: str, limit: Limit, entry: dict, now: float):
+        """
+        Add pending local hits to the shared window counter and read back the
+        subject's window total, failure streak and lockout
+        """
+        window = int(now // limit.window_seconds)
+        window_end = (window + 1) * limit.window_seconds
+        if self.table is None:
+            entry['pending'] = 0
+            entry['syncedAt'] = now
+            return
+        # Failure streaks outlive the window for limits with lockouts
+        expires = max(window_end, now + self.lockout_max_seconds) if limit.lockout else window_end
+        values = {':window': window, ':n': entry['pending'], ':ttl': int(expires)}
+        # The counter normally lives in the current window; the first hit of a
+        # new window resets it instead of adding to the previous total
+        updates = (
+            ('ADD hits :n SET #ttl = :ttl', '#window = :window'),
+            ('SET hits = :n, #window = :window, #ttl = :ttl',
+             'attribute_not_exists(#window) OR #window < :window')
+        )
+        item = None
+        for attempt in range(SYNC_ATTEMPTS):
+            update, condition = updates[attempt % 2]
+            try:
+                item = self.table.update_item(
+                    Key={'cooldownKey': self._key(kind, value)},
+                    UpdateExpression=update,
+                    ConditionExpression=condition,
+                    ExpressionAttributeNames={'#window': 'window', '#ttl': 'ttl'},
+                    ExpressionAttributeValues=values,
+                    ReturnValues='ALL_NEW'
+                ).get('Attributes', {})
+                break
+            except Exception as e:
+                if isinstance(e, ClientError) and \
+                        e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                    continue
+                # Fail open on the shared store; the local bucket still applies
+                print(f"Error syncing limiter for {kind} {value}: {str(e)}")
+                break
+
+        entry['pending'] = 0
+        entry['syncedAt'] = now
+        if item is None:
+            return
+        if int(item.get('hits', 0)) > limit.window_max:
+            entry['blockedUntil'] = window_end
+        entry['failures'] = int(item.get('failures', 0))
+        entry['lockedUntil'] = max(entry['lockedUntil'], int(item.get('lockedUntil', 0)))
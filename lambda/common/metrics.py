@@ -0,0 +1,253 @@
+"""
+Per-invocation latency and count metrics shared by all handlers
+Stages and every AWS call are timed in-process and written once per
+invocation as CloudWatch embedded metric format (EMF) log lines, with
+Function, Stage and Outcome dimensions; METRICS_MODE=local prints
+histograms aggregated across invocations instead
+"""
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'SmartDoor')
+MODE = os.environ.get('METRICS_MODE', 'emf')  # emf, local or off
+
+# EMF accepts at most 100 distinct values per metric in one document
+MAX_VALUES = 100
+
+# Error codes reported with the throttled outcome rather than error
+THROTTLING_CODES = {
+    'ThrottlingException', 'Throttling', 'ThrottledException', 'TooManyRequestsException',
+    'ProvisionedThroughputExceededException', 'RequestLimitExceeded', 'SlowDown',
+    'LimitExceededException', 'RequestThrottledException'
+}
+
+
+def bucket(value: float) -> float:
+    """
+    Round to two significant figures (at most 5% off) so repeated latencies
+    collapse into a few values and counts
+    """
+    return float(f'{value:.2g}')
+
+
+def percentile(counts: Counter, fraction: float) -> float:
+    """
+    The value at a fraction of a {value: count} histogram
+    """
+    target = fraction * sum(counts.values())
+    seen = 0
+    for value in sorted(counts):
+        seen += counts[value]
+        if seen >= target:
+            return value
+    return 0.0
+
+
+class _Timer:
+    """
+    Context manager timing one stage; the outcome is error if the block
+    raises, unless set beforehand
+    """
+    __slots__ = ('metrics', 'stage', 'outcome', 'started')
+
+    def __init__(self, metrics, stage: str):
+        self.metrics = metrics
+        self.stage = stage
+        self.outcome = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        elapsed_ms = (time.perf_counter() - self.started) * 1000
+        outcome = self.outcome or ('error' if exc_type else 'ok')
+        self.metrics.record(self.stage, elapsed_ms, outcome)
+        return False
+
+
+class Metrics:
+    """
+    Collects timings and counts for the current invocation.
+
+    record and count only append to per-invocation containers, which is
+    safe from worker threads without a lock; flush swaps them out and
+    writes one EMF document per stage and outcome plus one for the counts.
+    """
+
+    def __init__(self, namespace: str = NAMESPACE, mode: str = MODE, emit=print):
+        self.namespace = namespace
+        self.mode = mode
+        self.emit = emit
+        self.function = os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+        self._timings = {}  # (stage, outcome) -> [milliseconds]
+        self._counts = {}  # name -> [increments]
+        self._histograms = {}  # local mode: (stage, outcome) -> Counter of bucketed ms
+        self._totals = Counter()  # local mode: counts across invocations
+        self._lock = threading.Lock()
+        self._reporting = False
+
+    def timer(self, stage: str) -> _Timer:
+        """
+        with metrics.timer('photo.extract'): ...
+        """
+        return _Timer(self, stage)
+
+    def record(self, stage: str, milliseconds: float, outcome: str = 'ok'):
+        if self.mode != 'off':
+            self._timings.setdefault((stage, outcome), []).append(milliseconds)
+
+    def count(self, name: str, value: float = 1):
+        if self.mode != 'off':
+            self._counts.setdefault(name, []).append(value)
+
+    def handler(self, function):
+        """
+        Decorate a Lambda handler: times the invocation and flushes once at its end
+        """
+        @functools.wraps(function)
+        def wrapper(event, context):
+            if getattr(context, 'function_name', None):
+                self.function = context.function_name
+            try:
+                with self.timer('invocation'):
+                    return function(event, context)
+            finally:
+                self.flush()
+        return wrapper
+
+    def flush(self):
+        """
+        Write the invocation's metrics and start a new invocation
+        """
+        with self._lock:
+            timings, self._timings = self._timings, {}
+            counts, self._counts = self._counts, {}
+        if not timings and not counts:
+            return
+        if self.mode == 'local':
+            self._aggregate(timings, counts)
+        elif self.mode == 'emf':
+            self.emit('\n'.join(self._documents(timings, counts)))
+
+    def _documents(self, timings: dict, counts: dict) -> list:
+        """
+        EMF documents for the invocation; latency documents share everything
+        but their values, so they are assembled from a pre-encoded header
+        """
+        timestamp = int(time.time() * 1000)
+        header = json.dumps({
+            '_aws': {
+                'Timestamp': timestamp,
+                'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Function', 'Stage', 'Outcome']],
+                    'Metrics': [{'Name': 'Latency', 'Unit': 'Milliseconds'}]
+                }]
+            },
+            'Function': self.function
+        }, separators=(',', ':'))[:-1]
+        documents = []
+        for (stage, outcome), values in sorted(timings.items()):
+            histogram = Counter()
+            for value in values:
+                key = bucket(value)
+                if key not in histogram and len(histogram) >= MAX_VALUES:
+                    key = min(histogram, key=lambda existing: abs(existing - value))
+                histogram[key] += 1
+            documents.append(
+                f'{header},"Stage":{json.dumps(stage)},"Outcome":{json.dumps(outcome)},'
+                f'"Latency":{{"Values":[{",".join(map(repr, histogram))}],'
+                f'"Counts":[{",".join(map(str, histogram.values()))}]}}}}'
+            )
+        if counts:
+            document = {
+                '_aws': {
+                    'Timestamp': timestamp,
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [['Function']],
+                        'Metrics': [{'Name': name, 'Unit': 'Count'} for name in sorted(counts)]
+                    }]
+                },
+                'Function': self.function
+            }
+            document.update({name: sum(increments) for name, increments in counts.items()})
+            documents.append(json.dumps(document, separators=(',', ':')))
+        return documents
+
+    def _aggregate(self, timings: dict, counts: dict):
+        for key, values in timings.items():
+            histogram = self._histograms.setdefault(key, Counter())
+            histogram.update(bucket(value) for value in values)
+        for name, increments in counts.items():
+            self._totals[name] += sum(increments)
+        if not self._reporting:
+            self._reporting = True
+            atexit.register(self.report)
+
+    def report(self):
+        """
+        Print the local-mode histograms: count and percentiles per stage and outcome
+        """
+        if not self._histograms and not self._totals:
+            return
+        print(f"\n{'stage':<44} {'outcome':<10} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} "
+              f"{'p99 ms':>9} {'max ms':>9}")
+        for (stage, outcome), histogram in sorted(self._histograms.items()):
+            print(f"{stage:<44} {outcome:<10} {sum(histogram.values()):>7} "
+                  f"{percentile(histogram, 0.5):>9.5g} {percentile(histogram, 0.95):>9.5g} "
+                  f"{percentile(histogram, 0.99):>9.5g} {max(histogram):>9.5g}")
+        for name, total in sorted(self._totals.items()):
+            print(f"{name:<44} {'count':<10} {total:>7g}")
+
+    def watch(self, client):
+        """
+        Time every call made through a botocore client (or a boto3 resource's
+        client) as stage <service>.<Operation>, e.g. dynamodb.BatchGetItem;
+        the outcome is ok, throttled or error. Returns client unchanged.
+        """
+        meta = getattr(client, 'meta', None)
+        meta = getattr(getattr(meta, 'client', None), 'meta', meta)
+        events = getattr(meta, 'events', None)
+        if events is None or self.mode == 'off':
+            return client
+        # Registered first at the level stubs answer before-call at, so a
+        # handler that returns a response cannot skip the timer
+        events.register_first('before-call.*.*', self._before_call)
+        events.register('after-call.*.*', self._after_call)
+        events.register('after-call-error.*.*', self._after_call_error)
+        return client
+
+    @staticmethod
+    def _before_call(context, **kwargs):
+        context['metrics_started'] = time.perf_counter()
+
+    def _after_call(self, http_response, parsed, model, context, **kwargs):
+        started = context.get('metrics_started')
+        if started is None:
+            return
+        outcome = 'ok'
+        if http_response is not None and http_response.status_code >= 300:
+            code = (parsed or {}).get('Error', {}).get('Code')
+            outcome = 'throttled' if code in THROTTLING_CODES else 'error'
+        self._record_call(model, started, outcome)
+
+    def _after_call_error(self, context, model=None, **kwargs):
+        started = context.get('metrics_started')
+        if started is not None and model is not None:
+            self._record_call(model, started, 'error')
+
+    def _record_call(self, model, started: float, outcome: str):
+        service = model.service_model.service_id.hyphenize()
+        self.record(f"{service}.{model.name}", (time.perf_counter() - started) * 1000, outcome)
+
+
+# Process-wide metrics shared by the handler and every module it uses
+metrics = Metrics()
@@ -0,0 +1,157 @@
+"""
+One-time passcode operations shared by the handlers
+Passcodes are scoped to a door and keyed by (doorId, otp). Allocating and
+consuming one are each a single conditional write, so live codes never
+collide and a code can only ever open its door once
+"""
+
+import re
+import secrets
+import time
+from botocore.exceptions import ClientError
+
+# Outcomes of consume_otp
+GRANTED = 'granted'
+EXPIRED = 'expired'
+MISSING = 'missing'
+USED = 'used'
+
+OTP_LENGTH = 6
+ALLOCATE_ATTEMPTS = 8
+
+# Door used when a deployment or request does not name one
+DEFAULT_DOOR_ID = 'default'
+DOOR_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+# GSI on the passcodes table: faceId (hash) + ttl (range)
+FACE_INDEX = 'faceId-index'
+
+
+def door_ids(value: str) -> frozenset:
+    """
+    Parse a comma-separated DOOR_IDS setting; empty means any well-formed door
+    """
+    return frozenset(door.strip() for door in (value or '').split(',') if door.strip())
+
+
+def parse_door_id(value, default: str = DEFAULT_DOOR_ID, doors: frozenset = None):
+    """
+    The door a request names, or default when it names none
+    Returns None when the ID is malformed, or not in doors when given
+    (the default door is always allowed)
+    """
+    door_id = str(value or default).strip()
+    if not DOOR_ID_PATTERN.match(door_id):
+        return None
+    if doors and door_id not in doors and door_id != default:
+        return None
+    return door_id
+
+
+class OtpAllocationError(Exception):
+    """
+    No free passcode was found within the attempt budget
+    """
+
+
+def consume_otp(table, door_id: str, otp: str, now: int = None):
+    """
+    Atomically mark a door's passcode as used if it exists, is unexpired and unused.
+    Returns (outcome, item); item is the stored passcode for GRANTED, else None.
+
+    The passcode is kept as a used tombstone until its TTL removes it, so a
+    second submission is told it was already used rather than not found.
+    """
+    now = int(time.time()) if now is None else now
+    try:
+        response = table.update_item(
+            Key={'doorId': door_id, 'otp': otp},
+            UpdateExpression='SET usedAt = :now',
+            ConditionExpression='attribute_exists(otp) AND #ttl > :now AND attribute_not_exists(usedAt)',
+            ExpressionAttributeNames={'#ttl': 'ttl'},
+            ExpressionAttributeValues={':now': now},
+            ReturnValues='ALL_OLD',
+            ReturnValuesOnConditionCheckFailure='ALL_OLD'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # The failed item comes back in low-level attribute-value form
+        existing = e.response.get('Item')
+        if not existing:
+            return MISSING, None
+        if 'usedAt' in existing:
+            return USED, None
+        return EXPIRED, None
+
+    return GRANTED, response.get('Attributes', {})
+
+
+def random_otp(length: int = OTP_LENGTH) -> str:
+    """
+    Draw a passcode from the OS CSPRNG
+    """
+    return f"{secrets.randbelow(10 ** length):0{length}d}"
+
+
+def allocate_otp(table, door_id: str, fields: dict, ttl_seconds: int, length: int = OTP_LENGTH,
+                 max_attempts: int = ALLOCATE_ATTEMPTS) -> str:
+    """
+    Store fields under a fresh passcode that no live passcode of the door holds.
+    Returns the passcode.
+
+    Each attempt is a conditional put that only succeeds if the code is free
+    or its previous holder has expired. A collision is just an unlucky draw,
+    not contention, so the next code is tried immediately: with L live codes
+    on the door an attempt fails with probability L / 10**length, and even at
+    50,000 live six-digit codes all eight attempts fail about once in 10**10
+    allocations. Other doors' codes never count towards L.
+    """
+    for _ in range(max_attempts):
+        otp = random_otp(length)
+        now = int(time.time())
+        try:
+            table.put_item(
+                Item={**fields, 'doorId': door_id, 'otp': otp, 'ttl': now + ttl_seconds},
+                ConditionExpression='attribute_not_exists(otp) OR #ttl <= :now',
+                ExpressionAttributeNames={'#ttl': 'ttl'},
+                ExpressionAttributeValues={':now': now}
+            )
+            return otp
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+    raise OtpAllocationError(f"No free passcode found in {max_attempts} attempts")
+
+
+def find_live_otp(table, face_id: str, door_id: str, min_remaining_seconds: int = 0,
+                  now: int = None):
+    """
+    Return a visitor's unused passcode for a door that stays valid for at
+    least min_remaining_seconds, or None.
+
+    One query on the faceId index, latest expiry first. The index is
+    eventually consistent, so a code issued moments ago may be missed.
+    """
+    now = int(time.time()) if now is None else now
+    response = table.query(
+        IndexName=FACE_INDEX,
+        KeyConditionExpression='faceId = :face AND #ttl > :until',
+        FilterExpression='doorId = :door AND attribute_not_exists(usedAt)',
+        ExpressionAttributeNames={'#ttl': 'ttl'},
+        ExpressionAttributeValues={
+            ':face': face_id,
+            ':door': door_id,
+            ':until': now + min_remaining_seconds
+        },
+        ScanIndexForward=False
+    )
+    items = response.get('Items', [])
+    return items[0] if items else None
+
+
+def revoke_otp(table, door_id: str, otp: str):
+    """
+    Delete a passcode, e.g. one whose SMS could not be delivered
+    """
+    table.delete_item(Key={'doorId': door_id, 'otp': otp})
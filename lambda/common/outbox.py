@@ -0,0 +1,130 @@
+"""
+SMS outbox shared by the handlers
+Handlers enqueue SMS (and owner email) intents on an SQS queue and return at
+once; the SMS dispatcher (LF4) drains the queue in batches and publishes
+through SNS
+"""
+
+import hashlib
+import json
+import time
+
+from common.door_trace import record_hops
+
+# Intent kinds; intents without a kind are SMS
+TOPIC = 'topic'
+DIGEST = 'digest'
+
+# Longest delay SQS allows on a message
+MAX_DELAY_SECONDS = 900
+
+# SNS error codes worth retrying; any other error is permanent
+RETRYABLE_ERRORS = {
+    'Throttling', 'ThrottlingException', 'ThrottledException',
+    'InternalError', 'InternalFailure', 'ServiceUnavailable', 'KMSThrottlingException'
+}
+
+
+def dedup_key(phone_number: str, message: str) -> str:
+    """
+    Identity of an SMS: the same text to the same number
+    """
+    return hashlib.sha256(f"{phone_number}\n{message}".encode()).hexdigest()[:32]
+
+
+def publish_sms(sns, phone_number: str, message: str):
+    """
+    Publish one transactional SMS through SNS
+    """
+    return sns.publish(
+        PhoneNumber=phone_number,
+        Message=message,
+        MessageAttributes={
+            'AWS.SNS.SMS.SMSType': {
+                'DataType': 'String',
+                'StringValue': 'Transactional'
+            }
+        }
+    )
+
+
+class SmsOutbox:
+    """
+    Enqueues SMS intents for the dispatcher.
+
+    Enqueueing is one SQS write, so SNS latency and throttling never reach
+    the caller. Without a queue URL the SMS is published directly, which
+    keeps local runs and stacks without a queue working as before.
+    """
+
+    def __init__(self, queue_url: str, sqs, sns):
+        self.queue_url = queue_url
+        self.sqs = sqs
+        self.sns = sns
+
+    def send(self, phone_number: str, message: str, passcode: dict = None, trace: dict = None) -> str:
+        """
+        Queue an SMS and return its message ID.
+        passcode ({'doorId', 'otp'}) names an OTP the dispatcher revokes
+        if the SMS can never be delivered. trace (common.door_trace) is
+        carried to the dispatcher, which records the hops after this one.
+        """
+        if not self.queue_url:
+            message_id = publish_sms(self.sns, phone_number, message)['MessageId']
+            now = time.time()
+            record_hops(trace, handled_at=now, published_at=now)
+            return message_id
+
+        intent = {
+            'phoneNumber': phone_number,
+            'message': message,
+            'dedupKey': dedup_key(phone_number, message),
+            'enqueuedAt': time.time()
+        }
+        if passcode:
+            intent['passcode'] = passcode
+        if trace:
+            intent['trace'] = {**trace, 'handledAt': intent['enqueuedAt']}
+        response = self.sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(intent))
+        record_hops(trace, handled_at=intent['enqueuedAt'])
+        return response['MessageId']
+
+    def send_topic(self, topic_arn: str, subject: str, message: str) -> str:
+        """
+        Queue a publish to an SNS topic (e.g. the owner's email) and return its message ID
+        """
+        if not self.queue_url:
+            return self.sns.publish(TopicArn=topic_arn, Subject=subject, Message=message)['MessageId']
+
+        intent = {
+            'kind': TOPIC,
+            'topicArn': topic_arn,
+            'subject': subject,
+            'message': message,
+            'dedupKey': dedup_key(topic_arn, message),
+            'enqueuedAt': time.time()
+        }
+        response = self.sqs.send_message(QueueUrl=self.queue_url, MessageBody=json.dumps(intent))
+        return response['MessageId']
+
+    def schedule_digest(self, digest_key: str, window_id: str, door_id: str, delay_seconds: int,
+                        phone_number: str = None, topic_arn: str = None) -> str:
+        """
+        Ask the dispatcher to flush an owner digest (common.digest) after
+        delay_seconds, to phone_number and/or topic_arn. Needs a queue.
+        """
+        intent = {
+            'kind': DIGEST,
+            'digestKey': digest_key,
+            'windowId': window_id,
+            'doorId': door_id,
+            'phoneNumber': phone_number,
+            'topicArn': topic_arn,
+            'enqueuedAt': time.time()
+        }
+        response = self.sqs.send_message(
+            QueueUrl=self.queue_url,
+            MessageBody=json.dumps(intent),
+            DelaySeconds=int(min(max(delay_seconds, 0), MAX_DELAY_SECONDS))
+        )
+        return response['MessageId']
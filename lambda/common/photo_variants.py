@@ -0,0 +1,119 @@
+"""
+Thumbnail and display variants of visitor photos
+Each photo stored in S3 gets re-encoded, size-bounded copies under
+predictable keys next to it, for the approval page and owner alerts
+"""
+
+import io
+
+# Variant -> (longest edge in pixels, size budget in bytes); the key of a
+# variant is its prefix followed by the original key
+VARIANTS = {
+    'display': (640, 40 * 1024),
+    'thumbnail': (160, 8 * 1024)
+}
+VARIANT_PREFIXES = {name: f"{name}/" for name in VARIANTS}
+
+# JPEG qualities tried in turn until a variant fits its budget
+QUALITY_STEPS = (75, 65, 55, 45)
+
+# Variant keys never change content, so clients may cache them for good
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def variant_key(photo_key: str, variant: str) -> str:
+    """
+    Key of a photo's variant, e.g. thumbnail/visitors/20240101_120000_abc.jpg
+    """
+    return f"{VARIANT_PREFIXES[variant]}{original_key(photo_key)}"
+
+
+def variant_keys(photo_key: str) -> dict:
+    return {variant: variant_key(photo_key, variant) for variant in VARIANTS}
+
+
+def original_key(photo_key: str) -> str:
+    """
+    Key of the original photo, given its key or the key of one of its variants
+    """
+    for prefix in VARIANT_PREFIXES.values():
+        if photo_key.startswith(prefix):
+            return photo_key[len(prefix):]
+    return photo_key
+
+
+def _encode(image, max_bytes: int) -> bytes:
+    """
+    Encode as progressive JPEG at the highest quality step that fits
+    max_bytes, or at the lowest step if none does
+    """
+    for quality in QUALITY_STEPS:
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality, optimize=True, progressive=True)
+        if output.tell() <= max_bytes:
+            break
+    return output.getvalue()
+
+
+def render_variants(photo: bytes) -> dict:
+    """
+    Render every variant of a photo; returns {variant: JPEG bytes}
+    Empty when Pillow is unavailable or the photo cannot be decoded.
+    Variants are resized largest first, each from the previous one.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        print("Pillow unavailable, photo variants not rendered")
+        return {}
+
+    try:
+        image = Image.open(io.BytesIO(photo))
+        # JPEGs are decoded at a reduced scale when that is still large enough
+        largest = max(edge for edge, _ in VARIANTS.values())
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+        rendered = {}
+        for variant, (edge, max_bytes) in sorted(VARIANTS.items(), key=lambda item: -item[1][0]):
+            image = image.copy()
+            image.thumbnail((edge, edge), Image.LANCZOS)
+            rendered[variant] = _encode(image, max_bytes)
+        return rendered
+    except Exception as e:
+        print(f"Error rendering photo variants: {str(e)}")
+        return {}
+
+
+def store_variants(s3, bucket: str, photo_key: str, photo: bytes) -> dict:
+    """
+    Render a photo's variants and upload them next to it
+    Returns {variant: key} for the variants that were stored
+    """
+    stored = {}
+    for variant, body in render_variants(photo).items():
+        key = variant_key(photo_key, variant)
+        try:
+            s3.put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=body,
+                ContentType='image/jpeg',
+                CacheControl=CACHE_CONTROL
+            )
+            stored[variant] = key
+        except Exception as e:
+            print(f"Error uploading {variant} of {photo_key}: {str(e)}")
+    return stored
+
+
+def store_variants_from_s3(s3, bucket: str, photo_key: str) -> dict:
+    """
+    store_variants for a photo that is already in S3
+    """
+    try:
+        photo = s3.get_object(Bucket=bucket, Key=photo_key)['Body'].read()
+    except Exception as e:
+        print(f"Error reading {photo_key} for variants: {str(e)}")
+        return {}
+    return store_variants(s3, bucket, photo_key, photo)
@@ -0,0 +1,326 @@
+"""
+Warm-container cache of the visitor directory for LF1
+Names and phone numbers are read through a bounded TTL/LRU cache that the
+visitors table's DynamoDB stream keeps current; small directories are
+preloaded whole, so a known visitor needs no visitor-table read
+"""
+
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+
+# The stream's position can no longer be resumed, changes may have been missed
+LOST_POSITION_ERRORS = ('TrimmedDataAccessException', 'ResourceNotFoundException')
+
+
+class CachedVisitor:
+    """
+    The attributes LF1 needs from a visitor, in slots rather than an item dict
+    """
+    __slots__ = ('face_id', 'name', 'phone_number', 'expires_at')
+
+    def __init__(self, face_id: str, name: str, phone_number: str, expires_at: float):
+        self.face_id = face_id
+        self.name = name
+        self.phone_number = phone_number
+        self.expires_at = expires_at
+
+    def as_item(self) -> dict:
+        item = {'faceId': self.face_id}
+        if self.name is not None:
+            item['name'] = self.name
+        if self.phone_number is not None:
+            item['phoneNumber'] = self.phone_number
+        return item
+
+
+class VisitorChangeFeed:
+    """
+    Reads a table's DynamoDB stream from where the previous poll stopped.
+
+    Shards open when the feed starts are read from LATEST, shards that appear
+    later from TRIM_HORIZON. An expired iterator (a container idle for more
+    than 15 minutes) is renewed after the last sequence number read; only when
+    that is impossible does poll report that changes may have been missed.
+    """
+
+    def __init__(self, streams_client, stream_arn: str, poll_seconds: float = 1.0,
+                 shard_refresh_seconds: int = 60, max_pages: int = 10):
+        self.streams = streams_client
+        self.stream_arn = stream_arn
+        self.poll_seconds = poll_seconds
+        self.shard_refresh_seconds = shard_refresh_seconds
+        self.max_pages = max_pages
+        self._iterators = {}  # shard ID -> iterator, None once the shard is closed
+        self._sequence_numbers = {}  # shard ID -> last sequence number read
+        self._next_poll = 0.0
+        self._next_refresh = 0.0
+
+    def poll(self, force: bool = False) -> tuple:
+        """
+        Read the changes since the last poll, at most once per poll_seconds
+        Returns (records, continuous); continuous is False when records may
+        have been missed since the previous poll
+        """
+        now = time.monotonic()
+        if not force and now < self._next_poll:
+            return [], True
+        self._next_poll = now + self.poll_seconds
+
+        continuous = True
+        if now >= self._next_refresh:
+            self._next_refresh = now + self.shard_refresh_seconds
+            continuous = self._refresh_shards()
+
+        records = []
+        for shard_id, iterator in list(self._iterators.items()):
+            for _ in range(self.max_pages):
+                if iterator is None:
+                    break
+                try:
+                    response = self.streams.get_records(ShardIterator=iterator, Limit=1000)
+                except ClientError as e:
+                    code = e.response['Error']['Code']
+                    if code == 'ExpiredIteratorException':
+                        iterator = self._resume(shard_id)
+                        if iterator is not None:
+                            continue
+                    elif code not in LOST_POSITION_ERRORS:
+                        # Transient: the iterator is kept and retried next poll
+                        print(f"Error reading visitor changes from {shard_id}: {str(e)}")
+                        break
+                    continuous = False
+                    iterator = self._iterator(shard_id, 'LATEST')
+                    if iterator is None:
+                        # Not a closed shard: reopened on the next refresh
+                        self._next_refresh = 0.0
+                        del self._iterators[shard_id]
+                    break
+                page = response.get('Records', [])
+                records.extend(page)
+                if page:
+                    self._sequence_numbers[shard_id] = page[-1]['dynamodb']['SequenceNumber']
+                iterator = response.get('NextShardIterator')
+                if iterator is None:
+                    # Closed shard: its children are picked up on the next refresh
+                    self._next_refresh = 0.0
+                if not page:
+                    break
+            if shard_id in self._iterators:
+                self._iterators[shard_id] = iterator
+        return records, continuous
+
+    def _refresh_shards(self) -> bool:
+        """
+        Start reading shards that appeared since the last refresh
+        Returns False if a shard could not be listed or opened
+        """
+        try:
+            shards, start = [], None
+            while True:
+                kwargs = {'StreamArn': self.stream_arn}
+                if start:
+                    kwargs['ExclusiveStartShardId'] = start
+                description = self.streams.describe_stream(**kwargs)['StreamDescription']
+                shards.extend(description.get('Shards', []))
+                start = description.get('LastEvaluatedShardId')
+                if not start:
+                    break
+        except Exception as e:
+            print(f"Error listing visitor stream shards: {str(e)}")
+            return False
+
+        starting = not self._iterators
+        opened = True
+        for shard in shards:
+            shard_id = shard['ShardId']
+            if shard_id in self._iterators:
+                continue
+            closed = 'EndingSequenceNumber' in shard.get('SequenceNumberRange', {})
+            if starting and closed:
+                self._iterators[shard_id] = None
+                continue
+            iterator = self._iterator(shard_id, 'LATEST' if starting else 'TRIM_HORIZON')
+            if iterator is None:
+                # Not being read: retried on the next refresh
+                opened = False
+                self._next_refresh = 0.0
+                continue
+            self._iterators[shard_id] = iterator
+        return opened
+
+    def _resume(self, shard_id: str):
+        """
+        A fresh iterator just after the last record read from the shard, or
+        from its start if none was read (replaying a change is harmless)
+        """
+        sequence_number = self._sequence_numbers.get(shard_id)
+        if sequence_number:
+            return self._iterator(shard_id, 'AFTER_SEQUENCE_NUMBER', sequence_number)
+        return self._iterator(shard_id, 'TRIM_HORIZON')
+
+    def _iterator(self, shard_id: str, iterator_type: str, sequence_number: str = None):
+        kwargs = {'StreamArn': self.stream_arn, 'ShardId': shard_id, 'ShardIteratorType': iterator_type}
+        if sequence_number:
+            kwargs['SequenceNumber'] = sequence_number
+        try:
+            return self.streams.get_shard_iterator(**kwargs)['ShardIterator']
+        except Exception as e:
+            print(f"Error opening visitor stream shard {shard_id}: {str(e)}")
+            return None
+
+
+class VisitorCache:
+    """
+    Read-through cache of visitor names and phone numbers.
+
+    Entries live for ttl_seconds and at most max_entries are kept, least
+    recently used first out. With a change feed, changed visitors are updated
+    and deleted ones dropped on the next poll, and if the feed loses its place
+    the cache is emptied. When the table holds at most snapshot_max_items
+    visitors it is loaded whole and reloaded every ttl_seconds.
+    """
+
+    def __init__(self, table, ttl_seconds: int = 60, max_entries: int = 1024,
+                 feed: VisitorChangeFeed = None, snapshot_max_items: int = 0):
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.feed = feed
+        self.snapshot_max_items = min(snapshot_max_items, max_entries)
+        self._entries = OrderedDict()  # face ID -> CachedVisitor
+        self._snapshot_expires_at = 0.0
+        self._refreshing = None  # Future of a refresh started by prefetch
+        self._executor = None
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self):
+        """
+        Start refresh in the background so its stream reads overlap the
+        caller's other work; the next get_many waits for it
+        """
+        if self._refreshing is None:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1)
+            self._refreshing = self._executor.submit(self.refresh)
+
+    def get_many(self, face_ids: list, fetch) -> dict:
+        """
+        Visitors for the face IDs as {faceId: item}; fetch(face_ids) is called
+        once for the ones not cached and must return the same shape
+        """
+        if self._refreshing is not None:
+            refreshing, self._refreshing = self._refreshing, None
+            refreshing.result()
+        # A no-op right after a prefetch; catches up if it was long ago
+        self.refresh()
+        now = time.monotonic()
+        visitors, missing = {}, []
+        for face_id in dict.fromkeys(face_ids):
+            entry = self._entries.get(face_id)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(face_id)
+                visitors[face_id] = entry.as_item()
+            else:
+                missing.append(face_id)
+        self.hits += len(visitors)
+        self.misses += len(missing)
+
+        if missing:
+            for face_id, item in fetch(missing).items():
+                visitors[face_id] = self._store(item, now).as_item()
+        return visitors
+
+    def refresh(self):
+        """
+        Apply the changes the feed has seen and reload a due snapshot
+        """
+        if self.feed is not None:
+            try:
+                records, continuous = self.feed.poll()
+            except Exception as e:
+                print(f"Error polling visitor changes: {str(e)}")
+                records, continuous = [], True
+            if not continuous:
+                print("Visitor change feed lost its place, cache cleared")
+                self.clear()
+            for record in records:
+                self._apply(record)
+
+        if self.snapshot_max_items and time.monotonic() >= self._snapshot_expires_at:
+            self.preload()
+
+    def preload(self) -> bool:
+        """
+        Load every visitor if there are at most snapshot_max_items of them
+        Returns True if the directory was loaded whole
+        """
+        if self.feed is not None:
+            # Changes made while scanning are applied on the next poll
+            self.feed.poll(force=True)
+        now = time.monotonic()
+        self._snapshot_expires_at = now + self.ttl_seconds
+        items, kwargs = [], {
+            'ProjectionExpression': 'faceId, #name, phoneNumber',
+            'ExpressionAttributeNames': {'#name': 'name'}
+        }
+        try:
+            while True:
+                response = self.table.scan(**kwargs)
+                items.extend(response.get('Items', []))
+                if len(items) > self.snapshot_max_items:
+                    print(f"Visitor directory exceeds {self.snapshot_max_items} items, not preloaded")
+                    self.snapshot_max_items = 0
+                    return False
+                if 'LastEvaluatedKey' not in response:
+                    break
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        except Exception as e:
+            print(f"Error preloading visitors: {str(e)}")
+            return False
+
+        for item in items:
+            if item.get('phoneNumber'):
+                self._store(item, now)
+        print(f"Preloaded {len(self._entries)} visitors")
+        return True
+
+    def invalidate(self, face_id: str):
+        self._entries.pop(face_id, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._snapshot_expires_at = 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _apply(self, record: dict):
+        """
+        Apply one stream record: the new image replaces the entry, removals
+        and visitors without a phone number (e.g. pending ones) drop it
+        """
+        change = record.get('dynamodb', {})
+        face_id = change.get('Keys', {}).get('faceId', {}).get('S')
+        if not face_id:
+            return
+        image = change.get('NewImage') or {}
+        phone_number = image.get('phoneNumber', {}).get('S')
+        if record.get('eventName') == 'REMOVE' or not phone_number:
+            self.invalidate(face_id)
+            return
+        self._store({
+            'faceId': face_id,
+            'name': image.get('name', {}).get('S'),
+            'phoneNumber': phone_number
+        }, time.monotonic())
+
+    def _store(self, item: dict, now: float) -> CachedVisitor:
+        entry = CachedVisitor(item['faceId'], item.get('name'), item.get('phoneNumber'), now + self.ttl_seconds)
+        self._entries[entry.face_id] = entry
+        self._entries.move_to_end(entry.face_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
@@ -0,0 +1,84 @@
+"""
+Visitor records and photo history shared by the handlers
+A visitor's core record is written with one upsert; each photo is its own
+item in the visitor photos table, keyed by faceId and photoAt
+"""
+
+import secrets
+from datetime import datetime, timezone
+
+def upsert_visitor(table, face_id: str, name: str, phone_number: str, photo: dict = None,
+                   status: str = 'approved', now: str = None) -> dict:
+    """
+    Create or update a visitor in a single UpdateItem and return the record.
+    createdAt is only set on creation; photo, when given, becomes latestPhoto
+    and is counted in photoCount. The history itself is kept by add_photo.
+    """
+    now = now or datetime.now(timezone.utc).isoformat()
+    update = (
+        'SET #name = :name, phoneNumber = :phone, #status = :status, updatedAt = :now, '
+        'createdAt = if_not_exists(createdAt, :now)'
+    )
+    values = {':name': name, ':phone': phone_number, ':status': status, ':now': now}
+    if photo:
+        update += ', latestPhoto = :photo ADD photoCount :one'
+        values.update({':photo': photo, ':one': 1})
+    response = table.update_item(
+        Key={'faceId': face_id},
+        UpdateExpression=update,
+        ExpressionAttributeNames={'#name': 'name', '#status': 'status'},
+        ExpressionAttributeValues=values,
+        ReturnValues='ALL_NEW'
+    )
+    return response.get('Attributes', {})
+
+
+def visitor_item(face_id: str, name: str, phone_number: str, photo: dict = None,
+                 status: str = 'approved', now: str = None) -> dict:
+    """
+    The record upsert_visitor creates for a new face, for writers that
+    put whole items, e.g. a batch writer during bulk enrollment
+    """
+    now = now or datetime.now(timezone.utc).isoformat()
+    item = {
+        'faceId': face_id,
+        'name': name,
+        'phoneNumber': phone_number,
+        'status': status,
+        'createdAt': now,
+        'updatedAt': now
+    }
+    if photo:
+        item.update({'latestPhoto': photo, 'photoCount': 1})
+    return item
+
+
+def photo_record(object_key: str, bucket: str, now: str = None, variants: dict = None) -> dict:
+    """
+    Photo attributes as stored in latestPhoto and the history
+    variants maps variant names (thumbnail, display) to their keys
+    """
+    record = {
+        'objectKey': object_key,
+        'bucket': bucket,
+        'createdTimestamp': now or datetime.now(timezone.utc).isoformat()
+    }
+    if variants:
+        record['variants'] = variants
+    return record
+
+
+def add_photo(table, face_id: str, photo: dict) -> dict:
+    """
+    Append a photo to a visitor's history with one PutItem and return the item.
+    photoAt is the photo's timestamp plus a random suffix, so photos sort by
+    time and two taken in the same instant do not overwrite each other.
+    """
+    item = {
+        **photo,
+        'faceId': face_id,
+        'photoAt': f"{photo['createdTimestamp']}#{secrets.token_hex(4)}"
+    }
+    table.put_item(Item=item)
+    return item
+
@@ -6,239 +6,709 @@ Handles both known and unknown visitor workflows
 
 import json
 import os
-import boto3
 import base64
-import random
-import string
+import functools
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 from decimal import Decimal
 from botocore.exceptions import ClientError
 
-# Initialize AWS clients
-dynamodb = boto3.resource('dynamodb')
-s3_client = boto3.client('s3')
-sns_client = boto3.client('sns')
-rekognition = boto3.client('rekognition')
-kvs_client = boto3.client('kinesisvideo')
+import mkv
+from common.clients import registry
+from common.cooldown import CooldownCache
+from common.digest import FLUSH_LATER, FLUSH_NOW, SEND_NOW, OwnerDigest, format_alerts
+from common.door_trace import OWNER, VISITOR, for_recipient, start_trace
+from common.face_collection import FaceCollections
+from common.metrics import metrics
+from common.otp import DEFAULT_DOOR_ID, allocate_otp, find_live_otp, revoke_otp
+from common.outbox import SmsOutbox
+from common.photo_variants import store_variants
+from common.visitor_cache import VisitorCache, VisitorChangeFeed
+from kvs_clients import KvsClientCache
+from records import decode_record
+from sessions import DetectionSessionStore, box_tuple, cluster_detections
+
+# AWS clients - each is created on first use
+dynamodb = registry.lazy_resource('dynamodb')
+s3_client = registry.lazy_client('s3')
+sns_client = registry.lazy_client('sns')
+kvs_client = registry.lazy_client('kinesisvideo')
+rekognition = registry.lazy_client('rekognition')
 
 # Environment variables
 VISITORS_TABLE = os.environ.get('VISITORS_TABLE', 'smartdoor-visitors-dev')
-PASSCODES_TABLE = os.environ.get('PASSCODES_TABLE', 'smartdoor-passcodes-dev')
+PASSCODES_TABLE = os.environ.get('PASSCODES_TABLE', 'smartdoor-passcodes-v2-dev')
 PHOTOS_BUCKET = os.environ.get('PHOTOS_BUCKET', 'smartdoor-visitor-photos')
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
 OWNER_PHONE = os.environ.get('OWNER_PHONE')
-COLLECTION_ID = os.environ.get('COLLECTION_ID', 'smartdoor-faces-dev')
+COLLECTION_ID = os.environ.get('COLLECTION_ID', 'smartdoor-faces-dev')  # Searched by the stream processor
+COLLECTION_SHARD_MAX_FACES = int(os.environ.get('COLLECTION_SHARD_MAX_FACES', '1000000'))
 KVS_STREAM_ARN = os.environ.get('KVS_STREAM_ARN')
 API_GATEWAY_URL = os.environ.get('API_GATEWAY_URL', '')
+COOLDOWN_TABLE = os.environ.get('COOLDOWN_TABLE', 'smartdoor-cooldowns-dev')
+SMS_QUEUE_URL = os.environ.get('SMS_QUEUE_URL')  # SMS outbox; unset sends directly
+
+# Door served by each KVS stream, as JSON keyed by stream name or ARN,
+# e.g. {"smartdoor-front-stream": "front"}; unlisted streams use the default door
+DOOR_STREAMS = json.loads(os.environ.get('DOOR_STREAMS') or '{}')
 
 # OTP Configuration
 OTP_LENGTH = 6
 OTP_TTL_SECONDS = 300  # 5 minutes
+# A visitor's live OTP is reused until it has less than this left
+OTP_REUSE_MIN_REMAINING_SECONDS = int(os.environ.get('OTP_REUSE_MIN_REMAINING_SECONDS', '60'))
+
+# Detection thresholds (percent)
+FACE_CONFIDENCE_THRESHOLD = float(os.environ.get('FACE_CONFIDENCE_THRESHOLD', '90'))
+FACE_SIMILARITY_THRESHOLD = float(os.environ.get('FACE_SIMILARITY_THRESHOLD', '80'))
+
+# Minimum gap between notifications for the same visitor
+VISITOR_COOLDOWN_SECONDS = int(os.environ.get('VISITOR_COOLDOWN_SECONDS', '60'))
+
+# Unknown-visitor alerts to the owner within this window (per door) are sent
+# as one digest, flushed after the window or at OWNER_DIGEST_MAX_EVENTS alerts;
+# 0 (or no SMS queue) sends every alert on its own
+OWNER_DIGEST_SECONDS = int(os.environ.get('OWNER_DIGEST_SECONDS', '30'))
+OWNER_DIGEST_MAX_EVENTS = int(os.environ.get('OWNER_DIGEST_MAX_EVENTS', '5'))
+
+# DynamoDB batch configuration
+BATCH_GET_MAX_KEYS = 100
+BATCH_MAX_ATTEMPTS = 5
+BATCH_RETRY_BASE_SECONDS = 0.05
+
+# Unmatched detections closer than this in time and overlapping at least
+# this much are treated as the same stranger
+UNKNOWN_SESSION_IDLE_SECONDS = int(os.environ.get('UNKNOWN_SESSION_IDLE_SECONDS', '30'))
+UNKNOWN_SESSION_MIN_IOU = float(os.environ.get('UNKNOWN_SESSION_MIN_IOU', '0.3'))
+
+# Visitor directory cache: with the visitors table's stream (NEW_IMAGE) it is
+# kept current by polling the stream every VISITOR_FEED_POLL_SECONDS, entries
+# live longer and households of up to VISITOR_SNAPSHOT_MAX_ITEMS visitors are
+# preloaded whole; without it, entries are re-read after a minute
+VISITORS_STREAM_ARN = os.environ.get('VISITORS_STREAM_ARN')
+VISITOR_CACHE_TTL_SECONDS = int(os.environ.get(
+    'VISITOR_CACHE_TTL_SECONDS', '21600' if VISITORS_STREAM_ARN else '60'
+))
+VISITOR_CACHE_MAX_ENTRIES = int(os.environ.get('VISITOR_CACHE_MAX_ENTRIES', '1000'))
+VISITOR_SNAPSHOT_MAX_ITEMS = int(os.environ.get(
+    'VISITOR_SNAPSHOT_MAX_ITEMS', '200' if VISITORS_STREAM_ARN else '0'
+))
+VISITOR_FEED_POLL_SECONDS = float(os.environ.get('VISITOR_FEED_POLL_SECONDS', '1'))
+
+# How long a discovered KVS data endpoint is trusted
+KVS_ENDPOINT_TTL_SECONDS = int(os.environ.get('KVS_ENDPOINT_TTL_SECONDS', '300'))
+
+# Upper bound on concurrent photo extractions and notification sends
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '8'))
+# Every worker may hold a connection to the same client at once
+registry.configure(max_pool_connections=MAX_WORKERS + 2)
 
 # Tables
-visitors_table = dynamodb.Table(VISITORS_TABLE)
-passcodes_table = dynamodb.Table(PASSCODES_TABLE)
+visitors_table = registry.lazy_table(VISITORS_TABLE)
+passcodes_table = registry.lazy_table(PASSCODES_TABLE)
+cooldowns_table = registry.lazy_table(COOLDOWN_TABLE)
+
+# Survives across warm invocations of this container
+visitor_cooldown = CooldownCache(cooldowns_table, VISITOR_COOLDOWN_SECONDS)
+kvs_media_clients = KvsClientCache(kvs_client, KVS_ENDPOINT_TTL_SECONDS, registry.client)
+unknown_sessions = DetectionSessionStore(
+    cooldowns_table, UNKNOWN_SESSION_IDLE_SECONDS, UNKNOWN_SESSION_MIN_IOU
+)
+sms_outbox = SmsOutbox(SMS_QUEUE_URL, registry.lazy_client('sqs'), sns_client)
+owner_digest = OwnerDigest(cooldowns_table, OWNER_DIGEST_SECONDS, OWNER_DIGEST_MAX_EVENTS)
+face_collections = FaceCollections(rekognition, COLLECTION_ID, COLLECTION_SHARD_MAX_FACES)
+visitor_cache = VisitorCache(
+    visitors_table,
+    VISITOR_CACHE_TTL_SECONDS,
+    VISITOR_CACHE_MAX_ENTRIES,
+    VisitorChangeFeed(
+        registry.lazy_client('dynamodbstreams'), VISITORS_STREAM_ARN, VISITOR_FEED_POLL_SECONDS
+    ) if VISITORS_STREAM_ARN else None,
+    VISITOR_SNAPSHOT_MAX_ITEMS
+)
 
 
+@metrics.handler
 def lambda_handler(event, context):
     """
     Main handler for Kinesis Data Stream events from Rekognition
+    Returns a partial batch response so only failed records are retried
+    Each stage and AWS call is timed by common.metrics
     """
+    received_at = time.time()  # Ends each detection's Kinesis queueing hop
     print(f"Received event with {len(event.get('Records', []))} records")
+    metrics.count('Records', len(event.get('Records', [])))
+    
+    failed_records = set()  # Sequence numbers to report back to Lambda
+    detections = []  # Every qualifying face in the batch, before any side effects
+    
+    with metrics.timer('decode'):
+        for index, record in enumerate(event.get('Records', [])):
+            try:
+                # Decode Kinesis record; frames without faces are skipped unparsed
+                data = decode_record(record, index)
+                if data is None:
+                    continue
+                
+                # Process face search response from Rekognition
+                detections.extend(extract_detections(data, record, received_at))
+                
+            except Exception as e:
+                # Malformed records would fail the same way on retry, so they
+                # are logged and skipped rather than reported as failures
+                print(f"Error processing record: {str(e)}")
+                metrics.count('MalformedRecords')
+                import traceback
+                traceback.print_exc()
+    
+    # Reduce: keep only the best detection per known face; unknown faces are
+    # reduced per cluster when they are grouped below
+    best_known, unknown_visitors = select_best_detections(detections)
+    metrics.count('Detections', len(detections))
     
-    processed_faces = set()  # Avoid processing same face multiple times
+    # Catch up on visitor changes while the cooldowns are claimed
+    if best_known:
+        visitor_cache.prefetch()
     
-    for record in event.get('Records', []):
+    known_visitors = []  # Winning detections that passed the cooldown check
+    with metrics.timer('cooldown'):
+        for detection in best_known:
+            face_id = detection['face_id']
+            if not visitor_cooldown.acquire(f"face#{face_id}"):
+                print(f"Visitor {face_id} notified recently, skipping")
+                metrics.count('CooldownSkips')
+                continue
+            print(f"Known visitor detected: {face_id} (similarity: {detection['similarity']})")
+            known_visitors.append(detection)
+    
+    # Resolve every known face in the batch from the visitor cache; faces it
+    # does not hold are read with a single BatchGetItem
+    visitors = {}
+    if known_visitors:
         try:
-            # Decode Kinesis record
-            payload = base64.b64decode(record['kinesis']['data'])
-            data = json.loads(payload)
-            
-            print(f"Processing record: {json.dumps(data, default=str)[:500]}")
-            
-            # Process face search response from Rekognition
-            if 'FaceSearchResponse' in data:
-                for face_search in data['FaceSearchResponse']:
-                    detected_face = face_search.get('DetectedFace', {})
-                    matched_faces = face_search.get('MatchedFaces', [])
-                    
-                    # Get fragment info for photo extraction
-                    fragment_number = data.get('InputInformation', {}).get(
-                        'KinesisVideo', {}
-                    ).get('FragmentNumber')
-                    
-                    # Check face confidence
-                    confidence = detected_face.get('Confidence', 0)
-                    if confidence < 90:
-                        print(f"Skipping low confidence face: {confidence}")
-                        continue
-                    
-                    if matched_faces:
-                        # KNOWN VISITOR WORKFLOW
-                        best_match = matched_faces[0]  # Highest similarity
-                        face_id = best_match['Face']['FaceId']
-                        similarity = best_match['Similarity']
-                        
-                        if face_id in processed_faces:
-                            continue
-                        processed_faces.add(face_id)
-                        
-                        if similarity >= 80:  # Similarity threshold
-                            print(f"Known visitor detected: {face_id} (similarity: {similarity})")
-                            handle_known_visitor(face_id)
-                    else:
-                        # UNKNOWN VISITOR WORKFLOW
-                        # Generate a temporary ID for this detection
-                        temp_id = f"unknown_{int(time.time() * 1000)}"
-                        
-                        if temp_id in processed_faces:
-                            continue
-                        processed_faces.add(temp_id)
-                        
-                        print(f"Unknown visitor detected")
-                        handle_unknown_visitor(
-                            detected_face,
-                            fragment_number,
-                            data.get('InputInformation', {})
-                        )
-                        
+            with metrics.timer('visitors'):
+                visitors = visitor_cache.get_many(
+                    [detection['face_id'] for detection in known_visitors], batch_get_visitors
+                )
+        except Exception as e:
+            print(f"Error fetching visitors: {str(e)}")
+            for detection in known_visitors:
+                failed_records.add(detection['sequence_number'])
+                visitor_cooldown.release(f"face#{detection['face_id']}")
+            known_visitors = []
+    
+    # One pending visitor per stranger: group this batch's unmatched
+    # detections, then attach each group to a live session or open one
+    pending_visitors = []
+    if unknown_visitors:
+        try:
+            with metrics.timer('group'):
+                pending_visitors = group_unknown_visitors(unknown_visitors)
+        except Exception as e:
+            print(f"Error grouping unknown visitors: {str(e)}")
+            failed_records.update(detection['sequence_number'] for detection in unknown_visitors)
+    
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        # Each OTP is allocated with its own conditional put, so known
+        # visitors are handled concurrently alongside photo extraction
+        known_results = [
+            (detection, pool.submit(
+                handle_known_visitor, detection['face_id'], visitors.get(detection['face_id']),
+                detection['door_id'], detection['trace']
+            ))
+            for detection in known_visitors
+        ]
+        
+        # Photo extraction (KVS GetMedia + S3 upload of the photo and its
+        # variants) runs concurrently, once per pending visitor from its
+        # highest-confidence frame
+        with metrics.timer('photos'):
+            photos = list(pool.map(
+                lambda pending: extract_and_upload_photo(
+                    pending['best']['fragment_number'],
+                    pending['best']['input_info'],
+                    pending['best']['detected_face'].get('BoundingBox')
+                ),
+                pending_visitors
+            ))
+        photo_keys = [photo_key for photo_key, _ in photos]
+        
+        # The stream processor only searches COLLECTION_ID, so strangers are
+        # looked up in the later collection shards from their cropped photo
+        with metrics.timer('overflow_search'):
+            overflow_matches = list(pool.map(find_in_overflow_shards, photo_keys))
+        
+        notifications = []  # (sequence_numbers, release callable or None, send callable)
+        for detection, future in known_results:
+            release = functools.partial(visitor_cooldown.release, f"face#{detection['face_id']}")
+            try:
+                for send in future.result():
+                    notifications.append(([detection['sequence_number']], release, send))
+            except Exception:
+                failed_records.add(detection['sequence_number'])
+                release()
+        
+        # Found in a shard: a known visitor after all; the unknown session
+        # stays open so their next detections are absorbed by it
+        unmatched = []
+        for pending, photo, face_id in zip(pending_visitors, photos, overflow_matches):
+            if face_id is None:
+                unmatched.append((pending, photo))
+                continue
+            if not visitor_cooldown.acquire(f"face#{face_id}"):
+                print(f"Visitor {face_id} notified recently, skipping")
+                metrics.count('CooldownSkips')
+                continue
+            print(f"Known visitor detected in a collection shard: {face_id}")
+            release = functools.partial(visitor_cooldown.release, f"face#{face_id}")
+            try:
+                visitor = visitor_cache.get_many([face_id], batch_get_visitors).get(face_id)
+                for send in handle_known_visitor(face_id, visitor, pending['best']['door_id'], pending['trace']):
+                    notifications.append((pending['sequence_numbers'], release, send))
+            except Exception:
+                failed_records.update(pending['sequence_numbers'])
+                release()
+        
+        # Pending-visitor writes are buffered and flushed together when the
+        # writer closes; owner notifications are only sent once they are stored
+        unknown_notifications = []
+        try:
+            with visitors_table.batch_writer() as visitor_writer:
+                for pending, (photo_key, variants) in unmatched:
+                    release = functools.partial(
+                        unknown_sessions.close, pending['stream_key'], pending['temp_face_id']
+                    )
+                    try:
+                        for send in handle_unknown_visitor(
+                            pending['temp_face_id'], pending['best']['detected_face'], photo_key,
+                            visitor_writer, pending['best']['door_id'], variants, pending['trace']
+                        ):
+                            unknown_notifications.append((pending['sequence_numbers'], release, send))
+                    except Exception:
+                        failed_records.update(pending['sequence_numbers'])
+                        release()
         except Exception as e:
-            print(f"Error processing record: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            print(f"Error flushing batched writes: {str(e)}")
+            for sequence_numbers, release, _ in unknown_notifications:
+                failed_records.update(sequence_numbers)
+                release()
+            unknown_notifications = []
+        notifications.extend(unknown_notifications)
+        
+        # SMS and topic publishes also run concurrently, with errors
+        # attributed to the records that produced them
+        with metrics.timer('notify'):
+            futures = {
+                pool.submit(send): (sequence_numbers, release)
+                for sequence_numbers, release, send in notifications
+            }
+            for future in as_completed(futures):
+                sequence_numbers, release = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Error sending notification: {str(e)}")
+                    failed_records.update(sequence_numbers)
+                    release()
+        metrics.count('Notifications', len(notifications))
+    
+    failed_records.discard(None)
+    metrics.count('KnownVisitors', len(known_visitors))
+    metrics.count('UnknownVisitors', len(pending_visitors))
+    metrics.count('FailedRecords', len(failed_records))
+    print(
+        f"Processed {len(detections)} detections into {len(known_visitors)} known "
+        f"and {len(pending_visitors)} new unknown visitors, {len(failed_records)} records failed"
+    )
     
     return {
-        'statusCode': 200,
-        'body': json.dumps({
-            'message': f'Processed {len(event.get("Records", []))} records',
-            'faces_processed': len(processed_faces)
-        })
+        'batchItemFailures': [
+            {'itemIdentifier': sequence_number}
+            for sequence_number in sorted(failed_records, key=int)
+        ]
     }
 
 
-def handle_known_visitor(face_id: str):
+def detection_time(input_info: dict, record: dict) -> float:
     """
-    Handle known visitor: Generate OTP and send SMS
+    Epoch seconds at which the camera captured the detected frame
+    Falls back to the Kinesis arrival time, then to now
     """
-    try:
-        # Get visitor info from DynamoDB
-        response = visitors_table.get_item(Key={'faceId': face_id})
+    kinesis_video = input_info.get('KinesisVideo', {})
+    producer_timestamp = kinesis_video.get('ProducerTimestamp')
+    if producer_timestamp is not None:
+        return float(producer_timestamp) + float(kinesis_video.get('FrameOffsetInSeconds', 0))
+    arrival = record.get('kinesis', {}).get('approximateArrivalTimestamp')
+    return float(arrival) if arrival is not None else time.time()
+
+
+def extract_detections(data: dict, record: dict, received_at: float = None) -> list:
+    """
+    Flatten a Rekognition record into one detection per qualifying face
+    Known faces carry their best match; unknown faces have face_id None.
+    Each carries the trace of its door-to-SMS latency (common.door_trace)
+    """
+    detections = []
+    input_info = data.get('InputInformation', {})
+    
+    # Get fragment info for photo extraction
+    fragment_number = input_info.get('KinesisVideo', {}).get('FragmentNumber')
+    door_id = door_for_stream(input_info.get('KinesisVideo', {}).get('StreamArn') or KVS_STREAM_ARN)
+    
+    for face_search in data.get('FaceSearchResponse', []):
+        detected_face = face_search.get('DetectedFace', {})
+        matched_faces = face_search.get('MatchedFaces', [])
+        
+        # Check face confidence
+        confidence = detected_face.get('Confidence', 0)
+        if confidence < FACE_CONFIDENCE_THRESHOLD:
+            print(f"Skipping low confidence face: {confidence}")
+            continue
+        
+        face_id = None
+        similarity = None
+        if matched_faces:
+            best_match = max(matched_faces, key=lambda match: match.get('Similarity', 0))
+            similarity = best_match.get('Similarity', 0)
+            if similarity < FACE_SIMILARITY_THRESHOLD:
+                print(f"Skipping weak match: {similarity}")
+                continue
+            face_id = best_match['Face']['FaceId']
+        
+        detections.append({
+            'sequence_number': record.get('kinesis', {}).get('sequenceNumber'),
+            'detected_face': detected_face,
+            'face_id': face_id,
+            'similarity': similarity,
+            'score': detection_score(confidence, similarity),
+            'fragment_number': fragment_number,
+            'input_info': input_info,
+            'door_id': door_id,
+            'seen_at': detection_time(input_info, record),
+            'trace': start_trace(input_info, record, received_at or time.time())
+        })
+    
+    return detections
+
+
+def door_for_stream(stream_arn: str) -> str:
+    """
+    Door ID for a KVS stream, looked up by ARN or stream name in DOOR_STREAMS
+    """
+    if not stream_arn:
+        return DEFAULT_DOOR_ID
+    stream_name = stream_arn.split(':stream/', 1)[-1].split('/', 1)[0]
+    return DOOR_STREAMS.get(stream_arn) or DOOR_STREAMS.get(stream_name) or DEFAULT_DOOR_ID
+
+
+def detection_score(confidence: float, similarity: float = None) -> float:
+    """
+    Rank detections: face confidence weighted by match similarity when known
+    """
+    score = float(confidence) / 100
+    if similarity is not None:
+        score *= float(similarity) / 100
+    return score
+
+
+def select_best_detections(detections: list) -> tuple:
+    """
+    Keep the highest-scoring detection per known face ID
+    Returns (best known detections, unknown detections)
+    A visitor's wait is traced from their first detection in the batch,
+    so the best one takes over that detection's trace
+    """
+    best_known = {}
+    first_seen = {}
+    unknown = []
+    for detection in detections:
+        face_id = detection['face_id']
+        if face_id is None:
+            unknown.append(detection)
+            print("Unknown visitor detected")
+            continue
+        if face_id not in best_known or detection['score'] > best_known[face_id]['score']:
+            best_known[face_id] = detection
+        if face_id not in first_seen or detection['seen_at'] < first_seen[face_id]['seen_at']:
+            first_seen[face_id] = detection
+    for face_id, detection in best_known.items():
+        detection['trace'] = first_seen[face_id]['trace']
+    return list(best_known.values()), unknown
+
+
+def group_unknown_visitors(unknown_visitors: list) -> list:
+    """
+    Group unmatched detections by stream, time proximity and bounding-box
+    overlap, then attach each group to a detection session
+    Returns one dict per group that opened a new session, with the group's
+    highest-scoring detection as 'best'
+    """
+    stream_keys = [
+        detection['input_info'].get('KinesisVideo', {}).get('StreamArn') or KVS_STREAM_ARN or 'default'
+        for detection in unknown_visitors
+    ]
+    boxes = [box_tuple(detection['detected_face'].get('BoundingBox')) for detection in unknown_visitors]
+    groups = cluster_detections(
+        [detection['seen_at'] for detection in unknown_visitors],
+        boxes,
+        stream_keys,
+        UNKNOWN_SESSION_IDLE_SECONDS,
+        UNKNOWN_SESSION_MIN_IOU
+    )
+    
+    pending_visitors = []
+    for index, members in enumerate(groups):
+        best = max(members, key=lambda i: unknown_visitors[i]['score'])
+        new_id = f"pending_{int(time.time() * 1000)}_{index}"
+        temp_face_id, is_new = unknown_sessions.assign(
+            stream_keys[best],
+            boxes[best],
+            max(unknown_visitors[i]['seen_at'] for i in members),
+            new_id
+        )
+        
+        if not is_new:
+            print(f"{len(members)} detections belong to pending visitor {temp_face_id}, skipping")
+            continue
+        
+        print(f"New unknown visitor {temp_face_id} from {len(members)} detections")
+        pending_visitors.append({
+            'temp_face_id': temp_face_id,
+            'stream_key': stream_keys[best],
+            'best': unknown_visitors[best],
+            # The stranger's wait started at the group's first detection
+            'trace': min((unknown_visitors[i] for i in members), key=lambda d: d['seen_at'])['trace'],
+            'sequence_numbers': sorted(
+                {unknown_visitors[i]['sequence_number'] for i in members} - {None}, key=int
+            )
+        })
+    
+    return pending_visitors
+
+
+def batch_get_visitors(face_ids: list) -> dict:
+    """
+    Fetch visitor records for many face IDs with BatchGetItem
+    Retries unprocessed keys with exponential backoff
+    Returns a dict of faceId -> visitor item
+    """
+    visitors = {}
+    unique_ids = list(dict.fromkeys(face_ids))
+    
+    # BatchGetItem accepts at most 100 keys per request
+    for i in range(0, len(unique_ids), BATCH_GET_MAX_KEYS):
+        request = {
+            VISITORS_TABLE: {
+                'Keys': [{'faceId': face_id} for face_id in unique_ids[i:i + BATCH_GET_MAX_KEYS]],
+                'ProjectionExpression': 'faceId, #name, phoneNumber',
+                'ExpressionAttributeNames': {'#name': 'name'}
+            }
+        }
         
-        if 'Item' not in response:
+        for attempt in range(BATCH_MAX_ATTEMPTS):
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(VISITORS_TABLE, []):
+                visitors[item['faceId']] = item
+            
+            request = response.get('UnprocessedKeys') or {}
+            if not request:
+                break
+            time.sleep(min(BATCH_RETRY_BASE_SECONDS * (2 ** attempt), 1.0))
+        else:
+            unprocessed = len(request.get(VISITORS_TABLE, {}).get('Keys', []))
+            print(f"Gave up on {unprocessed} unprocessed visitor keys")
+    
+    return visitors
+
+
+def find_in_overflow_shards(photo_key: str) -> str:
+    """
+    Search the collection shards after COLLECTION_ID for an unmatched face
+    Returns the FaceId of the best match, or None
+    """
+    if not photo_key:
+        return None
+    try:
+        matches = face_collections.search(
+            {'S3Object': {'Bucket': PHOTOS_BUCKET, 'Name': photo_key}},
+            threshold=FACE_SIMILARITY_THRESHOLD,
+            exclude=(COLLECTION_ID,)
+        )
+    except Exception as e:
+        print(f"Error searching collection shards: {str(e)}")
+        return None
+    if not matches:
+        return None
+    print(f"Matched {matches[0]['Face']['FaceId']} in {matches[0]['CollectionId']} "
+          f"(similarity: {matches[0]['Similarity']})")
+    return matches[0]['Face']['FaceId']
+
+
+def handle_known_visitor(face_id: str, visitor: dict, door_id: str = DEFAULT_DOOR_ID,
+                         trace: dict = None) -> list:
+    """
+    Handle known visitor: Allocate OTP and queue SMS
+    A visitor who still holds a live OTP for the door keeps it and gets no new SMS
+    Returns the notifications to send; the OTP is already stored
+    """
+    try:
+        if not visitor:
             print(f"Face ID {face_id} not found in visitors table")
-            return
+            return []
         
-        visitor = response['Item']
         name = visitor.get('name', 'Visitor')
         phone_number = visitor.get('phoneNumber')
         
         if not phone_number:
             print(f"No phone number for visitor {name}")
-            return
+            return []
         
-        # Generate and store OTP
-        otp = generate_otp()
-        store_otp(otp, face_id, name)
+        # Reuse the visitor's live OTP unless it is about to expire
+        live = find_visitor_otp(face_id, door_id)
+        if live:
+            print(f"Reusing OTP for {name} at door {door_id}, valid until {live['ttl']}")
+            return []
+        
+        # Allocate and store a unique OTP for the door the visitor is at
+        otp = store_otp(face_id, name, door_id)
         
         # Send SMS to visitor
         message = f"Hello {name}! Your Smart Door access code is: {otp}\nThis code expires in 5 minutes."
-        send_sms(phone_number, message)
+        print(f"OTP queued for known visitor {name} at {phone_number}")
         
-        print(f"OTP sent to known visitor {name} at {phone_number}")
+        return [functools.partial(
+            send_otp_sms, phone_number, message, door_id, otp, for_recipient(trace, VISITOR)
+        )]
         
     except Exception as e:
         print(f"Error handling known visitor: {str(e)}")
         raise
 
 
-def handle_unknown_visitor(detected_face: dict, fragment_number: str, input_info: dict):
+def handle_unknown_visitor(temp_face_id: str, detected_face: dict, photo_key: str,
+                           visitor_writer=None, door_id: str = DEFAULT_DOOR_ID,
+                           variants: dict = None, trace: dict = None) -> list:
     """
-    Handle unknown visitor: Extract photo, notify owner
+    Handle unknown visitor: Store pending record, queue owner notifications
+    The photo is extracted beforehand so extraction can run concurrently;
+    alerts link to its thumbnail and display variants when they were stored
+    Returns the notifications to send once the pending record is flushed
     """
+    variants = variants or {}
     try:
-        # Extract and upload photo from video fragment
-        photo_key = extract_and_upload_photo(fragment_number, input_info)
-        
         if not photo_key:
             print("Failed to extract photo from video")
             # Fall back to placeholder
             photo_key = f"unknown/placeholder_{int(time.time())}.jpg"
         
-        # Generate temporary face ID for tracking
-        temp_face_id = f"pending_{int(time.time() * 1000)}"
-        
-        # Create approval link
-        approval_link = f"{API_GATEWAY_URL}/wp1?faceId={temp_face_id}&photo={photo_key}"
+        # Create approval link; WP1 shows the thumbnail and LF2 maps it back to the photo
+        approval_photo = variants.get('thumbnail', photo_key)
+        approval_link = f"{API_GATEWAY_URL}/wp1?faceId={temp_face_id}&photo={approval_photo}&door={door_id}"
         
         # Store pending visitor info (optional - for tracking)
-        store_pending_visitor(temp_face_id, photo_key, detected_face)
-        
-        # Notify owner via SMS
-        message = (
-            f"🚪 Smart Door Alert!\n"
-            f"An unknown visitor is at your door.\n"
-            f"Approve access: {approval_link}"
-        )
-        
-        if OWNER_PHONE:
-            send_sms(OWNER_PHONE, message)
+        store_pending_visitor(temp_face_id, photo_key, detected_face, visitor_writer, door_id, variants)
         
-        # Also send email via SNS topic
-        if SNS_TOPIC_ARN:
-            sns_client.publish(
-                TopicArn=SNS_TOPIC_ARN,
-                Subject="Smart Door: Unknown Visitor",
-                Message=f"An unknown visitor is at your door.\n\nApprove access: {approval_link}\n\nPhoto: https://{PHOTOS_BUCKET}.s3.amazonaws.com/{photo_key}"
-            )
+        alert = {
+            'approvalLink': approval_link,
+            'photoUrl': f"https://{PHOTOS_BUCKET}.s3.amazonaws.com/{variants.get('display', photo_key)}",
+            'detectedAt': datetime.now(timezone.utc).isoformat()
+        }
+        print(f"Owner notification queued for unknown visitor. Approval link: {approval_link}")
         
-        print(f"Owner notified about unknown visitor. Approval link: {approval_link}")
+        # Bursts of alerts are coalesced into digests (flushed by the SMS dispatcher)
+        trace = for_recipient(trace, OWNER)
+        if OWNER_DIGEST_SECONDS > 0 and SMS_QUEUE_URL and (OWNER_PHONE or SNS_TOPIC_ARN):
+            return [functools.partial(notify_owner, temp_face_id, alert, door_id, trace)]
+        return owner_notifications([alert], door_id, trace)
         
     except Exception as e:
         print(f"Error handling unknown visitor: {str(e)}")
         raise
 
 
-def extract_and_upload_photo(fragment_number: str, input_info: dict) -> str:
+def owner_notifications(alerts: list, door_id: str, trace: dict = None) -> list:
+    """
+    Owner SMS and topic email for one or more alerts
+    trace follows the SMS of a single alert
+    """
+    sms, subject, email = format_alerts(alerts, door_id)
+    notifications = []
+    
+    # Notify owner via SMS
+    if OWNER_PHONE:
+        notifications.append(functools.partial(send_sms, OWNER_PHONE, sms, None, trace))
+    
+    # Also send email via SNS topic
+    if SNS_TOPIC_ARN:
+        notifications.append(functools.partial(sms_outbox.send_topic, SNS_TOPIC_ARN, subject, email))
+    
+    return notifications
+
+
+def notify_owner(temp_face_id: str, alert: dict, door_id: str = DEFAULT_DOOR_ID, trace: dict = None):
+    """
+    Send an alert at once if the owner has had none for this door within
+    the digest window; otherwise add it to the door's digest
+    The alert is keyed by the pending visitor, so a retried record that
+    adds it again only schedules the flush again
+    Digested alerts wait by design, so only alerts sent at once are traced
     """
-    Extract a frame from the video stream and upload to S3
+    digest_key = f"{OWNER_PHONE or SNS_TOPIC_ARN}#{door_id}"
+    action, window_id = owner_digest.add(digest_key, temp_face_id, alert)
+    if action == SEND_NOW:
+        for send in owner_notifications([alert], door_id, trace):
+            send()
+    elif action in (FLUSH_LATER, FLUSH_NOW):
+        delay = OWNER_DIGEST_SECONDS if action == FLUSH_LATER else 0
+        sms_outbox.schedule_digest(digest_key, window_id, door_id, delay, OWNER_PHONE, SNS_TOPIC_ARN)
+    print(f"Owner alert for door {door_id}: {action}")
+
+
+def extract_and_upload_photo(fragment_number: str, input_info: dict, bounding_box: dict = None) -> tuple:
+    """
+    Extract the first keyframe of the detection's fragment, crop it to the
+    face and upload it to S3 as a JPEG, along with its thumbnail and display variants
+    Returns (photo_key, {variant: key}), or (None, {}) without a photo
     """
     try:
         if not fragment_number or not KVS_STREAM_ARN:
             print("Missing fragment number or stream ARN")
-            return None
-        
-        # Get the stream name from ARN
-        stream_name = KVS_STREAM_ARN.split('/')[-1]
+            return None, {}
         
-        # Get data endpoint for GetMedia
-        endpoint_response = kvs_client.get_data_endpoint(
+        # Fetch exactly the fragment Rekognition reported the face in;
+        # the data endpoint and client are reused across warm invocations
+        media_response = kvs_media_clients.call(
+            KVS_STREAM_ARN,
+            'GET_MEDIA_FOR_FRAGMENT_LIST',
+            'get_media_for_fragment_list',
             StreamARN=KVS_STREAM_ARN,
-            APIName='GET_MEDIA'
+            Fragments=[fragment_number]
         )
-        endpoint = endpoint_response['DataEndpoint']
         
-        # Create client with specific endpoint
-        kvs_media_client = boto3.client(
-            'kinesis-video-media',
-            endpoint_url=endpoint
-        )
+        # Parse the payload incrementally, stopping at the first keyframe
+        payload = media_response['Payload']
+        try:
+            with metrics.timer('photo.keyframe'):
+                keyframe = mkv.read_first_keyframe(payload, fragment_number)
+        finally:
+            payload.close()
         
-        # Get media starting from the fragment
-        media_response = kvs_media_client.get_media(
-            StreamARN=KVS_STREAM_ARN,
-            StartSelector={
-                'StartSelectorType': 'FRAGMENT_NUMBER',
-                'AfterFragmentNumber': fragment_number
-            }
+        if not keyframe:
+            print(f"No keyframe found in fragment {fragment_number}")
+            return None, {}
+        
+        print(
+            f"Keyframe found after {keyframe.bytes_read} bytes "
+            f"in {keyframe.elapsed_ms:.1f} ms ({keyframe.codec_id})"
         )
         
-        # Read stream and extract first frame
-        # Note: This is simplified - in production you'd use a proper video decoder
-        stream_data = media_response['Payload'].read(1024 * 1024)  # Read 1MB
+        with metrics.timer('photo.jpeg'):
+            photo = mkv.keyframe_to_jpeg(keyframe, bounding_box)
+        if not photo:
+            print(f"Could not encode {keyframe.codec_id} keyframe as JPEG")
+            return None, {}
         
-        # For demo purposes, we'll save the raw fragment data
-        # In production, use OpenCV or FFmpeg to extract actual JPEG frame
         timestamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
         photo_key = f"visitors/{timestamp}_{fragment_number[:8]}.jpg"
         
@@ -246,55 +716,70 @@ def extract_and_upload_photo(fragment_number: str, input_info: dict) -> str:
         s3_client.put_object(
             Bucket=PHOTOS_BUCKET,
             Key=photo_key,
-            Body=stream_data,
+            Body=photo,
             ContentType='image/jpeg'
         )
         
         print(f"Photo uploaded to s3://{PHOTOS_BUCKET}/{photo_key}")
-        return photo_key
+        
+        # Small re-encoded copies for the approval page and alerts
+        with metrics.timer('photo.variants'):
+            variants = store_variants(s3_client, PHOTOS_BUCKET, photo_key, photo)
+        return photo_key, variants
         
     except Exception as e:
         print(f"Error extracting photo: {str(e)}")
-        return None
+        return None, {}
 
 
-def generate_otp() -> str:
+def store_otp(face_id: str, visitor_name: str, door_id: str = DEFAULT_DOOR_ID) -> str:
     """
-    Generate a random 6-digit OTP
+    Store a new OTP for a door in DynamoDB with TTL and return it
+    The code is drawn from a CSPRNG and never collides with a live OTP of that door
     """
-    return ''.join(random.choices(string.digits, k=OTP_LENGTH))
+    otp = allocate_otp(
+        passcodes_table,
+        door_id,
+        {
+            'faceId': face_id,
+            'visitorName': visitor_name,
+            'createdAt': datetime.now(timezone.utc).isoformat()
+        },
+        OTP_TTL_SECONDS,
+        length=OTP_LENGTH
+    )
+    print(f"OTP {otp} stored for door {door_id}, expires in {OTP_TTL_SECONDS}s")
+    return otp
 
 
-def store_otp(otp: str, face_id: str, visitor_name: str):
+def find_visitor_otp(face_id: str, door_id: str = DEFAULT_DOOR_ID):
     """
-    Store OTP in DynamoDB with TTL
+    Look up a live OTP of the visitor for the door with enough time left to reuse
+    Lookup errors fall back to issuing a new OTP
     """
-    ttl = int(time.time()) + OTP_TTL_SECONDS
-    
-    passcodes_table.put_item(
-        Item={
-            'otp': otp,
-            'faceId': face_id,
-            'visitorName': visitor_name,
-            'createdAt': datetime.now(timezone.utc).isoformat(),
-            'ttl': ttl
-        }
-    )
-    print(f"OTP {otp} stored with TTL {ttl}")
+    try:
+        return find_live_otp(passcodes_table, face_id, door_id, OTP_REUSE_MIN_REMAINING_SECONDS)
+    except Exception as e:
+        print(f"Error looking up live OTP for {face_id}: {str(e)}")
+        return None
 
 
-def store_pending_visitor(temp_face_id: str, photo_key: str, detected_face: dict):
+def store_pending_visitor(temp_face_id: str, photo_key: str, detected_face: dict, writer=None,
+                          door_id: str = DEFAULT_DOOR_ID, variants: dict = None):
     """
     Store pending visitor info for approval workflow
+    Goes through the batch writer when one is given
     """
     try:
-        visitors_table.put_item(
+        (writer or visitors_table).put_item(
             Item={
                 'faceId': temp_face_id,
                 'status': 'pending',
                 'photoKey': photo_key,
                 'photoBucket': PHOTOS_BUCKET,
+                'photoVariants': variants or {},
                 'boundingBox': json.dumps(detected_face.get('BoundingBox', {})),
+                'doorId': door_id,
                 'createdAt': datetime.now(timezone.utc).isoformat()
             }
         )
@@ -302,25 +787,32 @@ def store_pending_visitor(temp_face_id: str, photo_key: str, detected_face: dict
         print(f"Error storing pending visitor: {str(e)}")
 
 
-def send_sms(phone_number: str, message: str):
+def send_sms(phone_number: str, message: str, passcode: dict = None, trace: dict = None):
     """
-    Send SMS using SNS
+    Queue an SMS on the outbox; the SMS dispatcher (LF4) publishes it
     """
     try:
-        response = sns_client.publish(
-            PhoneNumber=phone_number,
-            Message=message,
-            MessageAttributes={
-                'AWS.SNS.SMS.SMSType': {
-                    'DataType': 'String',
-                    'StringValue': 'Transactional'
-                }
-            }
-        )
-        print(f"SMS sent to {phone_number}: MessageId={response['MessageId']}")
-        return response
+        message_id = sms_outbox.send(phone_number, message, passcode, trace)
+        print(f"SMS queued for {phone_number}: MessageId={message_id}")
+        return message_id
     except Exception as e:
-        print(f"Error sending SMS to {phone_number}: {str(e)}")
+        print(f"Error queueing SMS to {phone_number}: {str(e)}")
+        raise
+
+
+def send_otp_sms(phone_number: str, message: str, door_id: str, otp: str, trace: dict = None):
+    """
+    Send an OTP by SMS; an OTP that cannot be queued is revoked so the retried
+    detection issues a fresh one instead of reusing a code nobody received
+    (the dispatcher does the same for SMS that SNS rejects)
+    """
+    try:
+        return send_sms(phone_number, message, {'doorId': door_id, 'otp': otp}, trace)
+    except Exception:
+        try:
+            revoke_otp(passcodes_table, door_id, otp)
+        except Exception as e:
+            print(f"Error revoking undelivered OTP: {str(e)}")
         raise
 
 
@@ -0,0 +1,90 @@
+"""
+Kinesis Video Streams data-plane client cache for LF1
+Keeps discovered data endpoints and the clients built for them alive across
+warm invocations, keyed by stream ARN and API name
+"""
+
+import threading
+import time
+from botocore.exceptions import ConnectionError as EndpointError
+
+# Data-plane service that serves each GetDataEndpoint API name
+API_SERVICES = {
+    'GET_MEDIA': 'kinesis-video-media',
+    'PUT_MEDIA': 'kinesis-video-media',
+    'GET_MEDIA_FOR_FRAGMENT_LIST': 'kinesis-video-archived-media',
+    'LIST_FRAGMENTS': 'kinesis-video-archived-media',
+    'GET_HLS_STREAMING_SESSION_URL': 'kinesis-video-archived-media',
+    'GET_DASH_STREAMING_SESSION_URL': 'kinesis-video-archived-media',
+    'GET_CLIP': 'kinesis-video-archived-media',
+    'GET_IMAGES': 'kinesis-video-archived-media'
+}
+
+
+class KvsClientCache:
+    """
+    Caches GetDataEndpoint results for ttl_seconds and one client per endpoint.
+    Entries are dropped when a call through them fails with an endpoint error.
+    """
+
+    def __init__(self, kvs_client, ttl_seconds: int, client_factory):
+        self.kvs_client = kvs_client
+        self.ttl_seconds = ttl_seconds
+        self.client_factory = client_factory
+        self._endpoints = {}  # (stream_arn, api_name) -> (endpoint, expires_at)
+        self._clients = {}  # (service, endpoint) -> client
+        self._lock = threading.Lock()
+
+    def get_client(self, stream_arn: str, api_name: str):
+        """
+        Return a data-plane client for the stream and API, discovering the
+        endpoint only when it is not cached or has expired
+        """
+        service = API_SERVICES[api_name]
+        key = (stream_arn, api_name)
+        now = time.monotonic()
+
+        with self._lock:
+            cached = self._endpoints.get(key)
+            if cached and cached[1] > now:
+                client = self._clients.get((service, cached[0]))
+                if client is not None:
+                    return client
+
+        # Discovery happens outside the lock so a slow call does not block
+        # lookups for other streams; a racing duplicate is harmless
+        endpoint = self.kvs_client.get_data_endpoint(
+            StreamARN=stream_arn,
+            APIName=api_name
+        )['DataEndpoint']
+
+        with self._lock:
+            self._endpoints[key] = (endpoint, now + self.ttl_seconds)
+            client = self._clients.get((service, endpoint))
+            if client is None:
+                client = self.client_factory(service, endpoint_url=endpoint)
+                self._clients[(service, endpoint)] = client
+            return client
+
+    def invalidate(self, stream_arn: str, api_name: str):
+        """
+        Forget the endpoint and client for a stream and API
+        """
+        with self._lock:
+            cached = self._endpoints.pop((stream_arn, api_name), None)
+            if cached:
+                self._clients.pop((API_SERVICES[api_name], cached[0]), None)
+
+    def call(self, stream_arn: str, api_name: str, operation: str, **kwargs):
+        """
+        Call a data-plane operation, rediscovering the endpoint and retrying
+        once if the cached endpoint cannot be reached
+        """
+        client = self.get_client(stream_arn, api_name)
+        try:
+            return getattr(client, operation)(**kwargs)
+        except EndpointError as e:
+            print(f"Endpoint error for {api_name}, refreshing endpoint: {str(e)}")
+            self.invalidate(stream_arn, api_name)
+            client = self.get_client(stream_arn, api_name)
+            return getattr(client, operation)(**kwargs)
@@ -0,0 +1,360 @@
+"""
+Streaming Matroska (MKV) keyframe extractor for KVS media payloads
+Reads the EBML stream incrementally and stops at the first video keyframe,
+then encodes that frame as a JPEG cropped to a Rekognition BoundingBox
+"""
+
+import io
+import time
+from collections import namedtuple
+
+# EBML / Matroska element IDs (marker bits included)
+EBML_HEADER = 0x1A45DFA3
+SEGMENT = 0x18538067
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+CODEC_PRIVATE = 0x63A2
+VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+CLUSTER = 0x1F43B675
+CLUSTER_TIMECODE = 0xE7
+SIMPLE_BLOCK = 0xA3
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+REFERENCE_BLOCK = 0xFB
+TAGS = 0x1254C367
+TAG = 0x7373
+SIMPLE_TAG = 0x67C8
+TAG_NAME = 0x45A3
+TAG_STRING = 0x4487
+
+# Masters whose children are walked in place instead of being skipped
+MASTER_IDS = {SEGMENT, TRACKS, TRACK_ENTRY, VIDEO, CLUSTER, TAGS, TAG, SIMPLE_TAG}
+
+TRACK_TYPE_VIDEO = 1
+FRAGMENT_NUMBER_TAG = 'AWS_KINESISVIDEO_FRAGMENT_NUMBER'
+
+# Decoders for the codecs KVS producers commonly send
+PYAV_CODECS = {
+    'V_MPEG4/ISO/AVC': 'h264',
+    'V_MPEGH/ISO/HEVC': 'hevc'
+}
+MJPEG_CODEC = 'V_MJPEG'
+
+READ_CHUNK_SIZE = 16 * 1024
+MAX_ELEMENT_SIZE = 16 * 1024 * 1024  # Refuse to buffer anything larger
+CROP_MARGIN = 0.25  # Fraction of the face box added on each side
+JPEG_QUALITY = 85
+
+Keyframe = namedtuple('Keyframe', [
+    'codec_id', 'codec_private', 'width', 'height',
+    'data', 'fragment_number', 'timecode', 'bytes_read', 'elapsed_ms'
+])
+
+
+class _StreamReader:
+    """
+    Minimal buffered reader over a non-seekable stream (e.g. botocore StreamingBody)
+    Tracks how many bytes were pulled from the underlying stream
+    """
+
+    def __init__(self, stream, chunk_size: int = READ_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.bytes_read = 0
+
+    def _fill(self, n: int) -> bool:
+        while len(self.buffer) < n:
+            chunk = self.stream.read(max(self.chunk_size, n - len(self.buffer)))
+            if not chunk:
+                return False
+            self.bytes_read += len(chunk)
+            self.buffer += chunk
+        return True
+
+    def read(self, n: int) -> bytes:
+        if not self._fill(n):
+            raise EOFError('Unexpected end of MKV stream')
+        data = bytes(self.buffer[:n])
+        del self.buffer[:n]
+        return data
+
+    def skip(self, n: int):
+        while n > 0:
+            if not self.buffer and not self._fill(1):
+                raise EOFError('Unexpected end of MKV stream')
+            step = min(n, len(self.buffer))
+            del self.buffer[:step]
+            n -= step
+
+    def at_eof(self) -> bool:
+        return not self._fill(1)
+
+
+def _read_vint(reader: _StreamReader, keep_marker: bool):
+    """
+    Read an EBML variable-length integer
+    Returns (value, length); value is None for the reserved "unknown size"
+    """
+    first = reader.read(1)[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError('Invalid EBML variable-length integer')
+
+    value = first if keep_marker else first & (mask - 1)
+    all_ones = (first & (mask - 1)) == mask - 1
+    for byte in reader.read(length - 1):
+        value = (value << 8) | byte
+        all_ones = all_ones and byte == 0xFF
+
+    if not keep_marker and all_ones:
+        return None, length
+    return value, length
+
+
+def _read_uint(data: bytes) -> int:
+    return int.from_bytes(data, 'big') if data else 0
+
+
+def _parse_block_header(data: bytes):
+    """
+    Parse the track number, relative timecode and flags of a (Simple)Block
+    Returns (track_number, timecode, flags, header_length)
+    """
+    first = data[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    track_number = first & (mask - 1)
+    for byte in data[1:length]:
+        track_number = (track_number << 8) | byte
+    timecode = int.from_bytes(data[length:length + 2], 'big', signed=True)
+    flags = data[length + 2]
+    return track_number, timecode, flags, length + 3
+
+
+def _parse_block_group(data: bytes):
+    """
+    Split an in-memory BlockGroup into its Block payload and keyframe flag
+    A Block without a ReferenceBlock sibling is a keyframe
+    """
+    reader = _StreamReader(io.BytesIO(data))
+    block = None
+    is_keyframe = True
+    while not reader.at_eof():
+        element_id, _ = _read_vint(reader, keep_marker=True)
+        size, _ = _read_vint(reader, keep_marker=False)
+        payload = reader.read(size)
+        if element_id == BLOCK:
+            block = payload
+        elif element_id == REFERENCE_BLOCK:
+            is_keyframe = False
+    return block, is_keyframe
+
+
+def read_first_keyframe(stream, fragment_number: str = None, chunk_size: int = READ_CHUNK_SIZE):
+    """
+    Read an MKV stream until the first video keyframe and return it as a Keyframe
+    If fragment_number is given, fragments tagged with a different KVS
+    fragment number are skipped. Returns None if no keyframe is found.
+    """
+    started = time.perf_counter()
+    reader = _StreamReader(stream, chunk_size)
+
+    tracks = {}
+    current_track = None
+    current_fragment = None
+    pending_tag_name = None
+    cluster_timecode = 0
+
+    while not reader.at_eof():
+        element_id, _ = _read_vint(reader, keep_marker=True)
+        size, _ = _read_vint(reader, keep_marker=False)
+
+        if element_id in MASTER_IDS:
+            if element_id == SEGMENT:
+                tracks = {}
+                current_fragment = None
+            elif element_id == TRACK_ENTRY:
+                current_track = {}
+            elif element_id == CLUSTER:
+                cluster_timecode = 0
+            continue
+
+        if size is None:
+            raise ValueError(f'Unknown-size element 0x{element_id:X} is not supported')
+        if size > MAX_ELEMENT_SIZE:
+            raise ValueError(f'Element 0x{element_id:X} too large: {size} bytes')
+
+        if element_id == EBML_HEADER:
+            # A new fragment starts with its own EBML header
+            reader.skip(size)
+            tracks = {}
+            current_fragment = None
+
+        elif current_track is not None and element_id in (
+            TRACK_NUMBER, TRACK_TYPE, CODEC_ID, CODEC_PRIVATE, PIXEL_WIDTH, PIXEL_HEIGHT
+        ):
+            value = reader.read(size)
+            if element_id == TRACK_NUMBER:
+                current_track['number'] = _read_uint(value)
+                tracks[current_track['number']] = current_track
+            elif element_id == TRACK_TYPE:
+                current_track['type'] = _read_uint(value)
+            elif element_id == CODEC_ID:
+                current_track['codec_id'] = value.rstrip(b'\x00').decode('ascii', 'replace')
+            elif element_id == CODEC_PRIVATE:
+                current_track['codec_private'] = value
+            elif element_id == PIXEL_WIDTH:
+                current_track['width'] = _read_uint(value)
+            elif element_id == PIXEL_HEIGHT:
+                current_track['height'] = _read_uint(value)
+
+        elif element_id == TAG_NAME:
+            pending_tag_name = reader.read(size).rstrip(b'\x00').decode('utf-8', 'replace')
+
+        elif element_id == TAG_STRING:
+            value = reader.read(size).rstrip(b'\x00').decode('utf-8', 'replace')
+            if pending_tag_name == FRAGMENT_NUMBER_TAG:
+                current_fragment = value
+            pending_tag_name = None
+
+        elif element_id == CLUSTER_TIMECODE:
+            cluster_timecode = _read_uint(reader.read(size))
+
+        elif element_id in (SIMPLE_BLOCK, BLOCK_GROUP):
+            wrong_fragment = (
+                fragment_number and current_fragment and current_fragment != fragment_number
+            )
+            if wrong_fragment:
+                reader.skip(size)
+                continue
+
+            if element_id == SIMPLE_BLOCK:
+                # Peek at the block header before deciding to buffer the frame
+                header = reader.read(min(size, 11))
+                track_number, timecode, flags, header_length = _parse_block_header(header)
+                track = tracks.get(track_number, {})
+                is_video = track.get('type', TRACK_TYPE_VIDEO) == TRACK_TYPE_VIDEO
+                is_keyframe = bool(flags & 0x80) and not flags & 0x06  # No lacing
+                if not (is_video and is_keyframe):
+                    reader.skip(size - len(header))
+                    continue
+                data = header[header_length:] + reader.read(size - len(header))
+            else:
+                block, is_keyframe = _parse_block_group(reader.read(size))
+                if not block or not is_keyframe:
+                    continue
+                track_number, timecode, flags, header_length = _parse_block_header(block)
+                track = tracks.get(track_number, {})
+                if track.get('type', TRACK_TYPE_VIDEO) != TRACK_TYPE_VIDEO or flags & 0x06:
+                    continue
+                data = block[header_length:]
+
+            return Keyframe(
+                codec_id=track.get('codec_id'),
+                codec_private=track.get('codec_private'),
+                width=track.get('width'),
+                height=track.get('height'),
+                data=data,
+                fragment_number=current_fragment or fragment_number,
+                timecode=cluster_timecode + timecode,
+                bytes_read=reader.bytes_read,
+                elapsed_ms=(time.perf_counter() - started) * 1000
+            )
+
+        else:
+            reader.skip(size)
+
+    return None
+
+
+def _decode_image(keyframe: Keyframe):
+    """
+    Decode a keyframe into a PIL image, or None if no decoder is available
+    Decoders are optional and imported on first use
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+
+    if keyframe.codec_id == MJPEG_CODEC:
+        return Image.open(io.BytesIO(keyframe.data))
+
+    try:
+        import av
+    except ImportError:
+        av = None
+
+    codec_name = PYAV_CODECS.get(keyframe.codec_id)
+    if codec_name is None or av is None:
+        print(f"No decoder available for codec {keyframe.codec_id}")
+        return None
+
+    context = av.CodecContext.create(codec_name, 'r')
+    if keyframe.codec_private:
+        context.extradata = keyframe.codec_private
+    frames = context.decode(av.Packet(keyframe.data))
+    if not frames:
+        frames = context.decode(None)  # Flush the decoder
+    return frames[0].to_image() if frames else None
+
+
+def crop_box(width: int, height: int, bounding_box: dict, margin: float = CROP_MARGIN):
+    """
+    Convert a Rekognition BoundingBox (ratios) into a pixel crop box
+    The box is padded by margin on each side and clamped to the frame
+    """
+    box_width = bounding_box.get('Width', 1.0)
+    box_height = bounding_box.get('Height', 1.0)
+    left = bounding_box.get('Left', 0.0) - box_width * margin
+    top = bounding_box.get('Top', 0.0) - box_height * margin
+    right = left + box_width * (1 + 2 * margin)
+    bottom = top + box_height * (1 + 2 * margin)
+
+    return (
+        max(0, int(left * width)),
+        max(0, int(top * height)),
+        min(width, int(right * width)),
+        min(height, int(bottom * height))
+    )
+
+
+def keyframe_to_jpeg(keyframe: Keyframe, bounding_box: dict = None, quality: int = JPEG_QUALITY) -> bytes:
+    """
+    Encode a keyframe as JPEG, cropped to the face bounding box if given
+    MJPEG frames are passed through uncropped when Pillow is unavailable;
+    other codecs return None without a decoder, and any frame that fails
+    to decode returns None
+    """
+    try:
+        image = _decode_image(keyframe)
+    except Exception as e:
+        print(f"Error decoding {keyframe.codec_id} keyframe: {str(e)}")
+        return None
+
+    if image is None:
+        if keyframe.codec_id == MJPEG_CODEC:
+            return keyframe.data
+        return None
+
+    if bounding_box:
+        box = crop_box(image.width, image.height, bounding_box)
+        if box[2] > box[0] and box[3] > box[1]:
+            image = image.crop(box)
+
+    output = io.BytesIO()
+    image.convert('RGB').save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
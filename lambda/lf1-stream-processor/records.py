@@ -0,0 +1,57 @@
+"""
+Decoding of Rekognition face-search records from Kinesis for LF1
+Skips records without faces before parsing, uses orjson when installed and
+keeps only the fields LF1 reads
+"""
+
+import base64
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Rekognition writes "FaceSearchResponse": [] for frames without faces;
+# any record with a face contains this key
+FACE_MARKER = b'"DetectedFace"'
+
+LOG_PREVIEW_BYTES = int(os.environ.get('RECORD_LOG_PREVIEW_BYTES', '500'))
+LOG_SAMPLE_EVERY = max(1, int(os.environ.get('RECORD_LOG_SAMPLE_EVERY', '10')))
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+def json_loads(payload: bytes):
+    """
+    Parse JSON bytes with the fastest available backend
+    """
+    if orjson is not None:
+        return orjson.loads(payload)
+    return json.loads(payload)
+
+
+def decode_record(record: dict, index: int = 0):
+    """
+    Decode one Kinesis record into the fields LF1 uses:
+    {'FaceSearchResponse': [...], 'InputInformation': {'KinesisVideo': {...}}}
+    Returns None for records without any detected face.
+    Every LOG_SAMPLE_EVERY-th record is logged as a truncated raw preview.
+    """
+    payload = base64.b64decode(record['kinesis']['data'])
+
+    if index % LOG_SAMPLE_EVERY == 0:
+        preview = payload[:LOG_PREVIEW_BYTES].decode('utf-8', 'replace')
+        print(f"Processing record {index} ({len(payload)} bytes): {preview}")
+
+    if FACE_MARKER not in payload:
+        return None
+
+    data = json_loads(payload)
+    return {
+        'FaceSearchResponse': data.get('FaceSearchResponse') or [],
+        'InputInformation': {
+            'KinesisVideo': data.get('InputInformation', {}).get('KinesisVideo', {})
+        }
+    }
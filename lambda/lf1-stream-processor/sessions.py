@@ -0,0 +1,231 @@
+"""
+Unknown-visitor detection sessions for LF1
+Groups unmatched face detections from the same stream that are close in time
+and overlap in position, so one stranger becomes one pending visitor
+"""
+
+import json
+import time
+from botocore.exceptions import ClientError
+
+SYNC_ATTEMPTS = 3
+
+_numpy = None
+
+
+def _load_numpy():
+    """
+    Import numpy on first use (it is slow to import on a cold start)
+    Returns None when it is not installed; grouping then uses pure Python
+    """
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = False
+    return _numpy or None
+
+
+def box_tuple(bounding_box: dict) -> tuple:
+    """
+    Rekognition BoundingBox ratios as (left, top, width, height)
+    """
+    bounding_box = bounding_box or {}
+    return (
+        float(bounding_box.get('Left', 0.0)),
+        float(bounding_box.get('Top', 0.0)),
+        float(bounding_box.get('Width', 0.0)),
+        float(bounding_box.get('Height', 0.0))
+    )
+
+
+def box_iou(a: tuple, b: tuple) -> float:
+    """
+    Intersection over union of two (left, top, width, height) boxes
+    """
+    inter_width = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    inter_height = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if inter_width <= 0 or inter_height <= 0:
+        return 0.0
+    inter = inter_width * inter_height
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union > 0 else 0.0
+
+
+def _linked_pairs(times: list, boxes: list, streams: list, max_gap: float, min_iou: float):
+    """
+    Yield index pairs (i < j) that are on the same stream, within max_gap
+    seconds of each other and overlap by at least min_iou
+    """
+    np = _load_numpy()
+    if np is not None:
+        t = np.asarray(times, dtype=float)
+        b = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        stream_codes = {stream: code for code, stream in enumerate(set(streams))}
+        s = np.asarray([stream_codes[stream] for stream in streams])
+
+        x1, y1 = b[:, 0], b[:, 1]
+        x2, y2 = x1 + b[:, 2], y1 + b[:, 3]
+        inter_width = np.clip(np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]), 0, None)
+        inter_height = np.clip(np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]), 0, None)
+        inter = inter_width * inter_height
+        area = b[:, 2] * b[:, 3]
+        union = area[:, None] + area[None, :] - inter
+        iou = np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+        linked = (
+            (np.abs(t[:, None] - t[None, :]) <= max_gap)
+            & (s[:, None] == s[None, :])
+            & (iou >= min_iou)
+        )
+        for i, j in np.argwhere(np.triu(linked, 1)):
+            yield int(i), int(j)
+        return
+
+    for i in range(len(times)):
+        for j in range(i + 1, len(times)):
+            if (
+                streams[i] == streams[j]
+                and abs(times[i] - times[j]) <= max_gap
+                and box_iou(boxes[i], boxes[j]) >= min_iou
+            ):
+                yield i, j
+
+
+def cluster_detections(times: list, boxes: list, streams: list, max_gap: float, min_iou: float) -> list:
+    """
+    Group detections into connected components of linked pairs
+    Returns a list of index lists, in order of first appearance
+    """
+    parent = list(range(len(times)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in _linked_pairs(times, boxes, streams, max_gap, min_iou):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    groups = {}
+    for i in range(len(times)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+
+class DetectionSessionStore:
+    """
+    Short-lived sessions of unknown visitors per stream.
+
+    Each stream has one DynamoDB record listing its live sessions, updated
+    with optimistic concurrency so concurrent invocations agree on whether a
+    detection belongs to a stranger that was already reported. A warm local
+    copy answers repeat detections without I/O between syncs.
+    """
+
+    def __init__(self, table, idle_seconds: int, min_iou: float):
+        self.table = table
+        self.idle_seconds = idle_seconds
+        self.min_iou = min_iou
+        self._local = {}  # stream_key -> list of {'id', 'box', 'lastSeen', 'syncedAt'}
+
+    def _live(self, sessions: list, seen_at: float) -> list:
+        return [s for s in sessions if seen_at - s['lastSeen'] <= self.idle_seconds]
+
+    def _best_match(self, sessions: list, box: tuple):
+        best, best_iou = None, self.min_iou
+        for session in sessions:
+            iou = box_iou(tuple(session['box']), box)
+            if iou >= best_iou:
+                best, best_iou = session, iou
+        return best
+
+    def assign(self, stream_key: str, box: tuple, seen_at: float, new_id: str):
+        """
+        Attach a detection to a live session or open a new one
+        Returns (session_id, is_new)
+        """
+        local = self._live(self._local.get(stream_key, []), seen_at)
+        self._local[stream_key] = local
+        match = self._best_match(local, box)
+        if match and seen_at - match['syncedAt'] < self.idle_seconds / 2:
+            match['lastSeen'] = max(match['lastSeen'], seen_at)
+            match['box'] = box
+            return match['id'], False
+
+        key = {'cooldownKey': f"sessions#{stream_key}"}
+        for _ in range(SYNC_ATTEMPTS):
+            try:
+                item = self.table.get_item(Key=key, ConsistentRead=True).get('Item')
+                version = int(item['version']) if item else 0
+                sessions = self._live(json.loads(item['sessions']) if item else [], seen_at)
+
+                match = self._best_match(sessions, box)
+                is_new = match is None
+                if is_new:
+                    match = {'id': new_id, 'box': box, 'lastSeen': seen_at}
+                    sessions.append(match)
+                else:
+                    match['lastSeen'] = max(match['lastSeen'], seen_at)
+                    match['box'] = box
+
+                self._write(key, sessions, version, seen_at)
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                    continue  # Another invocation updated the stream; re-read
+                print(f"Error syncing detection sessions for {stream_key}: {str(e)}")
+                break
+
+            for session in sessions:
+                session['syncedAt'] = seen_at
+            self._local[stream_key] = sessions
+            return match['id'], is_new
+
+        # Shared store unavailable: decide from the local view only
+        match = self._best_match(local, box)
+        if match:
+            return match['id'], False
+        local.append({'id': new_id, 'box': box, 'lastSeen': seen_at, 'syncedAt': seen_at})
+        return new_id, True
+
+    def close(self, stream_key: str, session_id: str):
+        """
+        Drop a session, e.g. when notifying about it failed
+        """
+        self._local[stream_key] = [
+            s for s in self._local.get(stream_key, []) if s['id'] != session_id
+        ]
+        key = {'cooldownKey': f"sessions#{stream_key}"}
+        for _ in range(SYNC_ATTEMPTS):
+            try:
+                item = self.table.get_item(Key=key, ConsistentRead=True).get('Item')
+                if not item:
+                    return
+                sessions = [s for s in json.loads(item['sessions']) if s['id'] != session_id]
+                self._write(key, sessions, int(item['version']), time.time())
+                return
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    print(f"Error closing detection session {session_id}: {str(e)}")
+                    return
+
+    def _write(self, key: dict, sessions: list, version: int, now: float):
+        last_seen = max([s['lastSeen'] for s in sessions], default=now)
+        self.table.put_item(
+            Item={
+                **key,
+                'sessions': json.dumps([
+                    {'id': s['id'], 'box': list(s['box']), 'lastSeen': s['lastSeen']}
+                    for s in sessions
+                ]),
+                'version': version + 1,
+                'ttl': int(last_seen + self.idle_seconds) + 60
+            },
+            ConditionExpression='attribute_not_exists(cooldownKey) OR version = :version',
+            ExpressionAttributeValues={':version': version}
+        )
@@ -3,18 +3,25 @@ LF1: Process Rekognition Video Events
 Triggered by Kinesis Data Stream when faces are detected
 """
 import json
-import boto3
 import os
 import random
 import string
-import time
 import base64
+import time
 from datetime import datetime
 
-dynamodb = boto3.resource('dynamodb')
-s3 = boto3.client('s3')
-sns = boto3.client('sns')
-rekognition = boto3.client('rekognition')
+from common.clients import registry
+from common.door_trace import OWNER, VISITOR, for_recipient, start_trace
+from common.metrics import metrics
+from common.otp import DEFAULT_DOOR_ID, allocate_otp, find_live_otp, revoke_otp
+from common.outbox import SmsOutbox
+from common.photo_variants import store_variants
+from common.visitor_cache import VisitorCache, VisitorChangeFeed
+
+# AWS clients are created on first use
+s3 = registry.lazy_client('s3')
+sns = registry.lazy_client('sns')
+outbox = SmsOutbox(os.environ.get('SMS_QUEUE_URL'), registry.lazy_client('sqs'), sns)
 
 VISITORS_TABLE = os.environ.get('VISITORS_TABLE')
 PASSCODES_TABLE = os.environ.get('PASSCODES_TABLE')
@@ -24,16 +31,33 @@ OWNER_EMAIL = os.environ.get('OWNER_EMAIL')
 COLLECTION_ID = os.environ.get('COLLECTION_ID')
 WP1_URL = os.environ.get('WP1_URL')
 OTP_TTL = 300  # 5 minutes
+DOOR_ID = os.environ.get('DOOR_ID', DEFAULT_DOOR_ID)  # Door this stream watches
+OTP_REUSE_MIN = int(os.environ.get('OTP_REUSE_MIN_REMAINING_SECONDS', '60'))  # Reuse live OTPs with this much left
+VISITORS_STREAM_ARN = os.environ.get('VISITORS_STREAM_ARN')
 
+# Visitor directory cached per container; the table's stream keeps it current
+visitor_feed = None
+if VISITORS_STREAM_ARN:
+    visitor_feed = VisitorChangeFeed(registry.lazy_client('dynamodbstreams'), VISITORS_STREAM_ARN)
+visitor_cache = VisitorCache(
+    registry.lazy_table(VISITORS_TABLE),
+    21600 if visitor_feed else 60,
+    feed=visitor_feed,
+    snapshot_max_items=200 if visitor_feed else 0
+)
 
+
+@metrics.handler
 def handler(event, context):
     print(f"Event: {json.dumps(event)}")
+    received_at = time.time()
     
     for record in event.get('Records', []):
         try:
             payload = base64.b64decode(record['kinesis']['data']).decode('utf-8')
             rek_event = json.loads(payload)
-            process_event(rek_event)
+            trace = start_trace(rek_event.get('InputInformation', {}), record, received_at)
+            process_event(rek_event, trace)
         except Exception as e:
             print(f"Error: {e}")
             raise
@@ -41,7 +65,7 @@ def handler(event, context):
     return {'statusCode': 200}
 
 
-def process_event(event):
+def process_event(event, trace=None):
     if 'FaceSearchResponse' not in event:
         return
     
@@ -55,58 +79,75 @@ def process_event(event):
         if matches:
             # Known visitor
             face_id = matches[0]['Face']['FaceId']
-            handle_known_visitor(face_id)
+            handle_known_visitor(face_id, for_recipient(trace, VISITOR))
         else:
             # Unknown visitor
-            handle_unknown_visitor(face.get('DetectedFace', {}), stream_arn, fragment)
+            handle_unknown_visitor(face.get('DetectedFace', {}), stream_arn, fragment, for_recipient(trace, OWNER))
 
 
-def handle_known_visitor(face_id):
-    visitors = dynamodb.Table(VISITORS_TABLE)
-    resp = visitors.get_item(Key={'faceId': face_id})
-    
-    if 'Item' not in resp:
+def fetch_visitors(face_ids):
+    visitors = registry.table(VISITORS_TABLE)
+    found = {}
+    for face_id in face_ids:
+        item = visitors.get_item(Key={'faceId': face_id}).get('Item')
+        if item:
+            found[face_id] = item
+    return found
+
+
+def handle_known_visitor(face_id, trace=None):
+    visitor = visitor_cache.get_many([face_id], fetch_visitors).get(face_id)
+    if not visitor:
         return
     
-    visitor = resp['Item']
     name = visitor.get('name', 'Visitor')
     phone = visitor.get('phoneNumber', '')
     
     if not phone:
         return
     
-    # Generate and store OTP
-    otp = ''.join(random.choices(string.digits, k=6))
-    passcodes = dynamodb.Table(PASSCODES_TABLE)
-    passcodes.put_item(Item={
-        'otp': otp,
+    # A visitor who still holds a live OTP keeps it
+    passcodes = registry.table(PASSCODES_TABLE)
+    if find_live_otp(passcodes, face_id, DOOR_ID, OTP_REUSE_MIN):
+        print(f"Reusing live OTP of {name}")
+        return
+    
+    # Allocate and store a unique OTP
+    otp = allocate_otp(passcodes, DOOR_ID, {
         'faceId': face_id,
         'visitorName': name,
-        'createdAt': datetime.utcnow().isoformat(),
-        'ttl': int(time.time()) + OTP_TTL
-    })
+        'createdAt': datetime.utcnow().isoformat()
+    }, OTP_TTL)
     
-    # Send SMS
+    # Queue SMS (published directly when SMS_QUEUE_URL is unset)
     msg = f"Hello {name}! Your Smart Door code is: {otp}. Valid for 5 minutes."
-    sns.publish(PhoneNumber=phone, Message=msg)
+    try:
+        outbox.send(phone, msg, {'doorId': DOOR_ID, 'otp': otp}, trace)
+    except Exception:
+        # Nobody received it; the retried record issues a new one
+        revoke_otp(passcodes, DOOR_ID, otp)
+        raise
     print(f"OTP sent to {name}")
 
 
-def handle_unknown_visitor(detected_face, stream_arn, fragment):
+def handle_unknown_visitor(detected_face, stream_arn, fragment, trace=None):
     temp_id = ''.join(random.choices(string.ascii_lowercase + string.digits, k=32))
     ts = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
     photo_key = f"unknown/{ts}_{temp_id}.jpg"
     
     # Save placeholder photo (in production: extract from stream)
+    photo = create_placeholder()
     s3.put_object(
         Bucket=PHOTOS_BUCKET,
         Key=photo_key,
-        Body=create_placeholder(),
+        Body=photo,
         ContentType='image/jpeg'
     )
     
-    photo_url = f"https://{PHOTOS_BUCKET}.s3.amazonaws.com/{photo_key}"
-    approval_link = f"{WP1_URL}?faceId={temp_id}&photo={photo_key}"
+    # The owner's phone loads the small variants rather than the photo
+    variants = store_variants(s3, PHOTOS_BUCKET, photo_key, photo)
+    photo_url = f"https://{PHOTOS_BUCKET}.s3.amazonaws.com/{variants.get('display', photo_key)}"
+    approval_link = f"{WP1_URL}?faceId={temp_id}&photo={variants.get('thumbnail', photo_key)}&door={DOOR_ID}"
     
     msg = f"""Unknown visitor at Smart Door!
 Time: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}
@@ -114,7 +155,7 @@ Approve: {approval_link}
 Photo: {photo_url}"""
     
     if OWNER_PHONE:
-        sns.publish(PhoneNumber=OWNER_PHONE, Message=msg)
+        outbox.send(OWNER_PHONE, msg, trace=trace)
     
     print(f"Owner notified about unknown visitor: {temp_id}")
 
@@ -6,36 +6,54 @@ Registers new visitors in Rekognition and DynamoDB
 
 import json
 import os
-import boto3
-import random
-import string
 import time
 from datetime import datetime, timezone
 from decimal import Decimal
 from botocore.exceptions import ClientError
 
-# Initialize AWS clients
-dynamodb = boto3.resource('dynamodb')
-s3_client = boto3.client('s3')
-sns_client = boto3.client('sns')
-rekognition = boto3.client('rekognition')
+from common.clients import registry
+from common.face_collection import FaceCollections
+from common.metrics import metrics
+from common.otp import DEFAULT_DOOR_ID, allocate_otp, door_ids, parse_door_id
+from common.outbox import SmsOutbox
+from common.photo_variants import original_key, store_variants_from_s3, variant_keys
+from common.visitors import add_photo, photo_record, upsert_visitor
+
+# AWS clients - each is created on first use
+s3_client = registry.lazy_client('s3')
+sns_client = registry.lazy_client('sns')
+rekognition = registry.lazy_client('rekognition')
+sqs_client = registry.lazy_client('sqs')
 
 # Environment variables
 VISITORS_TABLE = os.environ.get('VISITORS_TABLE', 'smartdoor-visitors-dev')
-PASSCODES_TABLE = os.environ.get('PASSCODES_TABLE', 'smartdoor-passcodes-dev')
+PASSCODES_TABLE = os.environ.get('PASSCODES_TABLE', 'smartdoor-passcodes-v2-dev')
+VISITOR_PHOTOS_TABLE = os.environ.get('VISITOR_PHOTOS_TABLE', 'smartdoor-visitor-photos-dev')
 PHOTOS_BUCKET = os.environ.get('PHOTOS_BUCKET', 'smartdoor-visitor-photos')
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
 COLLECTION_ID = os.environ.get('COLLECTION_ID', 'smartdoor-faces-dev')
+COLLECTION_SHARD_MAX_FACES = int(os.environ.get('COLLECTION_SHARD_MAX_FACES', '1000000'))
+DOOR_ID = os.environ.get('DOOR_ID', DEFAULT_DOOR_ID)  # Door assumed when a request names none
+DOOR_IDS = door_ids(os.environ.get('DOOR_IDS'))  # Doors requests may name; empty allows any
+SMS_QUEUE_URL = os.environ.get('SMS_QUEUE_URL')  # SMS outbox; unset sends directly
 
 # OTP Configuration
 OTP_LENGTH = 6
 OTP_TTL_SECONDS = 300  # 5 minutes
 
 # Tables
-visitors_table = dynamodb.Table(VISITORS_TABLE)
-passcodes_table = dynamodb.Table(PASSCODES_TABLE)
+visitors_table = registry.lazy_table(VISITORS_TABLE)
+passcodes_table = registry.lazy_table(PASSCODES_TABLE)
+photos_table = registry.lazy_table(VISITOR_PHOTOS_TABLE)
+
+# SMS are queued for the dispatcher instead of waiting on SNS
+sms_outbox = SmsOutbox(SMS_QUEUE_URL, sqs_client, sns_client)
 
+# Collection state is cached across warm invocations
+face_collections = FaceCollections(rekognition, COLLECTION_ID, COLLECTION_SHARD_MAX_FACES)
 
+
+@metrics.handler
 def lambda_handler(event, context):
     """
     Handle POST /visitor requests from WP1 (Owner Approval Page)
@@ -44,7 +62,8 @@ def lambda_handler(event, context):
         "faceId": "pending_xxx" or null,
         "name": "John Doe",
         "phoneNumber": "+12025551234",
-        "photoKey": "visitors/xxx.jpg"
+        "photoKey": "visitors/xxx.jpg" (or the key of one of its variants),
+        "doorId": "front" (optional, door the visitor is at)
     }
     """
     print(f"Received event: {json.dumps(event, default=str)}")
@@ -69,6 +88,7 @@ def lambda_handler(event, context):
         phone_number = body.get('phoneNumber')
         photo_key = body.get('photoKey')
         pending_face_id = body.get('faceId')
+        door_id = parse_door_id(body.get('doorId'), DOOR_ID, DOOR_IDS)
         
         if not name or not phone_number:
             return {
@@ -79,16 +99,31 @@ def lambda_handler(event, context):
                 })
             }
         
+        if not door_id:
+            return {
+                'statusCode': 400,
+                'headers': headers,
+                'body': json.dumps({'error': 'Invalid doorId'})
+            }
+        
         # Validate phone number format (E.164)
         if not phone_number.startswith('+'):
             phone_number = '+1' + phone_number.replace('-', '').replace(' ', '')
         
         print(f"Registering visitor: {name}, {phone_number}")
         
+        # Approval links carry the thumbnail; faces are indexed from the original
+        variants = None
+        if photo_key:
+            with metrics.timer('photo_variants'):
+                photo_key, variants = photo_variants(photo_key)
+        
         # Index face in Rekognition (if photo available)
         face_id = None
         if photo_key:
-            face_id = index_face_in_rekognition(photo_key)
+            with metrics.timer('index_face') as timer:
+                face_id = index_face_in_rekognition(photo_key)
+                timer.outcome = 'ok' if face_id else 'no_face'
         
         if not face_id:
             # Generate a UUID-like face ID if indexing failed
@@ -96,7 +131,8 @@ def lambda_handler(event, context):
             print(f"Using generated face ID: {face_id}")
         
         # Create visitor record in DynamoDB
-        visitor_record = create_visitor_record(face_id, name, phone_number, photo_key)
+        with metrics.timer('visitor_record'):
+            visitor_record = create_visitor_record(face_id, name, phone_number, photo_key, variants)
         
         # Clean up pending record if it exists
         if pending_face_id and pending_face_id.startswith('pending_'):
@@ -106,21 +142,23 @@ def lambda_handler(event, context):
             except Exception as e:
                 print(f"Error deleting pending record: {str(e)}")
         
-        # Generate and store OTP
-        otp = generate_otp()
-        store_otp(otp, face_id, name)
+        # Allocate and store a unique OTP
+        with metrics.timer('otp'):
+            otp = store_otp(face_id, name, door_id)
         
-        # Send OTP to new visitor via SMS
+        # Queue the OTP SMS for the new visitor
         message = f"Hello {name}! You've been approved for Smart Door access.\nYour access code is: {otp}\nThis code expires in 5 minutes."
-        send_sms(phone_number, message)
+        with metrics.timer('sms'):
+            send_sms(phone_number, message, {'doorId': door_id, 'otp': otp})
+        metrics.count('Registrations')
         
-        # Notify owner of successful registration (optional)
+        # Notify owner of successful registration (optional), through the outbox
         if SNS_TOPIC_ARN:
             try:
-                sns_client.publish(
-                    TopicArn=SNS_TOPIC_ARN,
-                    Subject="Smart Door: New Visitor Registered",
-                    Message=f"New visitor registered:\nName: {name}\nPhone: {phone_number}\nFace ID: {face_id}"
+                sms_outbox.send_topic(
+                    SNS_TOPIC_ARN,
+                    "Smart Door: New Visitor Registered",
+                    f"New visitor registered:\nName: {name}\nPhone: {phone_number}\nFace ID: {face_id}"
                 )
             except Exception as e:
                 print(f"Error sending notification: {str(e)}")
@@ -156,16 +194,12 @@ def lambda_handler(event, context):
 
 def index_face_in_rekognition(photo_key: str) -> str:
     """
-    Index a face image in Rekognition collection
+    Index a face image into the active shard of the Rekognition collection
     Returns the FaceId if successful, None otherwise
     """
     try:
-        # Ensure collection exists
-        ensure_collection_exists()
-        
-        # Index face from S3
-        response = rekognition.index_faces(
-            CollectionId=COLLECTION_ID,
+        # Index face from S3; the shard is created if needed
+        response = face_collections.index_faces(
             Image={
                 'S3Object': {
                     'Bucket': PHOTOS_BUCKET,
@@ -179,7 +213,7 @@ def index_face_in_rekognition(photo_key: str) -> str:
         
         if response['FaceRecords']:
             face_id = response['FaceRecords'][0]['Face']['FaceId']
-            print(f"Face indexed successfully: {face_id}")
+            print(f"Face indexed successfully: {face_id} in {response['CollectionId']}")
             return face_id
         else:
             print("No face detected in image")
@@ -196,119 +230,66 @@ def index_face_in_rekognition(photo_key: str) -> str:
         return None
 
 
-def ensure_collection_exists():
+def photo_variants(photo_key: str) -> tuple:
     """
-    Create Rekognition collection if it doesn't exist
+    Resolve a photo key from WP1 to (original key, {variant: key})
+    A variant key means LF1 already stored the variants; for an original
+    key they are rendered now
     """
-    try:
-        rekognition.create_collection(CollectionId=COLLECTION_ID)
-        print(f"Created collection: {COLLECTION_ID}")
-    except rekognition.exceptions.ResourceAlreadyExistsException:
-        print(f"Collection already exists: {COLLECTION_ID}")
-    except Exception as e:
-        print(f"Error creating collection: {str(e)}")
+    original = original_key(photo_key)
+    if original != photo_key:
+        return original, variant_keys(original)
+    return original, store_variants_from_s3(s3_client, PHOTOS_BUCKET, original)
 
 
-def create_visitor_record(face_id: str, name: str, phone_number: str, photo_key: str) -> dict:
+def create_visitor_record(face_id: str, name: str, phone_number: str, photo_key: str,
+                          variants: dict = None) -> dict:
     """
     Create or update visitor record in DynamoDB
+    The record is upserted in one call and the photo appended to the
+    visitor's history, whatever the number of photos already stored
     """
     timestamp = datetime.now(timezone.utc).isoformat()
+    photo = photo_record(photo_key, PHOTOS_BUCKET, timestamp, variants) if photo_key else None
     
-    # Build photo object
-    photo_record = None
-    if photo_key:
-        photo_record = {
-            'objectKey': photo_key,
-            'bucket': PHOTOS_BUCKET,
-            'createdTimestamp': timestamp
-        }
-    
-    # Check if visitor exists (update) or is new (create)
-    try:
-        existing = visitors_table.get_item(Key={'faceId': face_id})
-        if 'Item' in existing:
-            # Update existing record - append new photo
-            photos = existing['Item'].get('photos', [])
-            if photo_record:
-                photos.append(photo_record)
-            
-            visitors_table.update_item(
-                Key={'faceId': face_id},
-                UpdateExpression='SET #name = :name, phoneNumber = :phone, photos = :photos, updatedAt = :updated',
-                ExpressionAttributeNames={'#name': 'name'},
-                ExpressionAttributeValues={
-                    ':name': name,
-                    ':phone': phone_number,
-                    ':photos': photos,
-                    ':updated': timestamp
-                }
-            )
-            print(f"Updated existing visitor: {face_id}")
-            return existing['Item']
-    except Exception as e:
-        print(f"Error checking existing visitor: {str(e)}")
-    
-    # Create new record
-    visitor_record = {
-        'faceId': face_id,
-        'name': name,
-        'phoneNumber': phone_number,
-        'photos': [photo_record] if photo_record else [],
-        'createdAt': timestamp,
-        'status': 'approved'
-    }
-    
-    visitors_table.put_item(Item=visitor_record)
-    print(f"Created new visitor record: {face_id}")
+    visitor_record = upsert_visitor(visitors_table, face_id, name, phone_number, photo, now=timestamp)
+    if photo:
+        add_photo(photos_table, face_id, photo)
     
+    print(f"Upserted visitor record: {face_id} ({visitor_record.get('photoCount', 0)} photos)")
     return visitor_record
 
 
-def generate_otp() -> str:
+def store_otp(face_id: str, visitor_name: str, door_id: str = DEFAULT_DOOR_ID) -> str:
     """
-    Generate a random 6-digit OTP
+    Store a new OTP for a door in DynamoDB with TTL and return it
+    The code is drawn from a CSPRNG and never collides with a live OTP of that door
     """
-    return ''.join(random.choices(string.digits, k=OTP_LENGTH))
-
-
-def store_otp(otp: str, face_id: str, visitor_name: str):
-    """
-    Store OTP in DynamoDB with TTL
-    """
-    ttl = int(time.time()) + OTP_TTL_SECONDS
-    
-    passcodes_table.put_item(
-        Item={
-            'otp': otp,
+    otp = allocate_otp(
+        passcodes_table,
+        door_id,
+        {
             'faceId': face_id,
             'visitorName': visitor_name,
-            'createdAt': datetime.now(timezone.utc).isoformat(),
-            'ttl': ttl
-        }
+            'createdAt': datetime.now(timezone.utc).isoformat()
+        },
+        OTP_TTL_SECONDS,
+        length=OTP_LENGTH
     )
-    print(f"OTP {otp} stored with TTL {ttl}")
+    print(f"OTP {otp} stored for door {door_id}, expires in {OTP_TTL_SECONDS}s")
+    return otp
 
 
-def send_sms(phone_number: str, message: str):
+def send_sms(phone_number: str, message: str, passcode: dict = None):
     """
-    Send SMS using SNS
+    Queue an SMS on the outbox; the SMS dispatcher (LF4) publishes it
     """
     try:
-        response = sns_client.publish(
-            PhoneNumber=phone_number,
-            Message=message,
-            MessageAttributes={
-                'AWS.SNS.SMS.SMSType': {
-                    'DataType': 'String',
-                    'StringValue': 'Transactional'
-                }
-            }
-        )
-        print(f"SMS sent to {phone_number}: MessageId={response['MessageId']}")
-        return response
+        message_id = sms_outbox.send(phone_number, message, passcode)
+        print(f"SMS queued for {phone_number}: MessageId={message_id}")
+        return message_id
     except Exception as e:
-        print(f"Error sending SMS to {phone_number}: {str(e)}")
+        print(f"Error queueing SMS to {phone_number}: {str(e)}")
         raise
 
 
@@ -3,25 +3,38 @@ LF2: Visitor Registration API
 Called when owner approves unknown visitor via WP1
 """
 import json
-import boto3
 import os
-import random
-import string
-import time
 from datetime import datetime
 
-dynamodb = boto3.resource('dynamodb')
-s3 = boto3.client('s3')
-rekognition = boto3.client('rekognition')
-sns = boto3.client('sns')
+from common.clients import registry
+from common.face_collection import FaceCollections
+from common.metrics import metrics
+from common.otp import DEFAULT_DOOR_ID, allocate_otp, door_ids, parse_door_id
+from common.outbox import SmsOutbox
+from common.photo_variants import original_key, store_variants_from_s3, variant_keys
+from common.visitors import add_photo, photo_record, upsert_visitor
+
+# AWS clients are created on first use
+rekognition = registry.lazy_client('rekognition')
+s3 = registry.lazy_client('s3')
+sns = registry.lazy_client('sns')
+outbox = SmsOutbox(os.environ.get('SMS_QUEUE_URL'), registry.lazy_client('sqs'), sns)
 
 VISITORS_TABLE = os.environ.get('VISITORS_TABLE')
 PASSCODES_TABLE = os.environ.get('PASSCODES_TABLE')
+VISITOR_PHOTOS_TABLE = os.environ.get('VISITOR_PHOTOS_TABLE')
 PHOTOS_BUCKET = os.environ.get('PHOTOS_BUCKET')
 COLLECTION_ID = os.environ.get('COLLECTION_ID')
 OTP_TTL = 300
+DOOR_ID = os.environ.get('DOOR_ID', DEFAULT_DOOR_ID)
+DOOR_IDS = door_ids(os.environ.get('DOOR_IDS'))
+SHARD_MAX_FACES = int(os.environ.get('COLLECTION_SHARD_MAX_FACES', '1000000'))
+
+# Shard list and face counts are cached across warm invocations
+collections = FaceCollections(rekognition, COLLECTION_ID, SHARD_MAX_FACES)
 
 
+@metrics.handler
 def handler(event, context):
     print(f"Event: {json.dumps(event)}")
     
@@ -34,6 +47,7 @@ def handler(event, context):
         phone = body.get('phoneNumber', '').strip()
         face_id = body.get('faceId', '').strip()
         photo_key = body.get('photoKey', '').strip()
+        door_id = parse_door_id(body.get('doorId'), DOOR_ID, DOOR_IDS)
         
         if not name:
             return response(400, {'error': 'Name required'})
@@ -41,24 +55,30 @@ def handler(event, context):
             return response(400, {'error': 'Phone required'})
         if not face_id:
             return response(400, {'error': 'Face ID required'})
+        if not door_id:
+            return response(400, {'error': 'Invalid door'})
         
         # Format phone
         if not phone.startswith('+'):
             phone = '+1' + phone.replace('-', '').replace(' ', '')
         
+        # WP1 sends the thumbnail key; index the original photo
+        variants = None
+        if photo_key:
+            photo_key, variants = photo_variants(photo_key)
+        
         # Index face in Rekognition
         rek_face_id = index_face(photo_key, face_id)
         
         # Store visitor
-        store_visitor(rek_face_id, name, phone, photo_key)
+        store_visitor(rek_face_id, name, phone, photo_key, variants)
         
-        # Generate OTP
-        otp = ''.join(random.choices(string.digits, k=6))
-        store_otp(otp, rek_face_id, name)
+        # Allocate a unique OTP
+        otp = store_otp(rek_face_id, name, door_id)
         
-        # Send SMS
+        # Queue SMS (published directly when SMS_QUEUE_URL is unset)
         msg = f"Welcome {name}! Your Smart Door code is: {otp}. Valid for 5 minutes."
-        sns.publish(PhoneNumber=phone, Message=msg)
+        outbox.send(phone, msg, {'doorId': door_id, 'otp': otp})
         
         return response(200, {
             'message': 'Registered successfully',
@@ -73,17 +93,11 @@ def handler(event, context):
 
 def index_face(photo_key, external_id):
     try:
-        # Ensure collection exists
-        try:
-            rekognition.create_collection(CollectionId=COLLECTION_ID)
-        except rekognition.exceptions.ResourceAlreadyExistsException:
-            pass
-        
         if not photo_key:
             return external_id
         
-        resp = rekognition.index_faces(
-            CollectionId=COLLECTION_ID,
+        # Goes to the active shard, created on first use
+        resp = collections.index_faces(
             Image={'S3Object': {'Bucket': PHOTOS_BUCKET, 'Name': photo_key}},
             ExternalImageId=external_id,
             MaxFaces=1,
@@ -99,36 +113,31 @@ def index_face(photo_key, external_id):
         return external_id
 
 
-def store_visitor(face_id, name, phone, photo_key):
-    visitors = dynamodb.Table(VISITORS_TABLE)
+def photo_variants(photo_key):
+    # Variants exist when the key is one of them; otherwise render them now
+    original = original_key(photo_key)
+    if original != photo_key:
+        return original, variant_keys(original)
+    return original, store_variants_from_s3(s3, PHOTOS_BUCKET, original)
+
+
+def store_visitor(face_id, name, phone, photo_key, variants=None):
     ts = datetime.utcnow().isoformat()
+    photo = photo_record(photo_key, PHOTOS_BUCKET, ts, variants) if photo_key else None
     
-    photos = []
-    if photo_key:
-        photos.append({
-            'objectKey': photo_key,
-            'bucket': PHOTOS_BUCKET,
-            'createdTimestamp': ts
-        })
-    
-    visitors.put_item(Item={
-        'faceId': face_id,
-        'name': name,
-        'phoneNumber': phone,
-        'photos': photos,
-        'createdAt': ts
-    })
+    # One upsert keeps earlier photos; the new one is appended to the history
+    upsert_visitor(registry.table(VISITORS_TABLE), face_id, name, phone, photo, now=ts)
+    if photo:
+        add_photo(registry.table(VISITOR_PHOTOS_TABLE), face_id, photo)
 
 
-def store_otp(otp, face_id, name):
-    passcodes = dynamodb.Table(PASSCODES_TABLE)
-    passcodes.put_item(Item={
-        'otp': otp,
+def store_otp(face_id, name, door_id):
+    passcodes = registry.table(PASSCODES_TABLE)
+    return allocate_otp(passcodes, door_id, {
         'faceId': face_id,
         'visitorName': name,
-        'createdAt': datetime.utcnow().isoformat(),
-        'ttl': int(time.time()) + OTP_TTL
-    })
+        'createdAt': datetime.utcnow().isoformat()
+    }, OTP_TTL)
 
 
 def response(code, body):
@@ -5,27 +5,78 @@ Validates one-time passcodes for door access
 
 import json
 import os
-import boto3
 import time
 from datetime import datetime, timezone
 from decimal import Decimal
 
-# Initialize AWS clients
-dynamodb = boto3.resource('dynamodb')
+from common.clients import registry
+from common.limiter import LOCKED, Limit, RateLimiter
+from common.metrics import metrics
+from common.otp import DEFAULT_DOOR_ID, EXPIRED, GRANTED, MISSING, USED, consume_otp, door_ids, parse_door_id
 
 # Environment variables
-PASSCODES_TABLE = os.environ.get('PASSCODES_TABLE', 'smartdoor-passcodes-dev')
+PASSCODES_TABLE = os.environ.get('PASSCODES_TABLE', 'smartdoor-passcodes-v2-dev')
+COOLDOWN_TABLE = os.environ.get('COOLDOWN_TABLE', 'smartdoor-cooldowns-dev')
+DOOR_ID = os.environ.get('DOOR_ID', DEFAULT_DOOR_ID)  # Door assumed when a request names none
+DOOR_IDS = door_ids(os.environ.get('DOOR_IDS'))  # Doors requests may name; empty allows any
 
-# Table
-passcodes_table = dynamodb.Table(PASSCODES_TABLE)
+# Request limits: per source IP and per door, each a local token bucket
+# (rate/s, burst) plus a shared cap per minute across containers
+VALIDATE_IP_LIMIT = Limit(
+    rate=float(os.environ.get('VALIDATE_IP_RATE', '1')),
+    burst=int(os.environ.get('VALIDATE_IP_BURST', '5')),
+    window_seconds=60,
+    window_max=int(os.environ.get('VALIDATE_IP_PER_MINUTE', '20')),
+    lockout=True
+)
+VALIDATE_DOOR_LIMIT = Limit(
+    rate=float(os.environ.get('VALIDATE_DOOR_RATE', '10')),
+    burst=int(os.environ.get('VALIDATE_DOOR_BURST', '20')),
+    window_seconds=60,
+    window_max=int(os.environ.get('VALIDATE_DOOR_PER_MINUTE', '300'))
+)
 
+# Consecutive invalid codes before an IP is locked out (30s, doubling)
+VALIDATE_LOCKOUT_THRESHOLD = int(os.environ.get('VALIDATE_LOCKOUT_THRESHOLD', '5'))
 
+# Tables
+passcodes_table = registry.lazy_table(PASSCODES_TABLE)  # Created on first use
+cooldowns_table = registry.lazy_table(COOLDOWN_TABLE)
+
+# Survives across warm invocations; shared counters live in the cooldowns table
+validate_limiter = RateLimiter(
+    cooldowns_table,
+    {'ip': VALIDATE_IP_LIMIT, 'door': VALIDATE_DOOR_LIMIT},
+    lockout_threshold=VALIDATE_LOCKOUT_THRESHOLD
+)
+
+DENIED_MESSAGES = {
+    MISSING: 'Invalid OTP. Please check your code and try again.',
+    EXPIRED: 'OTP has expired. Please request a new code.',
+    USED: 'This OTP has already been used. Please request a new code.'
+}
+
+
+def source_ip(event: dict) -> str:
+    """
+    Caller IP from a REST (v1) or HTTP (v2) API Gateway proxy event
+    """
+    context = event.get('requestContext') or {}
+    return (
+        context.get('identity', {}).get('sourceIp')
+        or context.get('http', {}).get('sourceIp')
+        or 'unknown'
+    )
+
+
+@metrics.handler
 def lambda_handler(event, context):
     """
     Handle POST /validate requests from WP2 (Virtual Door Page)
     Expected body:
     {
-        "otp": "123456"
+        "otp": "123456",
+        "doorId": "front" (optional, defaults to DOOR_ID)
     }
     """
     print(f"Received event: {json.dumps(event, default=str)}")
@@ -45,66 +96,79 @@ def lambda_handler(event, context):
         else:
             body = event.get('body', {})
         
-        # Extract OTP
+        # Extract OTP and the door it is entered at
         otp = body.get('otp', '').strip()
+        door_id = parse_door_id(body.get('doorId'), DOOR_ID, DOOR_IDS)
         
-        if not otp:
+        if not door_id:
             return {
                 'statusCode': 400,
                 'headers': headers,
                 'body': json.dumps({
                     'access': 'denied',
-                    'message': 'OTP is required'
+                    'message': 'Invalid door.'
                 })
             }
         
-        # Validate OTP length
-        if len(otp) != 6 or not otp.isdigit():
+        # Shed guessing before any passcode lookup
+        ip = source_ip(event)
+        with metrics.timer('limiter'):
+            reason, retry_after = validate_limiter.check({'ip': ip, 'door': door_id})
+        if reason:
+            print(f"Request from {ip} rejected: {reason} (retry after {retry_after:.0f}s)")
+            metrics.count('Throttled')
+            return {
+                'statusCode': 429,
+                'headers': {**headers, 'Retry-After': str(max(1, int(retry_after + 0.5)))},
+                'body': json.dumps({
+                    'access': 'denied',
+                    'reason': reason,
+                    'message': 'Too many failed attempts. Please try again later.' if reason == LOCKED
+                               else 'Too many requests. Please wait and try again.'
+                })
+            }
+        
+        if not otp:
             return {
                 'statusCode': 400,
                 'headers': headers,
                 'body': json.dumps({
                     'access': 'denied',
-                    'message': 'Invalid OTP format. Please enter a 6-digit code.'
+                    'message': 'OTP is required'
                 })
             }
         
-        print(f"Validating OTP: {otp}")
-        
-        # Look up OTP in DynamoDB
-        response = passcodes_table.get_item(Key={'otp': otp})
-        
-        if 'Item' not in response:
-            print(f"OTP not found: {otp}")
+        # Validate OTP length
+        if len(otp) != 6 or not otp.isdigit():
             return {
-                'statusCode': 401,
+                'statusCode': 400,
                 'headers': headers,
                 'body': json.dumps({
                     'access': 'denied',
-                    'message': 'Invalid OTP. Please check your code and try again.'
+                    'message': 'Invalid OTP format. Please enter a 6-digit code.'
                 })
             }
         
-        item = response['Item']
+        print(f"Validating OTP: {otp} at door {door_id}")
         
-        # Check if OTP has expired (TTL)
-        ttl = int(item.get('ttl', 0))
-        current_time = int(time.time())
+        # Consume the OTP in one conditional write (one-time use)
+        with metrics.timer('consume_otp') as timer:
+            outcome, item = consume_otp(passcodes_table, door_id, otp)
+            timer.outcome = outcome
         
-        if current_time > ttl:
-            print(f"OTP expired: {otp} (TTL: {ttl}, Current: {current_time})")
-            # Delete expired OTP
-            try:
-                passcodes_table.delete_item(Key={'otp': otp})
-            except Exception as e:
-                print(f"Error deleting expired OTP: {str(e)}")
-            
+        if outcome != GRANTED:
+            print(f"OTP rejected: {otp} ({outcome})")
+            if outcome == MISSING:
+                # Only unknown codes look like guessing; used or expired
+                # codes are usually a real visitor retrying
+                validate_limiter.record_failure('ip', ip)
             return {
                 'statusCode': 401,
                 'headers': headers,
                 'body': json.dumps({
                     'access': 'denied',
-                    'message': 'OTP has expired. Please request a new code.'
+                    'reason': outcome,
+                    'message': DENIED_MESSAGES[outcome]
                 })
             }
         
@@ -113,16 +177,7 @@ def lambda_handler(event, context):
         face_id = item.get('faceId', 'unknown')
         
         print(f"Access granted to {visitor_name} (faceId: {face_id})")
-        
-        # Delete used OTP (one-time use)
-        try:
-            passcodes_table.delete_item(Key={'otp': otp})
-            print(f"Deleted used OTP: {otp}")
-        except Exception as e:
-            print(f"Error deleting used OTP: {str(e)}")
-        
-        # Calculate remaining time for display
-        time_remaining = ttl - current_time
+        validate_limiter.record_success('ip', ip)
         
         return {
             'statusCode': 200,
@@ -161,7 +216,8 @@ def lambda_handler(event, context):
 
 
 # Helper function for testing - add a test OTP
-def add_test_otp(otp: str, visitor_name: str = "Test Visitor", ttl_seconds: int = 300):
+def add_test_otp(otp: str, visitor_name: str = "Test Visitor", ttl_seconds: int = 300,
+                 door_id: str = DOOR_ID):
     """
     Add a test OTP to the table (for testing purposes)
     """
@@ -169,6 +225,7 @@ def add_test_otp(otp: str, visitor_name: str = "Test Visitor", ttl_seconds: int
     
     passcodes_table.put_item(
         Item={
+            'doorId': door_id,
             'otp': otp,
             'faceId': 'test-face-id',
             'visitorName': visitor_name,
@@ -3,15 +3,43 @@ LF3: OTP Validation API
 Validates passcodes entered on virtual door (WP2)
 """
 import json
-import boto3
 import os
-import time
 from datetime import datetime
 
-dynamodb = boto3.resource('dynamodb')
+from common.clients import registry
+from common.limiter import Limit, RateLimiter
+from common.metrics import metrics
+from common.otp import DEFAULT_DOOR_ID, GRANTED, MISSING, USED, consume_otp, door_ids, parse_door_id
+
 PASSCODES_TABLE = os.environ.get('PASSCODES_TABLE')
+COOLDOWN_TABLE = os.environ.get('COOLDOWN_TABLE')  # Optional shared limiter counters
+DOOR_ID = os.environ.get('DOOR_ID', DEFAULT_DOOR_ID)  # When the request names no door
+DOOR_IDS = door_ids(os.environ.get('DOOR_IDS'))  # Doors requests may name; empty allows any
+
+# Per-IP and per-door limits, checked before any passcode lookup
+VALIDATE_IP_LIMIT = Limit(
+    rate=float(os.environ.get('VALIDATE_IP_RATE', '1')),
+    burst=int(os.environ.get('VALIDATE_IP_BURST', '5')),
+    window_seconds=60,
+    window_max=int(os.environ.get('VALIDATE_IP_PER_MINUTE', '20')),
+    lockout=True
+)
+VALIDATE_DOOR_LIMIT = Limit(
+    rate=float(os.environ.get('VALIDATE_DOOR_RATE', '10')),
+    burst=int(os.environ.get('VALIDATE_DOOR_BURST', '20')),
+    window_seconds=60,
+    window_max=int(os.environ.get('VALIDATE_DOOR_PER_MINUTE', '300'))
+)
+VALIDATE_LOCKOUT_THRESHOLD = int(os.environ.get('VALIDATE_LOCKOUT_THRESHOLD', '5'))
 
+limiter = RateLimiter(
+    registry.lazy_table(COOLDOWN_TABLE) if COOLDOWN_TABLE else None,
+    {'ip': VALIDATE_IP_LIMIT, 'door': VALIDATE_DOOR_LIMIT},
+    lockout_threshold=VALIDATE_LOCKOUT_THRESHOLD
+)
 
+
+@metrics.handler
 def handler(event, context):
     print(f"Event: {json.dumps(event)}")
     
@@ -22,21 +50,37 @@ def handler(event, context):
         body = json.loads(event.get('body', '{}'))
         otp = body.get('otp', '').strip()
         
+        door_id = parse_door_id(body.get('doorId'), DOOR_ID, DOOR_IDS)
+        
         if not otp:
             return response(400, {'valid': False, 'message': 'OTP required'})
+        if not door_id:
+            return response(400, {'valid': False, 'message': 'Invalid door'})
         
-        result = validate_otp(otp)
+        ip = event.get('requestContext', {}).get('identity', {}).get('sourceIp', 'unknown')
+        reason, retry_after = limiter.check({'ip': ip, 'door': door_id})
+        if reason:
+            return response(429, {'valid': False, 'reason': reason, 'message': 'Too many attempts. Try again later.'})
+        
+        result = validate_otp(door_id, otp)
         
         if result['valid']:
+            limiter.record_success('ip', ip)
             return response(200, {
                 'valid': True,
                 'message': f"Welcome, {result['name']}! Access granted.",
                 'visitorName': result['name']
             })
         else:
+            if result['reason'] == MISSING:
+                limiter.record_failure('ip', ip)
+            message = 'Permission denied. Invalid or expired OTP.'
+            if result['reason'] == USED:
+                message = 'Permission denied. OTP already used.'
             return response(403, {
                 'valid': False,
-                'message': 'Permission denied. Invalid or expired OTP.'
+                'reason': result['reason'],
+                'message': message
             })
             
     except Exception as e:
@@ -44,28 +88,18 @@ def handler(event, context):
         return response(500, {'valid': False, 'message': str(e)})
 
 
-def validate_otp(otp):
-    passcodes = dynamodb.Table(PASSCODES_TABLE)
-    now = int(time.time())
-    
-    resp = passcodes.get_item(Key={'otp': otp})
+def validate_otp(door_id, otp):
+    passcodes = registry.table(PASSCODES_TABLE)
     
-    if 'Item' not in resp:
-        return {'valid': False}
+    # Check expiry and mark used in one conditional write
+    outcome, item = consume_otp(passcodes, door_id, otp)
     
-    item = resp['Item']
-    ttl = item.get('ttl', 0)
-    
-    # Check expiration
-    if now > ttl:
-        passcodes.delete_item(Key={'otp': otp})
-        return {'valid': False}
+    if outcome != GRANTED:
+        print(f"OTP rejected: {outcome}")
+        return {'valid': False, 'reason': outcome}
     
     name = item.get('visitorName', 'Visitor')
     
-    # Delete used OTP (one-time use)
-    passcodes.delete_item(Key={'otp': otp})
-    
     # Log access
     print(f"ACCESS GRANTED: {datetime.utcnow().isoformat()} - {name}")
     
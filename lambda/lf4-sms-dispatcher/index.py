@@ -0,0 +1,247 @@
+"""
+LF4 - SMS Dispatcher Lambda Function
+Drains the SMS outbox queue in batches and publishes each SMS through SNS
+under per-destination and global rate limits, with jittered backoff.
+Also flushes owner alert digests into single messages
+"""
+
+import json
+import os
+import random
+import time
+from botocore.exceptions import ClientError
+
+from common.clients import registry
+from common.cooldown import CooldownCache
+from common.digest import OwnerDigest, format_alerts
+from common.door_trace import record_hops
+from common.limiter import Limit, RateLimiter
+from common.metrics import metrics
+from common.otp import revoke_otp
+from common.outbox import DIGEST, MAX_DELAY_SECONDS, RETRYABLE_ERRORS, TOPIC, SmsOutbox, publish_sms
+
+# AWS clients - each is created on first use
+sqs_client = registry.lazy_client('sqs')
+sns_client = registry.lazy_client('sns')
+
+# Environment variables
+SMS_QUEUE_URL = os.environ.get('SMS_QUEUE_URL')
+COOLDOWN_TABLE = os.environ.get('COOLDOWN_TABLE', 'smartdoor-cooldowns-dev')
+PASSCODES_TABLE = os.environ.get('PASSCODES_TABLE', 'smartdoor-passcodes-v2-dev')
+
+# Account-wide SMS throughput (the SNS default is 20 messages per second)
+SMS_GLOBAL_LIMIT = Limit(
+    rate=float(os.environ.get('SMS_GLOBAL_RATE', '20')),
+    burst=int(os.environ.get('SMS_GLOBAL_BURST', '20')),
+    window_seconds=60,
+    window_max=int(os.environ.get('SMS_GLOBAL_PER_MINUTE', '1200'))
+)
+# Per phone number, so one busy owner cannot starve visitors' OTPs
+SMS_DESTINATION_LIMIT = Limit(
+    rate=float(os.environ.get('SMS_DESTINATION_RATE', '0.2')),
+    burst=int(os.environ.get('SMS_DESTINATION_BURST', '3')),
+    window_seconds=60,
+    window_max=int(os.environ.get('SMS_DESTINATION_PER_MINUTE', '10'))
+)
+
+# Identical SMS (same number and text) are sent once within this window
+SMS_DEDUP_SECONDS = int(os.environ.get('SMS_DEDUP_SECONDS', '300'))
+
+# Retries of throttled or failed publishes: full jitter over an exponential cap
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 900
+# Rate-limit waits up to this long are slept through instead of requeued
+MAX_WAIT_SECONDS = 1.0
+
+# Outcomes of dispatch_record
+SENT = 'sent'
+FLUSHED = 'flushed'
+DUPLICATE = 'duplicate'
+DEFERRED = 'deferred'
+REQUEUED = 'requeued'
+DROPPED = 'dropped'
+
+# Tables
+cooldowns_table = registry.lazy_table(COOLDOWN_TABLE)
+passcodes_table = registry.lazy_table(PASSCODES_TABLE)
+
+# Survive across warm invocations; shared state lives in the cooldowns table
+sms_limiter = RateLimiter(
+    cooldowns_table,
+    {'destination': SMS_DESTINATION_LIMIT, 'global': SMS_GLOBAL_LIMIT}
+)
+sms_dedup = CooldownCache(cooldowns_table, SMS_DEDUP_SECONDS)
+owner_digest = OwnerDigest(cooldowns_table)
+sms_outbox = SmsOutbox(SMS_QUEUE_URL, sqs_client, sns_client)
+
+
+@metrics.handler
+def lambda_handler(event, context):
+    """
+    Handle a batch of SQS messages from the SMS outbox
+    Each body is an intent written by common.outbox.SmsOutbox, e.g. an SMS:
+    {
+        "phoneNumber": "+12025551234",
+        "message": "...",
+        "dedupKey": "...",
+        "enqueuedAt": 1701432596.1,
+        "passcode": {"doorId": "front", "otp": "123456"} (optional),
+        "trace": {"capturedAt": 1701432594.8, ...} (optional, common.door_trace)
+    }
+    or a topic publish ("kind": "topic") or a digest flush ("kind": "digest")
+    Deferred messages are reported as batch item failures and come back
+    once their visibility timeout runs out; messages held back by the rate
+    limits are requeued with a delay instead, so the wait does not count
+    toward the queue's maxReceiveCount
+    """
+    records = event.get('Records', [])
+    outcomes = {SENT: 0, FLUSHED: 0, DUPLICATE: 0, DEFERRED: 0, REQUEUED: 0, DROPPED: 0}
+    failures = []
+    
+    for record in records:
+        try:
+            with metrics.timer('dispatch') as timer:
+                outcome = timer.outcome = dispatch_record(record)
+        except Exception as e:
+            print(f"Error dispatching message {record.get('messageId')}: {str(e)}")
+            failures.append(record['messageId'])
+            continue
+        outcomes[outcome] += 1
+        if outcome == DEFERRED:
+            failures.append(record['messageId'])
+    
+    print(f"Dispatched {len(records)} messages: {json.dumps(outcomes)}")
+    return {'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failures]}
+
+
+def dispatch_record(record: dict) -> str:
+    """
+    Send one queued SMS or topic publish, unless it duplicates one already
+    sent, or flush an owner digest
+    Returns SENT, FLUSHED, DUPLICATE, DEFERRED, REQUEUED or DROPPED
+    """
+    intent = json.loads(record['body'])
+    kind = intent.get('kind')
+    if kind == DIGEST:
+        return flush_digest(intent)
+    
+    destination = intent['topicArn'] if kind == TOPIC else intent['phoneNumber']
+    receives = int(record.get('attributes', {}).get('ApproximateReceiveCount', 1))
+    
+    # Duplicates are dropped before they can take rate-limit tokens
+    dedup_key = f"sms#{intent['dedupKey']}"
+    if not sms_dedup.acquire(dedup_key):
+        print(f"Dropped duplicate message to {destination}")
+        return DUPLICATE
+    
+    # Topic publishes (owner email) are not subject to SMS throughput
+    if kind != TOPIC:
+        reason, retry_after = sms_limiter.check({'destination': destination, 'global': 'sns'})
+        if reason and retry_after <= MAX_WAIT_SECONDS:
+            time.sleep(retry_after)
+            reason, retry_after = sms_limiter.check({'destination': destination, 'global': 'sns'})
+        if reason:
+            # Release the claim, or the requeued message would be dropped as a duplicate
+            sms_dedup.release(dedup_key)
+            requeue(record, retry_after + random.uniform(0, BACKOFF_BASE_SECONDS))
+            return REQUEUED
+    
+    try:
+        if kind == TOPIC:
+            response = sns_client.publish(
+                TopicArn=destination, Subject=intent['subject'], Message=intent['message']
+            )
+        else:
+            response = publish_sms(sns_client, destination, intent['message'])
+    except ClientError as e:
+        # Release the claim, or the retry would be dropped as a duplicate
+        sms_dedup.release(dedup_key)
+        code = e.response['Error']['Code']
+        if code in RETRYABLE_ERRORS:
+            delay = backoff_seconds(receives)
+            print(f"SNS {code} for {destination}, retrying in {delay:.0f}s")
+            defer(record, delay)
+            return DEFERRED
+        print(f"Undeliverable message to {destination}: {code}")
+        revoke_passcode(intent.get('passcode'))
+        return DROPPED
+    except Exception:
+        sms_dedup.release(dedup_key)
+        raise
+    
+    published_at = time.time()
+    queued_for = published_at - intent.get('enqueuedAt', published_at)
+    metrics.record('queue_wait', queued_for * 1000)
+    # Completes the door-to-SMS trace LF1 started for the detection
+    record_hops(intent.get('trace'), published_at=published_at)
+    print(f"Sent to {destination}: MessageId={response['MessageId']}, queued {queued_for:.2f}s")
+    return SENT
+
+
+def flush_digest(intent: dict) -> str:
+    """
+    Turn an owner digest into one queued SMS and one topic publish
+    Returns FLUSHED, or DUPLICATE if the digest was already flushed
+    """
+    alerts = owner_digest.take(intent['digestKey'], intent['windowId'])
+    if not alerts:
+        return DUPLICATE
+    
+    sms, subject, email = format_alerts(alerts, intent.get('doorId', ''))
+    try:
+        if intent.get('phoneNumber'):
+            sms_outbox.send(intent['phoneNumber'], sms)
+        if intent.get('topicArn'):
+            sms_outbox.send_topic(intent['topicArn'], subject, email)
+    except Exception:
+        # Put the alerts back for the retried flush; an SMS already queued
+        # is sent once, as the retry's identical text is deduplicated
+        owner_digest.restore(intent['digestKey'], intent['windowId'], alerts)
+        raise
+    print(f"Flushed digest {intent['digestKey']} with {len(alerts)} alerts")
+    return FLUSHED
+
+
+def backoff_seconds(receives: int) -> float:
+    """
+    Full-jitter exponential backoff for the n-th delivery attempt
+    """
+    cap = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** receives)
+    return max(1.0, random.uniform(0, cap))
+
+
+def defer(record: dict, delay_seconds: float):
+    """
+    Hide a message from the queue until it may be retried
+    """
+    sqs_client.change_message_visibility(
+        QueueUrl=SMS_QUEUE_URL,
+        ReceiptHandle=record['receiptHandle'],
+        VisibilityTimeout=int(min(max(delay_seconds, 1), 43200))
+    )
+
+
+def requeue(record: dict, delay_seconds: float):
+    """
+    Send a message again with a delay, so the original can be deleted
+    Unlike defer, this starts a new receive count, so waiting out the
+    rate limits never moves an SMS to the dead-letter queue
+    """
+    sqs_client.send_message(
+        QueueUrl=SMS_QUEUE_URL,
+        MessageBody=record['body'],
+        DelaySeconds=int(min(max(delay_seconds, 1), MAX_DELAY_SECONDS))
+    )
+
+
+def revoke_passcode(passcode: dict):
+    """
+    Revoke the OTP an undeliverable SMS carried, so the visitor is sent a
+    fresh one on their next detection instead of having it reused
+    """
+    if not passcode:
+        return
+    try:
+        revoke_otp(passcodes_table, passcode['doorId'], passcode['otp'])
+    except Exception as e:
+        print(f"Error revoking passcode: {str(e)}")
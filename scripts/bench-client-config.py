@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Tail-latency benchmark for the shared client settings (common.aws_config)
+Drives DynamoDB GetItem calls from a thread pool against a local HTTP
+stand-in that stalls a fraction of responses, once with botocore's default
+settings and once with the tuned ones, and reports latency percentiles
+
+Usage: ./bench-client-config.py [--calls 600] [--threads 16] [--slow 0.03] [--stall 6]
+Requires boto3 locally; nothing is sent to AWS.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from common.aws_config import client_config  # noqa: E402
+
+ITEM = b'{"Item": {"faceId": {"S": "bench-face"}, "name": {"S": "Bench Visitor"}}}'
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """
+    Answers DynamoDB GetItem with a fixed item; a `slow` fraction of
+    requests is held for `stall` seconds first, like a stuck connection
+    """
+    protocol_version = 'HTTP/1.1'
+    slow = 0.0
+    stall = 0.0
+    lock = threading.Lock()
+    requests = 0
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        with self.lock:
+            StandIn.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        with self.lock:
+            StandIn.requests += 1
+        if random.random() < self.slow:
+            time.sleep(self.stall)
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-amz-json-1.0')
+            self.send_header('Content-Length', str(len(ITEM)))
+            self.end_headers()
+            self.wfile.write(ITEM)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client gave up on this response
+
+    def log_message(self, *args):
+        pass
+
+
+def run(config, endpoint: str, calls: int, threads: int) -> dict:
+    import boto3
+    client = boto3.session.Session().client('dynamodb', endpoint_url=endpoint, config=config)
+    client.get_item(TableName='bench-visitors', Key={'faceId': {'S': 'warm'}})
+    StandIn.requests = StandIn.connections = 0
+
+    def call(_):
+        started = time.perf_counter()
+        try:
+            client.get_item(TableName='bench-visitors', Key={'faceId': {'S': 'bench-face'}})
+            return (time.perf_counter() - started) * 1000, None
+        except Exception as e:
+            return (time.perf_counter() - started) * 1000, type(e).__name__
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(call, range(calls)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(ms for ms, _ in results)
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        'p50': quantiles[49],
+        'p95': quantiles[94],
+        'p99': quantiles[98],
+        'max': latencies[-1],
+        'errors': sum(1 for _, error in results if error),
+        'requests': StandIn.requests,
+        'connections': StandIn.connections,
+        'throughput': calls / elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--calls', type=int, default=600)
+    parser.add_argument('--threads', type=int, default=16, help='Concurrent callers (LF1 runs MAX_WORKERS)')
+    parser.add_argument('--slow', type=float, default=0.03, help='Fraction of responses that stall')
+    parser.add_argument('--stall', type=float, default=6.0, help='Seconds a stalled response takes')
+    args = parser.parse_args()
+
+    os.environ.update({
+        'AWS_ACCESS_KEY_ID': 'bench',
+        'AWS_SECRET_ACCESS_KEY': 'bench',
+        'AWS_DEFAULT_REGION': 'us-east-1'
+    })
+    from botocore.config import Config
+
+    random.seed(18)
+    StandIn.slow, StandIn.stall = args.slow, args.stall
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f'http://127.0.0.1:{server.server_address[1]}'
+
+    configs = {
+        'default': Config(retries={'mode': 'legacy'}),
+        'tuned': client_config('dynamodb', max_pool_connections=args.threads + 2)
+    }
+    print(f"{args.calls} GetItem calls from {args.threads} threads, "
+          f"{args.slow:.0%} of responses stall {args.stall:g}s")
+    print(f"{'settings':<9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>9} {'max ms':>9} "
+          f"{'errors':>7} {'requests':>9} {'conns':>6} {'calls/s':>8}")
+    for name, config in configs.items():
+        result = run(config, endpoint, args.calls, args.threads)
+        print(f"{name:<9} {result['p50']:>8.1f} {result['p95']:>8.1f} {result['p99']:>9.1f} "
+              f"{result['max']:>9.1f} {result['errors']:>7} {result['requests']:>9} "
+              f"{result['connections']:>6} {result['throughput']:>8.1f}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
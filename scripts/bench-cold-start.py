@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the Lambda handlers
+Starts every handler in a fresh interpreter against a local AWS stand-in and
+reports module import time, first (cold) invocation and second (warm) invocation
+
+Usage: ./bench-cold-start.py [--runs N] [handler ...]
+Requires boto3 locally; nothing is sent to AWS.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LAMBDA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'lambda'))
+
+
+def api_event(body):
+    return {'httpMethod': 'POST', 'body': json.dumps(body)}
+
+
+def kinesis_event():
+    import base64
+    record = {
+        'FaceSearchResponse': [{
+            'DetectedFace': {'Confidence': 99.5, 'BoundingBox': {'Width': 0.2, 'Height': 0.3, 'Left': 0.4, 'Top': 0.3}},
+            'MatchedFaces': [{'Similarity': 97.0, 'Face': {'FaceId': 'bench-face'}}]
+        }],
+        'InputInformation': {'KinesisVideo': {'FragmentNumber': '91343852333181432392682062607743920146264271040'}}
+    }
+    data = base64.b64encode(json.dumps(record).encode()).decode()
+    return {'Records': [{'kinesis': {'data': data, 'sequenceNumber': '1'}}]}
+
+
+# name -> (module directory, module name, handler function, event)
+HANDLERS = {
+    'lf1-stream-processor': ('lf1-stream-processor', 'index', 'lambda_handler', kinesis_event()),
+    'lf2-visitor-registration': ('lf2-visitor-registration', 'index', 'lambda_handler', api_event(
+        {'name': 'Bench Visitor', 'phoneNumber': '+12025550100', 'photoKey': 'visitors/bench.jpg'})),
+    'lf3-otp-validator': ('lf3-otp-validator', 'index', 'lambda_handler', api_event({'otp': '123456'})),
+    'lf1_process': ('.', 'lf1_process', 'handler', kinesis_event()),
+    'lf2_register': ('.', 'lf2_register', 'handler', api_event(
+        {'name': 'Bench Visitor', 'phoneNumber': '+12025550100', 'faceId': 'pending_1', 'photoKey': 'visitors/bench.jpg'})),
+    'lf3_validate': ('.', 'lf3_validate', 'handler', api_event({'otp': '123456'})),
+}
+
+CHILD = r'''
+import json, sys, time
+started = time.perf_counter()
+sys.path[:0] = [sys.argv[1], sys.argv[2]]
+module = __import__(sys.argv[3])
+imported = time.perf_counter()
+handler = getattr(module, sys.argv[4])
+event = json.loads(sys.argv[5])
+import contextlib, io
+with contextlib.redirect_stdout(io.StringIO()):
+    handler(event, None)
+    first = time.perf_counter()
+    handler(event, None)
+    second = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_ms': (first - imported) * 1000,
+    'warm_ms': (second - first) * 1000,
+    'modules': len(sys.modules)
+}))
+'''
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """
+    Answers every AWS call with an empty success in the protocol it expects:
+    JSON for DynamoDB/Rekognition, query XML for SNS, empty body for S3
+    """
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8', 'replace')
+        if self.headers.get('X-Amz-Target'):
+            payload, content_type = b'{}', 'application/x-amz-json-1.0'
+        elif 'Action=' in body:
+            action = body.split('Action=')[1].split('&')[0]
+            payload = (
+                f'<{action}Response><{action}Result><MessageId>bench</MessageId>'
+                f'</{action}Result></{action}Response>'
+            ).encode()
+            content_type = 'text/xml'
+        else:
+            payload, content_type = b'', 'application/xml'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+def run_once(name: str, endpoint: str) -> dict:
+    directory, module, function, event = HANDLERS[name]
+    env = dict(
+        os.environ,
+        AWS_ACCESS_KEY_ID='bench',
+        AWS_SECRET_ACCESS_KEY='bench',
+        AWS_DEFAULT_REGION='us-east-1',
+        AWS_ENDPOINT_URL=endpoint,
+        VISITORS_TABLE='bench-visitors',
+        PASSCODES_TABLE='bench-passcodes',
+        PHOTOS_BUCKET='bench-photos',
+        COLLECTION_ID='bench-faces',
+        OWNER_PHONE='+12025550199'
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, os.path.join(LAMBDA_DIR, directory), LAMBDA_DIR,
+         module, function, json.dumps(event)],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('handlers', nargs='*', help=f"Subset of: {', '.join(HANDLERS)}")
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+    unknown = set(args.handlers) - set(HANDLERS)
+    if unknown:
+        parser.error(f"Unknown handlers: {', '.join(sorted(unknown))}")
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f'http://127.0.0.1:{server.server_address[1]}'
+
+    print(f"{'handler':<26} {'import ms':>10} {'cold call ms':>13} {'warm call ms':>13} {'modules':>8}")
+    for name in args.handlers or HANDLERS:
+        results = [run_once(name, endpoint) for _ in range(args.runs)]
+        median = {key: statistics.median(r[key] for r in results) for key in results[0]}
+        print(f"{name:<26} {median['import_ms']:>10.1f} {median['first_ms']:>13.1f} "
+              f"{median['warm_ms']:>13.1f} {median['modules']:>8.0f}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Overhead of the handler instrumentation (common.metrics)
+Times stage timers against a bare loop, botocore calls with and without
+the metrics hooks (answered by a Stubber, so only client-side work is
+measured) and the hooks on their own, and the once-per-invocation EMF
+flush of an LF1-sized batch
+
+Usage: ./bench-metrics.py [--timers 200000] [--calls 2000] [--flushes 2000]
+Requires boto3 locally; nothing is sent to AWS.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+import boto3  # noqa: E402
+from botocore.stub import Stubber  # noqa: E402
+
+from common.metrics import Metrics  # noqa: E402
+
+# Stages and calls of one LF1 invocation with a handful of visitors:
+# (stage, samples)
+LF1_INVOCATION = [
+    ('invocation', 1), ('decode', 1), ('cooldown', 1), ('visitors', 1), ('group', 1), ('photos', 1),
+    ('overflow_search', 1), ('notify', 1), ('photo.keyframe', 4), ('photo.jpeg', 4), ('photo.variants', 4),
+    ('dynamodb.UpdateItem', 6), ('dynamodb.BatchGetItem', 1), ('dynamodb.PutItem', 6),
+    ('dynamodb.BatchWriteItem', 1), ('kinesis-video-archived-media.GetMediaForFragmentList', 4),
+    ('s3.PutObject', 12), ('rekognition.SearchFacesByImage', 4), ('sqs.SendMessage', 6)
+]
+
+
+def per_call_ns(function, repeat: int) -> float:
+    started = time.perf_counter_ns()
+    function(repeat)
+    return (time.perf_counter_ns() - started) / repeat
+
+
+def bench_timers(repeat: int) -> tuple:
+    metrics = Metrics(mode='emf', emit=lambda text: None)
+
+    def bare(n):
+        for _ in range(n):
+            pass
+
+    def timed(n):
+        timer = metrics.timer
+        for _ in range(n):
+            with timer('stage'):
+                pass
+
+    def counted(n):
+        count = metrics.count
+        for _ in range(n):
+            count('Records')
+
+    baseline = min(per_call_ns(bare, repeat) for _ in range(3))
+    timer_ns = min(per_call_ns(timed, repeat) for _ in range(3)) - baseline
+    metrics.flush()
+    count_ns = min(per_call_ns(counted, repeat) for _ in range(3)) - baseline
+    return timer_ns, count_ns
+
+
+def bench_calls(repeat: int, rounds: int = 5) -> tuple:
+    """
+    Nanoseconds per GetItem through a stubbed client, without and with
+    hooks; the clients take turns and the fastest round of each counts
+    """
+    metrics = Metrics(mode='emf', emit=lambda text: None)
+    runs = []
+    for watched in (False, True):
+        client = boto3.client('dynamodb', region_name='us-east-1',
+                              aws_access_key_id='bench', aws_secret_access_key='bench')
+        if watched:
+            metrics.watch(client)
+        stubber = Stubber(client)
+        for _ in range(repeat * rounds + 50):
+            stubber.add_response('get_item', {'Item': {'faceId': {'S': 'bench-face'}}})
+        stubber.activate()
+
+        def calls(n, client=client):
+            for _ in range(n):
+                client.get_item(TableName='visitors', Key={'faceId': {'S': 'bench-face'}})
+
+        calls(50)  # Warm up the client's operation model caches
+        runs.append(calls)
+
+    best = [float('inf'), float('inf')]
+    for _ in range(rounds):
+        for index, calls in enumerate(runs):
+            best[index] = min(best[index], per_call_ns(calls, repeat))
+    recorded = sum(len(values) for values in metrics._timings.values())
+    assert recorded == repeat * rounds + 50, f"{recorded} calls recorded"
+    return tuple(best)
+
+
+def bench_hooks(repeat: int) -> float:
+    """
+    Nanoseconds the before-call and after-call handlers add to one call
+    """
+    metrics = Metrics(mode='emf', emit=lambda text: None)
+    client = boto3.client('dynamodb', region_name='us-east-1',
+                          aws_access_key_id='bench', aws_secret_access_key='bench')
+    model = client.meta.service_model.operation_model('GetItem')
+
+    class Response:
+        status_code = 200
+
+    def hooks(n):
+        response, parsed = Response(), {}
+        for _ in range(n):
+            context = {}
+            metrics._before_call(context=context)
+            metrics._after_call(http_response=response, parsed=parsed, model=model, context=context)
+
+    return min(per_call_ns(hooks, repeat) for _ in range(3))
+
+
+def bench_flush(repeat: int) -> tuple:
+    """
+    Microseconds and bytes for writing one LF1-sized invocation
+    """
+    written = []
+    metrics = Metrics(mode='emf', emit=written.append)
+    counts = ('Records', 'Detections', 'KnownVisitors', 'UnknownVisitors', 'Notifications', 'FailedRecords')
+    elapsed = 0
+    for run in range(repeat):
+        for stage, samples in LF1_INVOCATION:
+            for sample in range(samples):
+                metrics.record(stage, 3.7 * (sample + 1) + run % 7)
+        for name in counts:
+            metrics.count(name, 3)
+        started = time.perf_counter_ns()
+        metrics.flush()
+        elapsed += time.perf_counter_ns() - started
+    return elapsed / repeat / 1000, len(written[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--timers', type=int, default=200000, help='Timed blocks per run')
+    parser.add_argument('--calls', type=int, default=2000, help='Stubbed AWS calls per client and round')
+    parser.add_argument('--flushes', type=int, default=2000, help='Invocations flushed')
+    args = parser.parse_args()
+
+    timer_ns, count_ns = bench_timers(args.timers)
+    print(f"stage timer           {timer_ns:>8.0f} ns per timed block")
+    print(f"counter               {count_ns:>8.0f} ns per increment")
+
+    plain_ns, watched_ns = bench_calls(args.calls)
+    print(f"AWS call, no hooks    {plain_ns / 1000:>8.1f} us client-side")
+    print(f"AWS call, hooks       {watched_ns / 1000:>8.1f} us client-side "
+          f"({(watched_ns - plain_ns) / 1000:+.1f} us, {watched_ns / plain_ns - 1:+.1%})")
+
+    hook_ns = bench_hooks(args.timers // 4)
+    print(f"hooks alone           {hook_ns / 1000:>8.1f} us per call")
+
+    flush_us, size = bench_flush(args.flushes)
+    stages = sum(samples for _, samples in LF1_INVOCATION)
+    per_invocation_us = flush_us + (
+        stages * max(hook_ns, timer_ns) + 6 * count_ns
+    ) / 1000
+    print(f"EMF flush             {flush_us:>8.1f} us per invocation ({len(LF1_INVOCATION)} stages, "
+          f"{stages} samples, {size} bytes of log)")
+    print(f"\nLF1 invocation total  {per_invocation_us:>8.1f} us, "
+          f"{per_invocation_us / 1000 / 100:.2%} of a 100 ms invocation")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark the LF1 streaming MKV keyframe extractor
+Runs offline against recorded KVS fragments, or a synthetic fragment if none are given
+
+Record a fragment with:
+  aws kinesis-video-archived-media get-media-for-fragment-list \
+    --endpoint-url <endpoint> --stream-name <stream> \
+    --fragments <fragment-number> fragment.mkv
+
+Usage: ./bench-mkv-extract.py [fragment.mkv ...] [--fragment-number N] [--runs N]
+"""
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda', 'lf1-stream-processor'))
+import mkv  # noqa: E402
+from standins import synthetic_fragment  # noqa: E402
+
+BASELINE_READ_BYTES = 1024 * 1024  # What extract_and_upload_photo used to read
+
+
+class CountingStream(io.RawIOBase):
+    """File wrapper that counts how many bytes the parser pulled"""
+
+    def __init__(self, data: bytes):
+        self.inner = io.BytesIO(data)
+        self.bytes_read = 0
+
+    def read(self, n=-1):
+        chunk = self.inner.read(n)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+def bench(name: str, data: bytes, fragment_number: str, runs: int):
+    times = []
+    keyframe = None
+    bytes_read = 0
+    for _ in range(runs):
+        stream = CountingStream(data)
+        started = time.perf_counter()
+        keyframe = mkv.read_first_keyframe(stream, fragment_number)
+        times.append((time.perf_counter() - started) * 1000)
+        bytes_read = stream.bytes_read
+
+    print(f"\n{name}")
+    print(f"  payload size:        {len(data):>10,} bytes")
+    print(f"  baseline read:       {min(len(data), BASELINE_READ_BYTES):>10,} bytes")
+    print(f"  streaming read:      {bytes_read:>10,} bytes")
+    if not keyframe:
+        print("  no keyframe found")
+        return
+    print(f"  keyframe:            {len(keyframe.data):>10,} bytes ({keyframe.codec_id}, "
+          f"{keyframe.width}x{keyframe.height}, fragment {keyframe.fragment_number})")
+    print(f"  time to first frame: p50 {statistics.median(times):.3f} ms, max {max(times):.3f} ms")
+
+    started = time.perf_counter()
+    photo = mkv.keyframe_to_jpeg(keyframe, {'Width': 0.2, 'Height': 0.3, 'Left': 0.4, 'Top': 0.3})
+    elapsed = (time.perf_counter() - started) * 1000
+    if photo:
+        print(f"  jpeg encode:         {len(photo):>10,} bytes in {elapsed:.2f} ms")
+    else:
+        print("  jpeg encode:         skipped (no decoder installed for this codec)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('files', nargs='*', help='Recorded MKV fragments')
+    parser.add_argument('--fragment-number', help='Only accept keyframes from this fragment')
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.files:
+        for path in args.files:
+            with open(path, 'rb') as f:
+                bench(path, f.read(), args.fragment_number, args.runs)
+    else:
+        fragment_number = args.fragment_number or '91343852333181432392682062607743920146264271040'
+        data = synthetic_fragment(fragment_number)
+        bench('synthetic fragment (150 MJPEG frames)', data, fragment_number, args.runs)
+
+
+if __name__ == '__main__':
+    main()
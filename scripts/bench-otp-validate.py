@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Benchmark for LF3 OTP validation
+Compares the old lookup (get_item + ttl check + delete_item) with the single
+conditional write in common.otp.consume_otp, and races concurrent submissions
+of the same code against both
+
+Usage:
+  ./bench-otp-validate.py [--runs 200] [--rtt-ms 8]     # in-memory table with simulated round trips
+  ./bench-otp-validate.py --table smartdoor-passcodes-v2-dev  # real table (or AWS_ENDPOINT_URL)
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda'))
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+from common.clients import registry  # noqa: E402
+from common.otp import GRANTED, consume_otp  # noqa: E402
+
+DOOR_ID = 'bench'
+
+
+class SimulatedTable:
+    """
+    In-memory passcodes table; every call sleeps for one simulated round trip
+    """
+
+    def __init__(self, rtt_ms: float):
+        self.rtt_ms = rtt_ms
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def _round_trip(self):
+        time.sleep(max(0.0, random.gauss(self.rtt_ms, self.rtt_ms * 0.15)) / 1000)
+
+    def put_item(self, Item, **kwargs):
+        self._round_trip()
+        with self.lock:
+            self.items[(Item['doorId'], Item['otp'])] = dict(Item)
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        self._round_trip()
+        with self.lock:
+            item = self.items.get((Key['doorId'], Key['otp']))
+        return {'Item': dict(item)} if item else {}
+
+    def delete_item(self, Key, **kwargs):
+        self._round_trip()
+        with self.lock:
+            self.items.pop((Key['doorId'], Key['otp']), None)
+        return {}
+
+    def update_item(self, Key, ExpressionAttributeValues, **kwargs):
+        # Mirrors consume_otp's condition: exists AND ttl > :now AND not used
+        self._round_trip()
+        now = ExpressionAttributeValues[':now']
+        with self.lock:
+            item = self.items.get((Key['doorId'], Key['otp']))
+            if not item or item['ttl'] <= now or 'usedAt' in item:
+                failed = {}
+                if item:
+                    failed = {name: {'N': str(value)} for name, value in item.items()
+                              if name in ('ttl', 'usedAt')}
+                raise ClientError(
+                    {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'failed'},
+                     'Item': failed},
+                    'UpdateItem'
+                )
+            old = dict(item)
+            item['usedAt'] = now
+        return {'Attributes': old}
+
+
+def legacy_validate(table, otp: str) -> bool:
+    response = table.get_item(Key={'doorId': DOOR_ID, 'otp': otp})
+    if 'Item' not in response:
+        return False
+    if int(time.time()) > int(response['Item'].get('ttl', 0)):
+        table.delete_item(Key={'doorId': DOOR_ID, 'otp': otp})
+        return False
+    table.delete_item(Key={'doorId': DOOR_ID, 'otp': otp})
+    return True
+
+
+def atomic_validate(table, otp: str) -> bool:
+    outcome, _ = consume_otp(table, DOOR_ID, otp)
+    return outcome == GRANTED
+
+
+def seed(table, otp: str, ttl_seconds: int = 300):
+    table.put_item(Item={
+        'doorId': DOOR_ID,
+        'otp': otp,
+        'faceId': 'bench-face',
+        'visitorName': 'Bench Visitor',
+        'ttl': int(time.time()) + ttl_seconds
+    })
+
+
+def latency(validate, table, runs: int) -> list:
+    times = []
+    for i in range(runs):
+        otp = f'{900000 + i:06d}'
+        seed(table, otp)
+        started = time.perf_counter()
+        validate(table, otp)
+        times.append((time.perf_counter() - started) * 1000)
+    return times
+
+
+def race(validate, table, submissions: int) -> int:
+    otp = '999999'
+    seed(table, otp)
+    barrier = threading.Barrier(submissions)
+
+    def submit(_):
+        barrier.wait()
+        return validate(table, otp)
+
+    with ThreadPoolExecutor(max_workers=submissions) as executor:
+        return sum(executor.map(submit, range(submissions)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=200)
+    parser.add_argument('--rtt-ms', type=float, default=8.0, help='Simulated DynamoDB round trip')
+    parser.add_argument('--concurrent', type=int, default=8, help='Simultaneous submissions of one code')
+    parser.add_argument('--table', help='Benchmark against a real passcodes table instead')
+    args = parser.parse_args()
+
+    random.seed(528)
+    table = registry.table(args.table) if args.table else SimulatedTable(args.rtt_ms)
+    target = args.table or f'in-memory table, {args.rtt_ms:g} ms round trip'
+    print(f"OTP validation ({target}, {args.runs} runs)")
+
+    results = {}
+    for name, validate in (('get + delete', legacy_validate), ('consume_otp', atomic_validate)):
+        times = latency(validate, table, args.runs)
+        grants = race(validate, table, args.concurrent)
+        results[name] = statistics.median(times)
+        print(f"  {name:<13} p50 {statistics.median(times):7.2f} ms  "
+              f"p95 {statistics.quantiles(times, n=20)[-1]:7.2f} ms  "
+              f"grants for {args.concurrent} concurrent submissions: {grants}")
+
+    print(f"  speedup: {results['get + delete'] / results['consume_otp']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Bytes the approval page downloads per alert, original photo vs variants
+Renders the thumbnail and display variants (common.photo_variants) of
+synthetic camera photos and estimates the time to first photo on a
+cellular link from their sizes
+
+Usage: ./bench-photo-variants.py [--mbps 1.5] [--rtt-ms 120] [--runs 5]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from PIL import Image, ImageDraw, ImageFilter  # noqa: E402
+
+from common.photo_variants import render_variants  # noqa: E402
+
+# (label, width, height, JPEG quality of the stored photo)
+PHOTOS = [
+    ('face crop 480x480', 480, 480, 85),
+    ('MJPEG frame 1280x720', 1280, 720, 90),
+    ('MJPEG frame 1920x1080', 1920, 1080, 90)
+]
+
+
+def camera_photo(width: int, height: int, quality: int) -> bytes:
+    """
+    A doorstep-like scene: gradients and shapes with sensor noise, which
+    compresses about as badly as a real camera frame
+    """
+    scene = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    draw = ImageDraw.Draw(scene)
+    draw.rectangle((width * 0.1, height * 0.2, width * 0.35, height), fill=(120, 80, 50))
+    draw.ellipse((width * 0.4, height * 0.15, width * 0.65, height * 0.6), fill=(210, 170, 140))
+    draw.rectangle((width * 0.38, height * 0.6, width * 0.67, height), fill=(40, 60, 110))
+    noise = Image.effect_noise((width, height), 24).convert('RGB')
+    photo = Image.blend(scene.filter(ImageFilter.GaussianBlur(2)), noise, 0.18)
+    output = io.BytesIO()
+    photo.save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+
+def transfer_ms(size: int, mbps: float, rtt_ms: float) -> float:
+    """
+    One request on a warm connection: a round trip plus the bytes at the link rate
+    """
+    return rtt_ms + size * 8 / (mbps * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--mbps', type=float, default=1.5, help='Cellular downlink')
+    parser.add_argument('--rtt-ms', type=float, default=120.0)
+    parser.add_argument('--runs', type=int, default=5, help='Renders timed per photo')
+    args = parser.parse_args()
+
+    print(f"Link {args.mbps:g} Mbit/s, {args.rtt_ms:g} ms RTT")
+    print(f"{'photo':<22} {'original':>9} {'thumb':>7} {'display':>8} {'first photo ms':>15} "
+          f"{'egress':>8} {'render ms':>10}")
+    for label, width, height, quality in PHOTOS:
+        photo = camera_photo(width, height, quality)
+        started = time.perf_counter()
+        for _ in range(args.runs):
+            variants = render_variants(photo)
+        render_ms = (time.perf_counter() - started) * 1000 / args.runs
+
+        original, thumbnail, display = len(photo), len(variants['thumbnail']), len(variants['display'])
+        before = transfer_ms(original, args.mbps, args.rtt_ms)
+        after = transfer_ms(thumbnail, args.mbps, args.rtt_ms)
+        print(f"{label:<22} {original / 1024:>8.1f}K {thumbnail / 1024:>6.1f}K {display / 1024:>7.1f}K "
+              f"{before:>6.0f} -> {after:<5.0f} {(thumbnail + display) / original:>7.0%} {render_ms:>10.1f}")
+    print("egress: thumbnail + display variant as a share of the original; first photo: thumbnail vs original")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for LF1 Kinesis record decoding
+Compares the old decode path (b64 + json.loads + json.dumps[:500] log line)
+with records.decode_record on synthetic Rekognition output
+
+Usage: ./bench-record-decode.py [--records N] [--face-ratio 0.2]
+"""
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda', 'lf1-stream-processor'))
+import records  # noqa: E402
+
+
+def synthetic_record(with_face: bool, sequence: int) -> dict:
+    faces = []
+    if with_face:
+        faces.append({
+            'DetectedFace': {
+                'BoundingBox': {'Height': 0.31, 'Width': 0.18, 'Left': 0.41, 'Top': 0.27},
+                'Confidence': 99.7,
+                'Landmarks': [{'X': random.random(), 'Y': random.random(), 'Type': t}
+                              for t in ('eyeLeft', 'eyeRight', 'nose', 'mouthLeft', 'mouthRight')],
+                'Pose': {'Pitch': 1.2, 'Roll': -3.4, 'Yaw': 5.6},
+                'Quality': {'Brightness': 71.2, 'Sharpness': 86.9}
+            },
+            'MatchedFaces': [{
+                'Similarity': 97.3,
+                'Face': {
+                    'BoundingBox': {'Height': 0.5, 'Width': 0.4, 'Left': 0.3, 'Top': 0.2},
+                    'FaceId': f'{sequence:08d}-0000-4000-8000-000000000000',
+                    'Confidence': 99.9,
+                    'ImageId': f'{sequence:08d}-1111-4000-8000-000000000000',
+                    'ExternalImageId': 'visitor'
+                }
+            }]
+        })
+    data = {
+        'InputInformation': {'KinesisVideo': {
+            'StreamArn': 'arn:aws:kinesisvideo:us-east-1:123456789012:stream/smartdoor-video-stream-dev/1',
+            'FragmentNumber': str(91343852333181432392682062607743920146264271040 + sequence),
+            'ServerTimestamp': 1.7e9 + sequence,
+            'ProducerTimestamp': 1.7e9 + sequence - 0.4,
+            'FrameOffsetInSeconds': 0.5
+        }},
+        'StreamProcessorInformation': {'Status': 'RUNNING'},
+        'FaceSearchResponse': faces
+    }
+    return {'kinesis': {
+        'data': base64.b64encode(json.dumps(data).encode()).decode(),
+        'sequenceNumber': str(sequence)
+    }}
+
+
+def baseline_decode(record: dict, index: int):
+    payload = base64.b64decode(record['kinesis']['data'])
+    data = json.loads(payload)
+    print(f"Processing record: {json.dumps(data, default=str)[:500]}")
+    return data if data.get('FaceSearchResponse') else None
+
+
+def measure(decode, batch: list) -> float:
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        for index, record in enumerate(batch):
+            decode(record, index)
+        elapsed = time.perf_counter() - started
+    return len(batch) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--records', type=int, default=20000)
+    parser.add_argument('--face-ratio', type=float, default=0.2,
+                        help='Fraction of records that contain a face')
+    args = parser.parse_args()
+
+    random.seed(528)
+    batch = [synthetic_record(random.random() < args.face_ratio, i) for i in range(args.records)]
+
+    baseline = measure(baseline_decode, batch)
+    selective = measure(records.decode_record, batch)
+
+    print(f"records: {args.records:,}  face ratio: {args.face_ratio:.0%}  json backend: {records.JSON_BACKEND}")
+    print(f"  baseline decode:  {baseline:>12,.0f} records/s")
+    print(f"  selective decode: {selective:>12,.0f} records/s  ({selective / baseline:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
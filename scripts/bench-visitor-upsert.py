@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Cost of registering a photo for a visitor who already has n photos
+Compares the former read-modify-write of the photos list with the upsert
+plus photo history item (common.visitors): round trips, bytes written,
+write capacity units and the size of the visitor item
+
+Usage: ./bench-visitor-upsert.py [--photos 1,10,100,1000,3000]
+"""
+import argparse
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from common.visitors import add_photo, photo_record, upsert_visitor  # noqa: E402
+
+ITEM_LIMIT = 400 * 1024
+BUCKET = 'smartdoor-visitor-photos-123456789012'
+
+
+def attribute_size(value) -> int:
+    """
+    DynamoDB's size rules, roughly: strings by UTF-8 length, numbers by
+    digits, maps and lists by their contents plus a few bytes each
+    """
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, (int, float)):
+        return math.ceil(len(str(value)) / 2) + 1
+    if isinstance(value, dict):
+        return 3 + sum(len(name.encode()) + attribute_size(item) + 1 for name, item in value.items())
+    if isinstance(value, list):
+        return 3 + sum(attribute_size(item) + 1 for item in value)
+    return 1
+
+
+def item_size(item: dict) -> int:
+    return sum(len(name.encode()) + attribute_size(value) for name, value in item.items())
+
+
+class CostTable:
+    """
+    Keeps items in memory and tallies the calls, bytes and WCUs written
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.calls = 0
+        self.written = 0
+        self.wcu = 0
+
+    def _write(self, item: dict):
+        size = item_size(item)
+        if size > ITEM_LIMIT:
+            raise ValueError(f"Item size {size} exceeds the 400 KB limit")
+        self.written += size
+        self.wcu += math.ceil(size / 1024)
+
+    def get_item(self, Key):
+        self.calls += 1
+        item = self.items.get(Key['faceId'])
+        return {'Item': dict(item)} if item else {}
+
+    def put_item(self, Item):
+        self.calls += 1
+        self._write(Item)
+        self.items[(Item['faceId'], Item.get('photoAt'))] = Item
+
+    def update_item(self, Key, ExpressionAttributeValues, UpdateExpression, **kwargs):
+        # Applies exactly the SET/ADD clauses the two code paths use
+        self.calls += 1
+        values = ExpressionAttributeValues
+        item = dict(self.items.get(Key['faceId'], Key))
+        item.update({
+            'name': values[':name'],
+            'phoneNumber': values[':phone'],
+            'updatedAt': values.get(':updated', values.get(':now'))
+        })
+        if ':photos' in values:
+            item['photos'] = values[':photos']
+        if ':photo' in values:
+            item.setdefault('createdAt', values[':now'])
+            item['status'] = values[':status']
+            item['latestPhoto'] = values[':photo']
+            item['photoCount'] = item.get('photoCount', 0) + 1
+        self._write(item)
+        self.items[Key['faceId']] = item
+        return {'Attributes': item}
+
+
+def legacy_register(table: CostTable, face_id: str, photo: dict):
+    """
+    The former create_visitor_record: read the visitor, append, write the list back
+    """
+    existing = table.get_item(Key={'faceId': face_id})
+    photos = existing['Item'].get('photos', []) + [photo]
+    table.update_item(
+        Key={'faceId': face_id},
+        UpdateExpression='SET #name = :name, phoneNumber = :phone, photos = :photos, updatedAt = :updated',
+        ExpressionAttributeValues={
+            ':name': 'Bench Visitor',
+            ':phone': '+12025550100',
+            ':photos': photos,
+            ':updated': photo['createdTimestamp']
+        }
+    )
+
+
+def photo_for(number: int) -> dict:
+    return photo_record(
+        f'visitors/20240101_{number:06d}_bench.jpg', BUCKET, f'2024-01-01T00:00:00.{number:06d}+00:00'
+    )
+
+
+def measure(existing: int) -> dict:
+    legacy = CostTable()
+    legacy.items['bench'] = {
+        'faceId': 'bench',
+        'name': 'Bench Visitor',
+        'phoneNumber': '+12025550100',
+        'photos': [photo_for(n) for n in range(existing)]
+    }
+    visitors, photos = CostTable(), CostTable()
+    upsert_visitor(visitors, 'bench', 'Bench Visitor', '+12025550100', photo_for(0))
+    visitors.calls = visitors.written = visitors.wcu = 0
+
+    result = {'existing': existing}
+    try:
+        legacy_register(legacy, 'bench', photo_for(existing))
+        result['legacy'] = (legacy.calls, legacy.written, legacy.wcu, item_size(legacy.items['bench']))
+    except ValueError:
+        result['legacy'] = None
+
+    photo = photo_for(existing)
+    upsert_visitor(visitors, 'bench', 'Bench Visitor', '+12025550100', photo, now=photo['createdTimestamp'])
+    add_photo(photos, 'bench', photo)
+    result['upsert'] = (visitors.calls + photos.calls, visitors.written + photos.written,
+                        visitors.wcu + photos.wcu, item_size(visitors.items['bench']))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--photos', default='1,10,100,1000,3000', help='Photos the visitor already has')
+    args = parser.parse_args()
+
+    print(f"{'photos':>7}   {'path':<14} {'calls':>5} {'bytes written':>14} {'WCU':>5} {'visitor item':>13}")
+    for existing in (int(n) for n in args.photos.split(',')):
+        result = measure(existing)
+        for path in ('legacy', 'upsert'):
+            cost = result[path]
+            label = 'read-modify' if path == 'legacy' else 'upsert+history'
+            if cost is None:
+                print(f"{existing:>7}   {label:<14} {'fails: visitor item over 400 KB':>40}")
+                continue
+            calls, written, wcu, size = cost
+            print(f"{existing:>7}   {label:<14} {calls:>5} {written:>14,} {wcu:>5} {size:>13,}")
+
+
+if __name__ == '__main__':
+    main()
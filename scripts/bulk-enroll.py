@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Bulk visitor enrollment
+Indexes many visitors' faces concurrently under an adaptive Rekognition rate
+limit, writes their records with batch writes and optionally sends each an
+OTP, checkpointing every row so an interrupted import resumes where it stopped
+
+Usage: ./bulk-enroll.py --csv people.csv (--photos-dir DIR | --s3-prefix s3://bucket/prefix/)
+                        [--workers 16] [--tps 20] [--skip-sms] [--door-id front] [--checkpoint FILE]
+CSV columns: name, phoneNumber, photo (file name, or key under the prefix), externalId (optional)
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from botocore.config import Config  # noqa: E402
+from botocore.exceptions import ClientError  # noqa: E402
+
+from common.clients import registry  # noqa: E402
+from common.face_collection import FaceCollections  # noqa: E402
+from common.otp import DEFAULT_DOOR_ID, allocate_otp  # noqa: E402
+from common.outbox import SmsOutbox  # noqa: E402
+from common.visitors import add_photo, photo_record, visitor_item  # noqa: E402
+
+# Rekognition errors that mean "slow down" rather than "this row is bad"
+THROTTLING_ERRORS = {'ThrottlingException', 'ProvisionedThroughputExceededException', 'LimitExceededException'}
+RETRYABLE_ERRORS = THROTTLING_ERRORS | {'InternalServerError', 'ServiceUnavailableException'}
+INDEX_ATTEMPTS = 8
+
+# Rows are written to DynamoDB in groups of this size (one BatchWriteItem each)
+WRITE_BATCH = 25
+OTP_TTL_SECONDS = 300
+
+# Row states in the checkpoint, in order
+INDEXED = 'indexed'      # Face is in the collection
+ENROLLED = 'enrolled'    # Visitor and photo records are written
+NOTIFIED = 'notified'    # OTP SMS queued
+NO_FACE = 'no_face'      # IndexFaces found no usable face; not retried
+FAILED = 'failed'        # Retried on the next run
+
+
+class AdaptiveRate:
+    """
+    Paces calls shared by all workers. The rate halves on a throttling error
+    (at most once a second) and climbs back by about one call per second
+    each second up to the ceiling.
+    """
+
+    def __init__(self, ceiling: float, floor: float = 0.5):
+        self.ceiling = ceiling
+        self.floor = floor
+        self.rate = ceiling
+        self.throttles = 0
+        self._next_at = 0.0
+        self._cut_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next_at)
+            self._next_at = at + 1 / self.rate
+        if at > now:
+            time.sleep(at - now)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.ceiling, self.rate + 1 / self.rate)
+
+    def throttled(self):
+        with self._lock:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self._cut_at >= 1:
+                self.rate = max(self.floor, self.rate / 2)
+                self._cut_at = now
+
+
+class Checkpoint:
+    """
+    Append-only JSON lines of {row, state, ...}; the last line per row wins
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.rows[entry['row']] = entry
+        self._file = open(path, 'a')
+
+    def record(self, entries: list):
+        for entry in entries:
+            self.rows[entry['row']] = entry
+            self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def read_rows(source: str) -> list:
+    """
+    CSV rows from a local file or s3://bucket/key
+    """
+    if source.startswith('s3://'):
+        bucket, key = source[5:].split('/', 1)
+        text = registry.client('s3').get_object(Bucket=bucket, Key=key)['Body'].read().decode('utf-8-sig')
+    else:
+        with open(source, encoding='utf-8-sig') as f:
+            text = f.read()
+    rows = []
+    for number, row in enumerate(csv.DictReader(io.StringIO(text)), 2):
+        row = {name.strip(): (value or '').strip() for name, value in row.items() if name}
+        if not row.get('name') or not row.get('phoneNumber') or not row.get('photo'):
+            print(f"Line {number}: name, phoneNumber and photo are required, skipping")
+            continue
+        phone = row['phoneNumber']
+        if not phone.startswith('+'):
+            phone = '+1' + phone.replace('-', '').replace(' ', '')
+        row['phoneNumber'] = phone
+        row['key'] = row.get('externalId') or row['photo']
+        rows.append(row)
+    return rows
+
+
+def external_image_id(key: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_.\-:]', '_', key)[:255]
+
+
+def enroll_face(row: dict, args, collections: FaceCollections, rate: AdaptiveRate) -> dict:
+    """
+    Put the row's photo in S3 if it is local and index it; runs on a worker
+    Returns the checkpoint entry for the row
+    """
+    entry = {'row': row['key']}
+    try:
+        if args.photos_dir:
+            bucket = args.bucket
+            extension = os.path.splitext(row['photo'])[1] or '.jpg'
+            photo_key = f"visitors/bulk/{external_image_id(row['key'])}{extension}"
+            registry.client('s3').upload_file(os.path.join(args.photos_dir, row['photo']), bucket, photo_key)
+        else:
+            bucket, _, prefix = args.s3_prefix[5:].partition('/')
+            photo_key = f"{prefix}{row['photo']}"
+
+        for attempt in range(INDEX_ATTEMPTS):
+            rate.acquire()
+            try:
+                response = collections.index_faces(
+                    Image={'S3Object': {'Bucket': bucket, 'Name': photo_key}},
+                    ExternalImageId=external_image_id(row['key']),
+                    MaxFaces=1,
+                    QualityFilter='AUTO'
+                )
+                rate.succeeded()
+                break
+            except ClientError as e:
+                code = e.response['Error']['Code']
+                if code not in RETRYABLE_ERRORS or attempt == INDEX_ATTEMPTS - 1:
+                    raise
+                if code in THROTTLING_ERRORS:
+                    rate.throttled()
+                time.sleep(random.uniform(0, min(20, 0.5 * 2 ** attempt)))
+
+        if not response.get('FaceRecords'):
+            return {**entry, 'state': NO_FACE}
+        return {
+            **entry,
+            'state': INDEXED,
+            'faceId': response['FaceRecords'][0]['Face']['FaceId'],
+            'collectionId': response['CollectionId'],
+            'photoKey': photo_key,
+            'bucket': bucket,
+            'indexedAt': datetime.now(timezone.utc).isoformat()
+        }
+    except Exception as e:
+        return {**entry, 'state': FAILED, 'error': str(e)[:300]}
+
+
+def write_records(pending: list, rows: dict, args) -> list:
+    """
+    Write visitor and photo records for indexed rows through batch writers
+    Returns their ENROLLED checkpoint entries once the writers have flushed
+    """
+    with registry.table(args.visitors_table).batch_writer() as visitors, \
+            registry.table(args.photos_table).batch_writer() as photos:
+        for entry in pending:
+            row = rows[entry['row']]
+            photo = photo_record(entry['photoKey'], entry['bucket'], entry['indexedAt'])
+            visitors.put_item(Item=visitor_item(
+                entry['faceId'], row['name'], row['phoneNumber'], photo, now=entry['indexedAt']
+            ))
+            add_photo(photos, entry['faceId'], photo)
+    return [{**entry, 'state': ENROLLED} for entry in pending]
+
+
+def notify(enrolled: list, rows: dict, args, outbox: SmsOutbox) -> list:
+    """
+    Allocate an OTP for each enrolled visitor and queue its SMS, as LF2 does
+    Returns NOTIFIED entries for the ones that were queued
+    """
+    passcodes = registry.table(args.passcodes_table)
+    notified = []
+    for entry in enrolled:
+        row = rows[entry['row']]
+        try:
+            otp = allocate_otp(passcodes, args.door_id, {
+                'faceId': entry['faceId'],
+                'visitorName': row['name'],
+                'createdAt': datetime.now(timezone.utc).isoformat()
+            }, OTP_TTL_SECONDS)
+            message = (
+                f"Hello {row['name']}! You've been approved for Smart Door access.\n"
+                f"Your access code is: {otp}\nThis code expires in 5 minutes."
+            )
+            outbox.send(row['phoneNumber'], message, {'doorId': args.door_id, 'otp': otp})
+            notified.append({**entry, 'state': NOTIFIED})
+        except Exception as e:
+            print(f"Error sending OTP to {row['key']}: {str(e)}")
+    return notified
+
+
+def run(args) -> dict:
+    rows = {row['key']: row for row in read_rows(args.csv)}
+    checkpoint = Checkpoint(args.checkpoint)
+    final = {NOTIFIED, NO_FACE} | ({ENROLLED} if args.skip_sms else set())
+
+    to_index, to_write, to_notify = [], [], []
+    for key, row in rows.items():
+        state = checkpoint.rows.get(key, {}).get('state')
+        if state in final:
+            continue
+        if state == INDEXED:
+            to_write.append(checkpoint.rows[key])
+        elif state == ENROLLED:
+            to_notify.append(checkpoint.rows[key])
+        else:
+            to_index.append(row)
+
+    counts = {INDEXED: 0, ENROLLED: 0, NOTIFIED: 0, NO_FACE: 0, FAILED: 0}
+    skipped = len(rows) - len(to_index) - len(to_write) - len(to_notify)
+    print(f"{len(rows)} rows: {skipped} already done, {len(to_write) + len(to_notify)} resumed, "
+          f"{len(to_index)} to index ({args.workers} workers, up to {args.tps:g} IndexFaces/s)")
+
+    # Throttling is handled here, by AdaptiveRate, rather than retried inside botocore
+    rekognition = registry.client('rekognition', config=Config(retries={'mode': 'standard', 'max_attempts': 1}))
+    collections = FaceCollections(rekognition, args.collection_id, args.shard_max_faces)
+    outbox = None if args.skip_sms else SmsOutbox(args.sms_queue_url, registry.client('sqs'), registry.client('sns'))
+    rate = AdaptiveRate(args.tps)
+    started = last_report = time.monotonic()
+
+    def flush(force: bool = False):
+        nonlocal to_write, to_notify
+        while len(to_write) >= WRITE_BATCH or (force and to_write):
+            batch, to_write = to_write[:WRITE_BATCH], to_write[WRITE_BATCH:]
+            enrolled = write_records(batch, rows, args)
+            checkpoint.record(enrolled)
+            counts[ENROLLED] += len(enrolled)
+            if not args.skip_sms:
+                to_notify.extend(enrolled)
+        if to_notify and (force or len(to_notify) >= WRITE_BATCH):
+            notified = notify(to_notify, rows, args, outbox)
+            checkpoint.record(notified)
+            counts[NOTIFIED] += len(notified)
+            to_notify = []
+
+    def report(final_report: bool = False):
+        elapsed = time.monotonic() - started
+        processed = counts[INDEXED] + counts[NO_FACE] + counts[FAILED]
+        speed = processed / elapsed if elapsed else 0.0
+        remaining = (len(to_index) - processed) / speed if speed else 0.0
+        print(f"  {processed}/{len(to_index)} indexed ({counts[NO_FACE]} no face, {counts[FAILED]} failed), "
+              f"{counts[ENROLLED]} written, {counts[NOTIFIED]} notified | {speed:.1f} rows/s, "
+              f"rate {rate.rate:.1f}/s, {rate.throttles} throttles"
+              + ('' if final_report else f", ETA {remaining:.0f}s"))
+
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+    futures = []
+    recorded = set()
+    try:
+        flush(force=True)
+        futures = [pool.submit(enroll_face, row, args, collections, rate) for row in to_index]
+        for future in as_completed(futures):
+            entry = future.result()
+            checkpoint.record([entry])
+            recorded.add(future)
+            counts[entry['state']] += 1
+            if entry['state'] == INDEXED:
+                to_write.append(entry)
+            elif entry['state'] == FAILED:
+                print(f"  {entry['row']}: {entry['error']}")
+            flush()
+            if time.monotonic() - last_report >= args.progress_seconds:
+                report()
+                last_report = time.monotonic()
+        flush(force=True)
+    finally:
+        # On an error or Ctrl-C, drop the queued rows but checkpoint the
+        # faces already in flight, so a rerun does not index them twice
+        pool.shutdown(wait=True, cancel_futures=True)
+        checkpoint.record([
+            future.result() for future in futures
+            if future not in recorded and future.done() and not future.cancelled()
+        ])
+        checkpoint.close()
+
+    report(final_report=True)
+    print(f"Finished in {time.monotonic() - started:.1f}s; checkpoint: {args.checkpoint}"
+          + (f" ({counts[FAILED]} failed rows are retried on the next run)" if counts[FAILED] else ''))
+    return {**counts, 'throttles': rate.throttles, 'seconds': time.monotonic() - started}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--csv', required=True, help='Local path or s3://bucket/key')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--photos-dir', help='Local directory with the photos; they are uploaded to --bucket')
+    source.add_argument('--s3-prefix', help='s3://bucket/prefix/ the photos are already under')
+    parser.add_argument('--environment', default=os.environ.get('ENVIRONMENT', 'dev'))
+    parser.add_argument('--bucket', default=os.environ.get('PHOTOS_BUCKET'), help='Photos bucket for --photos-dir')
+    parser.add_argument('--collection-id')
+    parser.add_argument('--shard-max-faces', type=int,
+                        default=int(os.environ.get('COLLECTION_SHARD_MAX_FACES', '1000000')))
+    parser.add_argument('--visitors-table')
+    parser.add_argument('--photos-table')
+    parser.add_argument('--passcodes-table')
+    parser.add_argument('--sms-queue-url', default=os.environ.get('SMS_QUEUE_URL'),
+                        help='SMS outbox; unset publishes directly')
+    parser.add_argument('--door-id', default=DEFAULT_DOOR_ID, help='Door the OTPs are issued for')
+    parser.add_argument('--skip-sms', action='store_true', help='Enroll without sending OTPs')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--tps', type=float, default=20, help='IndexFaces calls per second (check your account quota)')
+    parser.add_argument('--checkpoint', help='Defaults to <csv name>.checkpoint.jsonl')
+    parser.add_argument('--progress-seconds', type=float, default=5)
+    args = parser.parse_args(argv)
+
+    if args.photos_dir and not args.bucket:
+        parser.error('--bucket (or PHOTOS_BUCKET) is required with --photos-dir')
+    if args.s3_prefix and not args.s3_prefix.startswith('s3://'):
+        parser.error('--s3-prefix must look like s3://bucket/prefix/')
+    args.collection_id = args.collection_id or f'smartdoor-faces-{args.environment}'
+    args.visitors_table = args.visitors_table or f'smartdoor-visitors-{args.environment}'
+    args.photos_table = args.photos_table or f'smartdoor-visitor-photos-{args.environment}'
+    args.passcodes_table = args.passcodes_table or f'smartdoor-passcodes-{args.environment}'
+    args.checkpoint = args.checkpoint or f"{os.path.splitext(os.path.basename(args.csv))[0]}.checkpoint.jsonl"
+    return args
+
+
+if __name__ == '__main__':
+    run(parse_args())
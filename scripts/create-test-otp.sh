@@ -1,6 +1,6 @@
 #!/bin/bash
 # Create Test OTP Script
-# Usage: ./create-test-otp.sh [otp] [visitor-name]
+# Usage: ./create-test-otp.sh [otp] [visitor-name] [face-id] [door-id]
 
 set -e
 
@@ -18,8 +18,9 @@ fi
 OTP=${1:-$(python3 -c "import random; print(''.join([str(random.randint(0,9)) for _ in range(6)]))")}
 VISITOR_NAME=${2:-"Test Visitor"}
 FACE_ID=${3:-"test-face-$(date +%s)"}
+DOOR_ID=${4:-"default"}
 
-PASSCODES_TABLE="smartdoor-passcodes-${ENVIRONMENT}"
+PASSCODES_TABLE="smartdoor-passcodes-v2-${ENVIRONMENT}"
 
 echo "=========================================="
 echo "  Create Test OTP"
@@ -30,6 +31,7 @@ echo "Configuration:"
 echo "  OTP: $OTP"
 echo "  Visitor: $VISITOR_NAME"
 echo "  FaceId: $FACE_ID"
+echo "  Door: $DOOR_ID"
 echo "  Expires: 5 minutes from now"
 echo ""
 
@@ -40,6 +42,7 @@ echo "Adding OTP to DynamoDB..."
 aws dynamodb put-item \
     --table-name "$PASSCODES_TABLE" \
     --item "{
+        \"doorId\": {\"S\": \"$DOOR_ID\"},
         \"otp\": {\"S\": \"$OTP\"},
         \"faceId\": {\"S\": \"$FACE_ID\"},
         \"visitorName\": {\"S\": \"$VISITOR_NAME\"},
@@ -62,12 +65,12 @@ fi
 echo "Expires at: $EXPIRES_AT"
 echo ""
 echo "Test it:"
-echo "  1. Visit WP2: http://smartdoor-web-dev-437794636369.s3-website-us-east-1.amazonaws.com/wp2/index.html"
+echo "  1. Visit WP2: http://smartdoor-web-dev-437794636369.s3-website-us-east-1.amazonaws.com/wp2/index.html?door=$DOOR_ID"
 echo "  2. Enter OTP: $OTP"
 echo ""
 echo "Or test via API:"
 echo "  curl -X POST https://1elw5cppd8.execute-api.us-east-1.amazonaws.com/dev/validate \\"
 echo "    -H \"Content-Type: application/json\" \\"
-echo "    -d '{\"otp\":\"$OTP\"}'"
+echo "    -d '{\"otp\":\"$OTP\",\"doorId\":\"$DOOR_ID\"}'"
 echo ""
 
@@ -50,8 +50,10 @@ deploy_lambda() {
     # Create temporary directory for packaging
     TEMP_DIR=$(mktemp -d)
     
-    # Copy Lambda code
+    # Copy Lambda code and the shared helpers package
     cp "$LAMBDA_DIR"/*.py "$TEMP_DIR/"
+    mkdir -p "$TEMP_DIR/common"
+    cp "$PROJECT_DIR/lambda/common"/*.py "$TEMP_DIR/common/"
     
     # Install dependencies if requirements.txt exists
     if [ -f "$LAMBDA_DIR/requirements.txt" ]; then
@@ -87,6 +89,9 @@ deploy_lambda "lf2-registration" "$PROJECT_DIR/lambda/lf2-visitor-registration"
 # Deploy LF3 - OTP Validator
 deploy_lambda "lf3-validator" "$PROJECT_DIR/lambda/lf3-otp-validator"
 
+# Deploy LF4 - SMS Dispatcher
+deploy_lambda "lf4-sms-dispatcher" "$PROJECT_DIR/lambda/lf4-sms-dispatcher"
+
 echo ""
 echo "=========================================="
 echo "✓ All Lambda functions deployed!"
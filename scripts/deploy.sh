@@ -41,7 +41,7 @@ echo "Deploying Lambda functions..."
 cd lambda
 for f in lf1_process lf2_register lf3_validate; do
     cp ${f}.py index.py
-    zip -q ${f}.zip index.py
+    zip -q ${f}.zip index.py common/*.py
     FUNC="smartdoor-${f//_/-}"
     aws lambda update-function-code --function-name $FUNC --zip-file fileb://${f}.zip --region $REGION > /dev/null
     rm index.py ${f}.zip
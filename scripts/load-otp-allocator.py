@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Load test for the OTP allocator (common.otp.allocate_otp)
+Fills an in-memory passcodes table with live codes, then allocates from many
+threads and reports latency, attempts per allocation and overwritten codes,
+next to the old random.choices + unconditional put_item into one global space.
+With --doors the live codes are spread over several door-scoped spaces
+
+Usage: ./load-otp-allocator.py [--live 1000,10000,25000,50000] [--doors 1] [--allocations 2000] [--rtt-ms 5]
+"""
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda'))
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+from common.otp import allocate_otp  # noqa: E402
+
+OTP_TTL_SECONDS = 300
+
+
+class SimulatedTable:
+    """
+    In-memory passcodes table with one simulated round trip per put
+    Counts attempts and overwrites of live codes
+    """
+
+    def __init__(self, rtt_ms: float):
+        self.rtt_ms = rtt_ms
+        self.items = {}
+        self.lock = threading.Lock()
+        self.puts = 0
+        self.overwrites = 0
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        time.sleep(max(0.0, random.gauss(self.rtt_ms, self.rtt_ms * 0.15)) / 1000)
+        with self.lock:
+            self.puts += 1
+            key = (Item.get('doorId'), Item['otp'])
+            existing = self.items.get(key)
+            live = existing is not None and existing['ttl'] > int(time.time())
+            if live and ConditionExpression:
+                # Mirrors 'attribute_not_exists(otp) OR #ttl <= :now'
+                raise ClientError(
+                    {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'failed'}},
+                    'PutItem'
+                )
+            if live:
+                self.overwrites += 1
+            self.items[key] = Item
+        return {}
+
+    def fill(self, live: int, doors: list):
+        """
+        Spread live codes evenly over doors (None: the old global code space)
+        """
+        expires = int(time.time()) + OTP_TTL_SECONDS
+        self.items = {}
+        for index, door_id in enumerate(doors):
+            share = live // len(doors) + (index < live % len(doors))
+            for code in random.sample(range(10 ** 6), share):
+                self.items[(door_id, f'{code:06d}')] = {'otp': f'{code:06d}', 'ttl': expires}
+        self.puts = 0
+        self.overwrites = 0
+
+
+def legacy_allocate(table, door_id, fields: dict, ttl_seconds: int) -> str:
+    otp = ''.join(random.choices(string.digits, k=6))
+    table.put_item(Item={**fields, 'otp': otp, 'ttl': int(time.time()) + ttl_seconds})
+    return otp
+
+
+def run(table, allocate, live: int, doors: list, allocations: int, workers: int):
+    table.fill(live, doors)
+    times = []
+
+    def one(i):
+        started = time.perf_counter()
+        allocate(table, random.choice(doors), {'faceId': f'load-{i}', 'visitorName': 'Load Test'}, OTP_TTL_SECONDS)
+        elapsed = (time.perf_counter() - started) * 1000
+        times.append(elapsed)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(one, range(allocations)))
+
+    cuts = statistics.quantiles(times, n=100)
+    return {
+        'p50': cuts[49], 'p95': cuts[94], 'p99': cuts[98],
+        'attempts': table.puts / allocations,
+        'overwrites': table.overwrites
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--live', default='1000,10000,25000,50000', help='Live code counts to test')
+    parser.add_argument('--doors', type=int, default=1, help='Doors the live codes are spread over')
+    parser.add_argument('--allocations', type=int, default=2000)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--rtt-ms', type=float, default=5.0, help='Simulated DynamoDB round trip')
+    args = parser.parse_args()
+
+    random.seed(528)
+    table = SimulatedTable(args.rtt_ms)
+    doors = [f'door-{i}' for i in range(args.doors)]
+    print(f"{args.allocations:,} allocations, {args.workers} threads, {args.rtt_ms:g} ms round trip, "
+          f"{args.doors} door(s)")
+    print(f"{'live codes':>10}  {'allocator':<14} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} "
+          f"{'attempts':>9} {'overwritten':>11}")
+    for live in (int(n) for n in args.live.split(',')):
+        for name, allocate, spaces in (('random+put', legacy_allocate, [None]),
+                                       ('allocate_otp', allocate_otp, doors)):
+            result = run(table, allocate, live, spaces, args.allocations, args.workers)
+            print(f"{live:>10,}  {name:<14} {result['p50']:>7.2f} {result['p95']:>7.2f} "
+                  f"{result['p99']:>7.2f} {result['attempts']:>9.3f} {result['overwrites']:>11}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Load test for owner alert digests (common.digest)
+Feeds unknown-visitor detections at rising rates through LF1's owner alert
+path and the SMS dispatcher (LF4) on a simulated clock, with digests off and
+on, and reports messages sent per detection and how long alerts take
+
+Usage: ./load-owner-digest.py [--rates 0.005,0.02,0.1,0.5,2] [--events 200] [--window 30] [--max-events 5]
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import random
+import statistics
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path[:0] = [os.path.join(ROOT, 'lambda', 'lf1-stream-processor'), os.path.join(ROOT, 'lambda')]
+
+import common.cooldown  # noqa: E402
+import common.digest  # noqa: E402
+import common.outbox  # noqa: E402
+from common.clients import registry  # noqa: E402
+from standins import LocalQueue, MemoryTable, SimClock, SimulatedSns  # noqa: E402
+
+OWNER_PHONE = '+12025550199'
+TOPIC_ARN = 'arn:aws:sns:us-east-1:123456789012:smartdoor-notifications'
+QUEUE_URL = 'local://smartdoor-sms-outbox'
+
+
+def load_script(name: str, filename: str):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+
+def run(lf1, dispatcher, clock, queue, sns, rate: float, events: int, digest: bool) -> dict:
+    """
+    Poisson detections at rate per second until events, then drain the queue
+    """
+    lf1.OWNER_DIGEST_SECONDS = lf1.owner_digest.window_seconds if digest else 0
+    arrivals = []
+    at = clock.now
+    for _ in range(events):
+        at += random.expovariate(rate)
+        arrivals.append(at)
+
+    def dispatch_until(until):
+        while True:
+            batch = queue.receive(10)
+            if not batch:
+                upcoming = queue.next_visible()
+                if upcoming is None or upcoming > until:
+                    if until != float('inf'):
+                        clock.now = max(clock.now, until)
+                    return
+                clock.now = max(clock.now, upcoming)
+                continue
+            response = dispatcher.lambda_handler({'Records': batch}, None)
+            failed = {failure['itemIdentifier'] for failure in response['batchItemFailures']}
+            for record in batch:
+                if record['messageId'] not in failed:
+                    queue.delete(record['messageId'])
+
+    detected = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for number, arrival in enumerate(arrivals):
+            dispatch_until(arrival)
+            face_id = f'pending_{rate}_{number}'
+            detected[face_id] = clock.now
+            for send in lf1.handle_unknown_visitor(face_id, {}, f'unknown/{face_id}.jpg', None, 'front'):
+                send()
+        dispatch_until(float('inf'))
+
+    sms = [(t, message) for t, phone, message in sns.delivered if phone == OWNER_PHONE]
+    emails = [t for t, phone, _ in sns.delivered if phone is None]
+    delays = []
+    for face_id, at in detected.items():
+        first = next((t for t, message in sms if f'faceId={face_id}&' in message), None)
+        if first is not None:
+            delays.append(first - at)
+    sns.delivered.clear()
+    return {
+        'events': len(arrivals),
+        'sms': len(sms),
+        'emails': len(emails),
+        'missing': len(arrivals) - len(delays),
+        'p50': statistics.median(delays) if delays else 0.0,
+        'max': max(delays) if delays else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rates', default='0.005,0.02,0.1,0.5,2', help='Unknown detections per second')
+    parser.add_argument('--events', type=int, default=200, help='Detections per rate and mode')
+    parser.add_argument('--window', type=int, default=30, help='OWNER_DIGEST_SECONDS')
+    parser.add_argument('--max-events', type=int, default=5, help='OWNER_DIGEST_MAX_EVENTS')
+    args = parser.parse_args()
+
+    random.seed(528)
+    clock = SimClock(1.7e9)
+    os.environ.update({
+        'SMS_QUEUE_URL': QUEUE_URL,
+        'OWNER_PHONE': OWNER_PHONE,
+        'SNS_TOPIC_ARN': TOPIC_ARN,
+        'OWNER_DIGEST_SECONDS': str(args.window),
+        'OWNER_DIGEST_MAX_EVENTS': str(args.max_events),
+        'API_GATEWAY_URL': 'https://api.example.com/dev'
+    })
+
+    queue = LocalQueue(clock, latency_ms=8)
+    for name, key in (('smartdoor-visitors-dev', ('faceId',)), ('smartdoor-passcodes-v2-dev', ('doorId', 'otp')),
+                      ('smartdoor-cooldowns-dev', ('cooldownKey',))):
+        registry.override('table', name, MemoryTable(clock, key, 6))
+    registry.override('client', 'sqs', queue)
+    sns = SimulatedSns(clock, 40, account_rate=20)
+    registry.override('client', 'sns', sns)
+    for module in (common.cooldown, common.digest, common.outbox):
+        module.time = clock
+
+    lf1 = load_script('lf1_index', 'lambda/lf1-stream-processor/index.py')
+    dispatcher = load_script('lf4_index', 'lambda/lf4-sms-dispatcher/index.py')
+    dispatcher.time = clock
+    dispatcher.sms_limiter.clock = clock.time
+
+    print(f"Owner alerts for {args.events} detections per rate, digest window {args.window}s / "
+          f"{args.max_events} alerts (simulated)")
+    print(f"{'detections/s':>12} {'events':>7}   {'mode':<7} {'SMS':>5} {'emails':>7} {'msgs/event':>11} "
+          f"{'alert p50 s':>12} {'max s':>7} {'missing':>8}")
+    for rate in (float(r) for r in args.rates.split(',')):
+        for digest in (False, True):
+            result = run(lf1, dispatcher, clock, queue, sns, rate, args.events, digest)
+            per_event = (result['sms'] + result['emails']) / max(result['events'], 1)
+            print(f"{rate:>12g} {result['events']:>7}   {'digest' if digest else 'each':<7} "
+                  f"{result['sms']:>5} {result['emails']:>7} {per_event:>11.2f} "
+                  f"{result['p50']:>12.1f} {result['max']:>7.1f} {result['missing']:>8}")
+            clock.sleep(3600)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Offline replay harness for LF1 (stream processor)
+Drives recorded or synthetic Rekognition FaceSearchResponse batches through
+lambda_handler with in-memory stand-ins for DynamoDB, S3, SNS and KVS, and
+reports throughput plus per-stage p50/p95/p99 latency
+
+Usage:
+  ./replay-lf1.py --synthetic 2000 --batch-size 10 --latency dynamodb=8,s3=25,sns=40,kvs=60
+  ./replay-lf1.py --input recorded.jsonl --batch-size 10
+
+Synthetic records are stamped as each batch starts, as if captured
+--camera-ms before reaching the Kinesis stream (--ingest-ms of it before
+KVS received the frame) and --queue-ms before the batch; --skewed-cameras
+gives a share of frames a camera clock minutes off. With METRICS_MODE=local
+the door-to-SMS trace hops are printed too.
+
+Input lines are either raw Rekognition output documents or Kinesis events
+({"Records": [...]}). Nothing is sent to AWS.
+"""
+import argparse
+import base64
+import contextlib
+import functools
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+LF1_DIR = os.path.join(ROOT, 'lambda', 'lf1-stream-processor')
+sys.path[:0] = [LF1_DIR, os.path.join(ROOT, 'lambda')]
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+from standins import CounterStore, synthetic_fragment  # noqa: E402
+
+STREAM_ARN = 'arn:aws:kinesisvideo:us-east-1:123456789012:stream/replay-stream/1'
+TABLE_KEYS = {'visitors': ('faceId',), 'passcodes': ('doorId', 'otp'), 'cooldowns': ('cooldownKey',)}
+
+
+class Recorder:
+    """Thread-safe per-stage latency collector"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, injected_ms: float = 0.0, jitter: float = 0.0):
+        started = time.perf_counter()
+        if injected_ms:
+            time.sleep(max(0.0, random.gauss(injected_ms, injected_ms * jitter)) / 1000)
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            with self.lock:
+                self.samples[name].append(elapsed)
+
+
+class StandIns:
+    """Shared configuration for every stand-in service"""
+
+    def __init__(self, recorder: Recorder, latency: dict, jitter: float):
+        self.recorder = recorder
+        self.latency = latency
+        self.jitter = jitter
+
+    def stage(self, service: str, operation: str):
+        return self.recorder.stage(f"{service}.{operation}", self.latency.get(service, 0.0), self.jitter)
+
+
+def conditional_failed(old: dict):
+    item = {'ttl': {'N': str(old['ttl'])}} if 'ttl' in old else {}
+    return ClientError(
+        {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'},
+         'Item': item},
+        'PutItem'
+    )
+
+
+class FakeTable:
+    def __init__(self, name: str, key: tuple, services: StandIns, expressions):
+        self.name = name
+        self.key_names = key
+        self.items = {}
+        self.services = services
+        self.lock = threading.Lock()
+        # Update and conditional delete expressions are evaluated on the same items
+        self.expressions = expressions
+        self.expressions.items = self.items
+        self.expressions.key = self.key
+
+    def key(self, item: dict) -> tuple:
+        return tuple(item[name] for name in self.key_names)
+
+    def get_item(self, Key, **kwargs):
+        with self.services.stage('dynamodb', 'get_item'):
+            item = self.items.get(self.key(Key))
+            return {'Item': dict(item)} if item else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        with self.services.stage('dynamodb', 'put_item'), self.lock:
+            old = self.items.get(self.key(Item))
+            if ConditionExpression and old is not None:
+                values = ExpressionAttributeValues or {}
+                if ':now' in values:
+                    allowed = int(old.get('ttl', 0)) <= values[':now']
+                elif ':version' in values:
+                    allowed = old.get('version') == values[':version']
+                else:
+                    allowed = False
+                if not allowed:
+                    raise conditional_failed(old)
+            self.items[self.key(Item)] = dict(Item)
+            return {}
+
+    def delete_item(self, **kwargs):
+        with self.services.stage('dynamodb', 'delete_item'), self.lock:
+            return self.expressions.delete_item(**kwargs)
+
+    def update_item(self, **kwargs):
+        with self.services.stage('dynamodb', 'update_item'), self.lock:
+            return self.expressions.update_item(**kwargs)
+
+    def query(self, IndexName=None, ExpressionAttributeValues=None, **kwargs):
+        # Only the passcodes faceId index (common.otp.find_live_otp) is queried
+        with self.services.stage('dynamodb', 'query'), self.lock:
+            if IndexName != 'faceId-index':
+                return {'Items': []}
+            values = ExpressionAttributeValues
+            items = [
+                dict(item) for item in self.items.values()
+                if item.get('faceId') == values[':face'] and item['ttl'] > values[':until']
+                and item['doorId'] == values[':door'] and 'usedAt' not in item
+            ]
+            return {'Items': sorted(items, key=lambda item: item['ttl'], reverse=True)}
+
+    def batch_writer(self, **kwargs):
+        return FakeBatchWriter(self)
+
+
+class FakeBatchWriter:
+    def __init__(self, table: FakeTable):
+        self.table = table
+        self.buffer = []
+
+    def put_item(self, Item):
+        self.buffer.append(Item)
+        if len(self.buffer) >= 25:
+            self._flush()
+
+    def delete_item(self, Key):
+        self.table.items.pop(self.table.key(Key), None)
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        with self.table.services.stage('dynamodb', 'batch_write_item'):
+            for item in self.buffer:
+                self.table.items[self.table.key(item)] = dict(item)
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._flush()
+
+
+class FakeDynamoResource:
+    def __init__(self, tables: dict, services: StandIns):
+        self.tables = tables
+        self.services = services
+
+    def Table(self, name):
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems):
+        with self.services.stage('dynamodb', 'batch_get_item'):
+            responses = {}
+            for name, request in RequestItems.items():
+                table = self.tables[name]
+                responses[name] = [
+                    dict(table.items[table.key(key)]) for key in request['Keys']
+                    if table.key(key) in table.items
+                ]
+            return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+class FakeClient:
+    """S3, SNS, SQS, KVS and Rekognition stand-in: every operation succeeds after the injected latency"""
+
+    def __init__(self, service: str, services: StandIns, build_fragment=None):
+        self.service = service
+        self.services = services
+        self.build_fragment = build_fragment
+
+    def __getattr__(self, operation):
+        group = 'kvs' if self.service.startswith('kinesis-video') or self.service == 'kinesisvideo' else self.service
+
+        def call(**kwargs):
+            payload = None
+            if operation in ('get_media', 'get_media_for_fragment_list'):
+                fragments = kwargs.get('Fragments') or ['0']
+                payload = io.BytesIO(self.build_fragment(fragments[0]))
+            with self.services.stage(group, operation):
+                if operation in ('publish', 'send_message'):
+                    return {'MessageId': 'replay'}
+                if operation == 'get_data_endpoint':
+                    return {'DataEndpoint': 'https://replay.kinesisvideo.local'}
+                if payload is not None:
+                    return {'Payload': payload}
+                return {}
+        return call
+
+
+def synthetic_documents(count: int, visitors: int, known_ratio: float, empty_ratio: float):
+    """Rekognition output documents with a mix of empty, known and unknown frames"""
+    started = time.time()
+    for i in range(count):
+        roll = random.random()
+        faces = []
+        if roll >= empty_ratio:
+            detected = {
+                'Confidence': random.uniform(88, 99.9),
+                'BoundingBox': {'Width': 0.2, 'Height': 0.3,
+                                'Left': random.uniform(0.1, 0.6), 'Top': random.uniform(0.1, 0.5)}
+            }
+            matches = []
+            if roll < empty_ratio + (1 - empty_ratio) * known_ratio:
+                matches = [{'Similarity': random.uniform(75, 99.9),
+                            'Face': {'FaceId': f'visitor-{random.randrange(visitors):04d}'}}]
+            faces.append({'DetectedFace': detected, 'MatchedFaces': matches})
+        yield {
+            'InputInformation': {'KinesisVideo': {
+                'StreamArn': STREAM_ARN,
+                'FragmentNumber': str(91343852333181432392682062607743920146264271040 + i),
+                'ProducerTimestamp': started + i * 0.2,
+                'ServerTimestamp': started + i * 0.2 + 0.3,
+                'FrameOffsetInSeconds': 0.1
+            }},
+            'FaceSearchResponse': faces
+        }
+
+
+def stamp(records: list, camera_ms: float, ingest_ms: float, queue_ms: float, jitter: float,
+          skewed: float = 0.0):
+    """
+    Give synthetic records capture, ingest and arrival times just before
+    their batch; a skewed share has its producer timestamp minutes off
+    """
+    now = time.time()
+    for record in records:
+        document = json.loads(base64.b64decode(record['kinesis']['data']))
+        kinesis_video = document['InputInformation']['KinesisVideo']
+        arrived_at = now - max(0.0, random.gauss(queue_ms, queue_ms * jitter)) / 1000
+        captured_at = arrived_at - max(0.0, random.gauss(camera_ms, camera_ms * jitter)) / 1000
+        ingested_at = captured_at + min(camera_ms, max(0.0, random.gauss(ingest_ms, ingest_ms * jitter))) / 1000
+        offset = kinesis_video.get('FrameOffsetInSeconds', 0)
+        kinesis_video['ServerTimestamp'] = ingested_at - offset
+        kinesis_video['ProducerTimestamp'] = captured_at - offset
+        if random.random() < skewed:
+            kinesis_video['ProducerTimestamp'] += random.choice((-1, 1)) * random.uniform(120, 600)
+        record['kinesis']['data'] = base64.b64encode(json.dumps(document).encode()).decode()
+        record['kinesis']['approximateArrivalTimestamp'] = arrived_at
+
+
+def recorded_records(path: str):
+    """Kinesis records from a JSONL file of documents or whole events"""
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            document = json.loads(line)
+            if 'Records' in document:
+                yield from document['Records']
+            else:
+                yield {'kinesis': {'data': base64.b64encode(json.dumps(document).encode()).decode()}}
+
+
+def percentile(values: list, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def parse_latency(spec: str) -> dict:
+    latency = {}
+    for part in filter(None, (spec or '').split(',')):
+        service, ms = part.split('=')
+        latency[service.strip()] = float(ms)
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--input', help='JSONL of Rekognition documents or Kinesis events')
+    source.add_argument('--synthetic', type=int, help='Number of synthetic records')
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--latency', default='', help='Injected ms per service, e.g. dynamodb=8,s3=25,sns=40,kvs=60')
+    parser.add_argument('--jitter', type=float, default=0.2, help='Latency std-dev as a fraction of the mean')
+    parser.add_argument('--visitors', type=int, default=50, help='Known visitors in the synthetic directory')
+    parser.add_argument('--known-ratio', type=float, default=0.6)
+    parser.add_argument('--empty-ratio', type=float, default=0.5)
+    parser.add_argument('--cooldown', type=int, default=None, help='Override VISITOR_COOLDOWN_SECONDS')
+    parser.add_argument('--workers', type=int, default=None, help='Override MAX_WORKERS')
+    parser.add_argument('--camera-ms', type=float, default=1500,
+                        help='Synthetic capture to Kinesis record: KVS upload and Rekognition')
+    parser.add_argument('--ingest-ms', type=float, default=300, help='Synthetic capture to KVS ingest (upload)')
+    parser.add_argument('--skewed-cameras', type=float, default=0.0,
+                        help='Share of synthetic frames whose camera clock is minutes off')
+    parser.add_argument('--queue-ms', type=float, default=300, help='Synthetic record age when its batch starts')
+    parser.add_argument('--seed', type=int, default=528)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    os.environ.setdefault('KVS_STREAM_ARN', STREAM_ARN)
+    os.environ.setdefault('OWNER_PHONE', '+12025550199')
+    os.environ.setdefault('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:123456789012:replay')
+    os.environ.setdefault('SMS_QUEUE_URL', 'https://sqs.us-east-1.amazonaws.com/123456789012/replay')
+    if args.cooldown is not None:
+        os.environ['VISITOR_COOLDOWN_SECONDS'] = str(args.cooldown)
+    if args.workers is not None:
+        os.environ['MAX_WORKERS'] = str(args.workers)
+
+    recorder = Recorder()
+    services = StandIns(recorder, parse_latency(args.latency), args.jitter)
+
+    from common.clients import registry
+    import index
+
+    table_names = {
+        'visitors': index.VISITORS_TABLE,
+        'passcodes': index.PASSCODES_TABLE,
+        'cooldowns': index.COOLDOWN_TABLE
+    }
+    tables = {
+        table_names[kind]: FakeTable(table_names[kind], key, services, CounterStore())
+        for kind, key in TABLE_KEYS.items()
+    }
+
+    for name, table in tables.items():
+        registry.override('table', name, table)
+    registry.override('resource', 'dynamodb', FakeDynamoResource(tables, services))
+    build_fragment = functools.partial(synthetic_fragment, frames=30)
+    for service in ('s3', 'sns', 'sqs', 'rekognition', 'kinesisvideo', 'kinesis-video-media',
+                    'kinesis-video-archived-media'):
+        registry.override('client', service, FakeClient(service, services, build_fragment))
+
+    visitors_table = tables[index.VISITORS_TABLE]
+    for i in range(args.visitors):
+        visitors_table.items[(f'visitor-{i:04d}',)] = {
+            'faceId': f'visitor-{i:04d}', 'name': f'Visitor {i}', 'phoneNumber': f'+1202555{i:04d}'
+        }
+
+    if args.input:
+        records = list(recorded_records(args.input))
+    else:
+        records = [
+            {'kinesis': {'data': base64.b64encode(json.dumps(document).encode()).decode()}}
+            for document in synthetic_documents(args.synthetic, args.visitors, args.known_ratio, args.empty_ratio)
+        ]
+    for sequence, record in enumerate(records):
+        record['kinesis'].setdefault('sequenceNumber', str(sequence + 1))
+
+    failed = 0
+    started = time.perf_counter()
+    for offset in range(0, len(records), args.batch_size):
+        event = {'Records': records[offset:offset + args.batch_size]}
+        if args.synthetic:
+            stamp(event['Records'], args.camera_ms, args.ingest_ms, args.queue_ms, args.jitter, args.skewed_cameras)
+        with contextlib.redirect_stdout(io.StringIO()):
+            with recorder.stage('handler.batch'):
+                response = index.lambda_handler(event, None)
+        failed += len(response.get('batchItemFailures', []))
+    elapsed = time.perf_counter() - started
+
+    batches = (len(records) + args.batch_size - 1) // args.batch_size
+    print(f"records: {len(records):,} in {batches:,} batches of {args.batch_size}, "
+          f"{failed} failed, {elapsed:.2f} s")
+    print(f"throughput: {len(records) / elapsed:,.0f} records/s")
+    print()
+    print(f"{'stage':<44} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name in sorted(recorder.samples, key=lambda n: (n != 'handler.batch', n)):
+        values = recorder.samples[name]
+        print(f"{name:<44} {len(values):>7} {statistics.median(values):>9.2f} "
+              f"{percentile(values, 95):>9.2f} {percentile(values, 99):>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Simulation of bulk enrollment (bulk-enroll.py) against local stand-ins
+Rekognition answers IndexFaces after a delay and throttles calls above an
+account quota. The import is interrupted partway, resumed from its
+checkpoint, and compared with enrolling the same people one at a time.
+
+Usage: ./sim-bulk-enroll.py [--rows 2000] [--quota 50] [--index-ms 250] [--tps 80] [--workers 16] [--crash-after 24]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'lambda'))
+
+import importlib.util  # noqa: E402
+
+from common.clients import registry  # noqa: E402
+
+
+def load_script(name: str, filename: str):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+bulk = load_script('bulk_enroll', 'scripts/bulk-enroll.py')
+
+
+class QuotaRekognition:
+    """
+    IndexFaces takes index_ms (real time) and at most quota calls are admitted
+    per second; the rest fail with ThrottlingException like the real service
+    """
+
+    def __init__(self, quota: float, index_ms: float, no_face: float = 0.01):
+        self.quota = quota
+        self.index_ms = index_ms
+        self.no_face = no_face
+        self.calls = Counter()
+        self.faces = Counter()  # ExternalImageId -> faces indexed for it
+        self.tokens = quota
+        self.refilled_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def list_collections(self, **kwargs):
+        return {'CollectionIds': ['smartdoor-faces-sim']}
+
+    def describe_collection(self, CollectionId):
+        return {'FaceCount': sum(self.faces.values())}
+
+    def index_faces(self, CollectionId, Image, ExternalImageId, **kwargs):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.quota, self.tokens + (now - self.refilled_at) * self.quota)
+            self.refilled_at = now
+            admitted = self.tokens >= 1
+            self.tokens -= admitted
+            self.calls['throttled' if not admitted else 'index_faces'] += 1
+        if not admitted:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'IndexFaces')
+        time.sleep(self.index_ms / 1000 * random.uniform(0.7, 1.5))
+        if random.random() < self.no_face:
+            return {'FaceRecords': []}
+        with self.lock:
+            self.faces[ExternalImageId] += 1
+        return {'FaceRecords': [{'Face': {'FaceId': f'face-{random.getrandbits(64):016x}'}}]}
+
+
+class LocalS3:
+    def upload_file(self, filename, bucket, key):
+        time.sleep(0.015)
+
+
+class LocalTable:
+    """
+    Table with put_item and a batch writer; crash_after batch writes, the
+    next one raises to interrupt the import
+    """
+
+    def __init__(self, key_names: tuple, crash_after: int = None):
+        self.key_names = key_names
+        self.items = {}
+        self.batches = 0
+        self.crash_after = crash_after
+
+    def put_item(self, Item, **kwargs):
+        self.items[tuple(Item[name] for name in self.key_names)] = Item
+        return {}
+
+    @contextlib.contextmanager
+    def batch_writer(self):
+        if self.crash_after is not None and self.batches >= self.crash_after:
+            raise RuntimeError('simulated crash')
+        time.sleep(0.02)
+        self.batches += 1
+        yield self
+
+
+def write_input(directory: str, rows: int) -> str:
+    path = os.path.join(directory, 'people.csv')
+    with open(path, 'w') as f:
+        f.write('name,phoneNumber,photo,externalId\n')
+        for i in range(rows):
+            f.write(f'Resident {i},202-555-{i % 10000:04d},resident-{i}.jpg,resident-{i}\n')
+            open(os.path.join(directory, f'resident-{i}.jpg'), 'wb').close()
+    return path
+
+
+def enroll(directory: str, csv_path: str, extra: list, rekognition, tables, quiet: bool = True) -> dict:
+    registry.override('client', 'rekognition', rekognition)
+    registry.override('client', 's3', LocalS3())
+    for name, table in tables.items():
+        registry.override('table', name, table)
+    args = bulk.parse_args([
+        '--csv', csv_path, '--photos-dir', directory, '--bucket', 'sim-photos', '--environment', 'sim',
+        '--skip-sms', '--checkpoint', os.path.join(directory, 'people.checkpoint.jsonl'), *extra
+    ])
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output if quiet else sys.stdout):
+        try:
+            return bulk.run(args)
+        except RuntimeError as e:
+            return {'crashed': str(e)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--quota', type=float, default=50, help='IndexFaces per second the account allows')
+    parser.add_argument('--index-ms', type=float, default=250)
+    parser.add_argument('--tps', type=float, default=80, help='--tps given to bulk-enroll, above the quota')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--crash-after', type=int, default=24, help='Batch writes before the simulated crash')
+    parser.add_argument('--sequential-sample', type=int, default=40, help='Rows timed with one worker')
+    args = parser.parse_args()
+    random.seed(21)
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = write_input(directory, args.rows)
+        rekognition = QuotaRekognition(args.quota, args.index_ms)
+        visitors = LocalTable(('faceId',), crash_after=args.crash_after)
+        tables = {'smartdoor-visitors-sim': visitors, 'smartdoor-visitor-photos-sim': LocalTable(('faceId', 'photoAt'))}
+        extra = ['--workers', str(args.workers), '--tps', str(args.tps)]
+
+        print(f"Bulk enrollment of {args.rows} rows, {args.workers} workers, --tps {args.tps:g}, "
+              f"quota {args.quota:g} IndexFaces/s, {args.index_ms:g} ms per call (simulated services, real time)")
+        started = time.monotonic()
+        first = enroll(directory, csv_path, extra, rekognition, tables)
+        first_seconds = time.monotonic() - started
+        print(f"  run 1: {first.get('crashed')} after {first_seconds:.1f}s, "
+              f"{sum(rekognition.faces.values())} faces indexed, {len(visitors.items)} visitors written")
+
+        visitors.crash_after = None
+        second = enroll(directory, csv_path, extra, rekognition, tables, quiet=False)
+        total = first_seconds + second['seconds']
+        duplicates = sum(count - 1 for count in rekognition.faces.values() if count > 1)
+        print(f"  run 2 resumed: {second['seconds']:.1f}s; total {total:.1f}s = {args.rows / total:.1f} rows/s")
+        print(f"  visitors written {len(visitors.items)}, faces indexed {sum(rekognition.faces.values())} "
+              f"({duplicates} twice), no face {args.rows - len(rekognition.faces)}, "
+              f"throttled calls {rekognition.calls['throttled']}")
+
+        # One at a time, like POST /visitor per person
+        sample = max(1, min(args.sequential_sample, args.rows))
+        with tempfile.TemporaryDirectory() as single:
+            single_csv = write_input(single, sample)
+            tables = {'smartdoor-visitors-sim': LocalTable(('faceId',)),
+                      'smartdoor-visitor-photos-sim': LocalTable(('faceId', 'photoAt'))}
+            result = enroll(single, single_csv, ['--workers', '1', '--tps', str(args.quota)],
+                            QuotaRekognition(args.quota, args.index_ms), tables)
+        per_row = result['seconds'] / sample
+        print(f"  one worker: {per_row * 1000:.0f} ms per row, {args.rows} rows would take {per_row * args.rows:.0f}s; "
+              f"5000 rows: {per_row * 5000 / 60:.0f} min sequential vs {5000 / (args.rows / total) / 60:.1f} min bulk")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Simulation of the sharded Rekognition collections (common.face_collection)
+Enrolls visitors through several LF2 containers on a simulated clock and
+counts the control-plane calls and faces per shard, then times sequential
+and parallel searches across the shards against a local Rekognition stand-in
+
+Usage: ./sim-face-collections.py [--faces 6000] [--shard-max 1000] [--containers 4] [--rate 2] [--search-ms 80]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+import common.face_collection  # noqa: E402
+from common.face_collection import FaceCollections  # noqa: E402
+
+BASE_ID = 'smartdoor-faces-sim'
+
+
+class SimClock:
+    """
+    Stands in for the time module's monotonic clock
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+def client_error(code: str, operation: str):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class SimulatedRekognition:
+    """
+    Collections of enrolled people. An image is {'S3Object': {'Name': '<person>.jpg'}};
+    searches sleep search_ms (real time) so fan-out can be measured
+    """
+
+    def __init__(self, search_ms: float = 0.0):
+        self.search_ms = search_ms
+        self.collections = {}  # collection ID -> {person: face ID}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+
+    def _count(self, operation: str):
+        with self.lock:
+            self.calls[operation] += 1
+
+    def list_collections(self, **kwargs):
+        self._count('list_collections')
+        return {'CollectionIds': sorted(self.collections)}
+
+    def describe_collection(self, CollectionId):
+        self._count('describe_collection')
+        if CollectionId not in self.collections:
+            raise client_error('ResourceNotFoundException', 'DescribeCollection')
+        return {'FaceCount': len(self.collections[CollectionId])}
+
+    def create_collection(self, CollectionId):
+        self._count('create_collection')
+        with self.lock:
+            if CollectionId in self.collections:
+                raise client_error('ResourceAlreadyExistsException', 'CreateCollection')
+            self.collections[CollectionId] = {}
+        return {'StatusCode': 200}
+
+    def index_faces(self, CollectionId, Image, **kwargs):
+        self._count('index_faces')
+        person = Image['S3Object']['Name'].rsplit('.', 1)[0]
+        with self.lock:
+            if CollectionId not in self.collections:
+                raise client_error('ResourceNotFoundException', 'IndexFaces')
+            face_id = f"face-{person}"
+            self.collections[CollectionId][person] = face_id
+        return {'FaceRecords': [{'Face': {'FaceId': face_id}}]}
+
+    def search_faces_by_image(self, CollectionId, Image, FaceMatchThreshold, MaxFaces):
+        self._count('search_faces_by_image')
+        time.sleep(self.search_ms / 1000 * random.uniform(0.8, 1.3))
+        person = Image['S3Object']['Name'].rsplit('.', 1)[0]
+        face_id = self.collections.get(CollectionId, {}).get(person)
+        if face_id is None:
+            return {'FaceMatches': []}
+        return {'FaceMatches': [{'Similarity': 99.0, 'Face': {'FaceId': face_id}}]}
+
+
+def enroll(args) -> SimulatedRekognition:
+    clock = SimClock()
+    common.face_collection.time = clock
+    rekognition = SimulatedRekognition()
+    containers = [FaceCollections(rekognition, BASE_ID, args.shard_max) for _ in range(args.containers)]
+
+    for number in range(args.faces):
+        clock.now += random.expovariate(args.rate)
+        random.choice(containers).index_faces(Image={'S3Object': {'Name': f'person-{number}.jpg'}}, MaxFaces=1)
+
+    control = sum(count for operation, count in rekognition.calls.items() if operation != 'index_faces')
+    print(f"Enrolled {args.faces} faces from {args.containers} containers at {args.rate:g}/s, "
+          f"shard limit {args.shard_max} (simulated {clock.now / 3600:.1f}h)")
+    print(f"  control-plane calls: {control} "
+          f"({', '.join(f'{op} {n}' for op, n in sorted(rekognition.calls.items()) if op != 'index_faces')}); "
+          f"before: {args.faces} create_collection")
+    sizes = {collection_id: len(faces) for collection_id, faces in rekognition.collections.items()}
+    shards = sorted(sizes, key=containers[0].shard_number)
+    print(f"  faces per shard: {', '.join(str(sizes[collection_id]) for collection_id in shards)} "
+          f"(largest {max(sizes.values()) / args.shard_max:.0%} of the limit)")
+    common.face_collection.time = time
+    return rekognition
+
+
+def search(rekognition: SimulatedRekognition, args) -> None:
+    rekognition.search_ms = args.search_ms
+    enrolled = args.faces
+    print(f"\nSearching {args.probes} photos (90% enrolled), {args.search_ms:g} ms per SearchFacesByImage")
+    print(f"{'shards':>7}   {'mode':<10} {'p50 ms':>8} {'p95 ms':>8} {'found':>7}")
+    shard_ids = sorted(rekognition.collections, key=FaceCollections(rekognition, BASE_ID).shard_number)
+    for count in sorted({1, 2, len(shard_ids) // 2 or 1, len(shard_ids)}):
+        subset = SimulatedRekognition(args.search_ms)
+        subset.collections = {
+            collection_id: rekognition.collections[collection_id] for collection_id in shard_ids[:count]
+        }
+        for mode, workers in (('sequential', 1), ('parallel', 8)):
+            collections = FaceCollections(subset, BASE_ID, args.shard_max, max_workers=workers)
+            latencies, found, findable = [], 0, 0
+            for _ in range(args.probes):
+                if random.random() < 0.9:
+                    person = f'person-{random.randrange(enrolled)}'
+                    findable += any(person in faces for faces in subset.collections.values())
+                else:
+                    person = f'stranger-{random.randrange(10 ** 6)}'
+                started = time.perf_counter()
+                matches = collections.search({'S3Object': {'Name': f'{person}.jpg'}})
+                latencies.append((time.perf_counter() - started) * 1000)
+                found += bool(matches)
+            print(f"{count:>7}   {mode:<10} {statistics.median(latencies):>8.1f} "
+                  f"{statistics.quantiles(latencies, n=20)[18]:>8.1f} {found:>3}/{findable:<3}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--faces', type=int, default=6000, help='Visitors to enroll')
+    parser.add_argument('--shard-max', type=int, default=1000, help='COLLECTION_SHARD_MAX_FACES')
+    parser.add_argument('--containers', type=int, default=4, help='Concurrent LF2 containers')
+    parser.add_argument('--rate', type=float, default=2.0, help='Registrations per second')
+    parser.add_argument('--search-ms', type=float, default=80.0)
+    parser.add_argument('--probes', type=int, default=60, help='Searches per shard count and mode')
+    args = parser.parse_args()
+
+    random.seed(19)
+    rekognition = enroll(args)
+    search(rekognition, args)
+
+
+if __name__ == '__main__':
+    main()
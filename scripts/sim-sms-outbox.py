@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Simulation of the SMS outbox (common.outbox) and the SMS dispatcher (LF4)
+Measures LF2 request latency with SMS sent directly and through the outbox
+as SNS slows down or throttles, then drains a bursty backlog through the
+dispatcher against a local SQS stand-in, all on a simulated clock
+
+Usage: ./sim-sms-outbox.py [--requests 200] [--visitors 400] [--owner-alerts 40] [--duplicates 0.15]
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import random
+import statistics
+import sys
+from collections import Counter, defaultdict
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'lambda'))
+
+import common.cooldown  # noqa: E402
+import common.digest  # noqa: E402
+import common.outbox  # noqa: E402
+from common.clients import registry  # noqa: E402
+from standins import LocalQueue, MemoryTable, SimClock, SimulatedSns  # noqa: E402
+
+OWNER_PHONE = '+12025550199'
+QUEUE_URL = 'local://smartdoor-sms-outbox'
+
+
+def load_script(name: str, filename: str):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class SimulatedRekognition:
+    def __init__(self, clock: SimClock, latency_ms: float):
+        self.clock = clock
+        self.latency_ms = latency_ms
+
+    def list_collections(self, **kwargs):
+        self.clock.sleep(self.latency_ms / 1000)
+        return {'CollectionIds': ['smartdoor-faces-dev']}
+
+    def describe_collection(self, **kwargs):
+        self.clock.sleep(self.latency_ms / 1000)
+        return {'FaceCount': 0}
+
+    def create_collection(self, **kwargs):
+        self.clock.sleep(self.latency_ms / 1000)
+        return {}
+
+    def index_faces(self, **kwargs):
+        self.clock.sleep(self.latency_ms / 1000)
+        return {'FaceRecords': [{'Face': {'FaceId': f'face-{random.getrandbits(48):012x}'}}]}
+
+
+def percentile(values: list, pct: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100)[pct - 1]
+
+
+def registration_latency(lf2, clock: SimClock, sns: SimulatedSns, requests: int) -> dict:
+    """
+    Time LF2 POST /visitor on the simulated clock
+    """
+    times = []
+    errors = 0
+    for i in range(requests):
+        event = {'body': json.dumps({
+            'name': f'Visitor {i}', 'phoneNumber': f'+1202555{i:04d}',
+            'photoKey': f'visitors/{i}.jpg', 'faceId': f'pending_{i}', 'doorId': 'front'
+        })}
+        started = clock.now
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            response = lf2.lambda_handler(event, None)
+        times.append((clock.now - started) * 1000)
+        errors += response['statusCode'] != 200
+    return {'p50': statistics.median(times), 'p99': percentile(times, 99), 'errors': errors}
+
+
+def workload(visitors: int, owner_alerts: int, duplicates: float, seconds: float):
+    """
+    Yield (time, phone number, message, passcode) for a burst of visitor OTPs,
+    double-submitted duplicates and a stream of owner alerts
+    """
+    events = []
+    for i in range(visitors):
+        at = random.uniform(0, seconds)
+        phone = f'+1303555{i:04d}'
+        message = f'Hello Visitor {i}! Your Smart Door access code is: {i:06d}'
+        passcode = {'doorId': 'front', 'otp': f'{i:06d}'}
+        events.append((at, phone, message, passcode))
+        if random.random() < duplicates:
+            events.append((at + random.uniform(0, 1), phone, message, passcode))
+    for i in range(owner_alerts):
+        events.append((random.uniform(0, seconds), OWNER_PHONE, f'Unknown visitor #{i} at Smart Door!', None))
+    return sorted(events, key=lambda event: event[0])
+
+
+def drain(dispatcher, outbox, queue: LocalQueue, clock: SimClock, events: list, horizon: float) -> dict:
+    """
+    Enqueue events at their arrival time and poll the queue like the Lambda
+    SQS event source: batches of up to 10, batch item failures stay queued
+    """
+    start = clock.now
+    pending = list(events)
+    invocations = 0
+    deferrals = 0
+    max_receives = 0
+    sent = queue.sent
+    with contextlib.redirect_stdout(io.StringIO()):
+        while (pending or queue.messages) and clock.now - start < horizon:
+            while pending and start + pending[0][0] <= clock.now:
+                _, phone, message, passcode = pending.pop(0)
+                outbox.send(phone, message, passcode)
+            batch = queue.receive(10)
+            if not batch:
+                candidates = [t for t in (queue.next_visible(), start + pending[0][0] if pending else None) if t]
+                clock.now = max(clock.now + 0.01, min(candidates))
+                continue
+            invocations += 1
+            clock.sleep(0.005)  # invocation overhead
+            response = dispatcher.lambda_handler({'Records': batch}, None)
+            failed = {failure['itemIdentifier'] for failure in response['batchItemFailures']}
+            deferrals += len(failed)
+            for record in batch:
+                max_receives = max(max_receives, int(record['attributes']['ApproximateReceiveCount']))
+                if record['messageId'] not in failed:
+                    queue.delete(record['messageId'])
+    requeues = queue.sent - sent - len(events)
+    return {'elapsed': clock.now - start, 'invocations': invocations, 'deferrals': deferrals,
+            'requeues': requeues, 'max_receives': max_receives}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=200, help='LF2 registrations per scenario')
+    parser.add_argument('--visitors', type=int, default=400, help='Visitor OTP SMS in the dispatcher burst')
+    parser.add_argument('--owner-alerts', type=int, default=40, help='Owner alerts in the same burst')
+    parser.add_argument('--duplicates', type=float, default=0.15, help='Share of visitor SMS submitted twice')
+    parser.add_argument('--burst-seconds', type=float, default=10.0)
+    parser.add_argument('--sns-rate', type=float, default=20, help='Account-wide SNS SMS per second')
+    args = parser.parse_args()
+
+    random.seed(528)
+    clock = SimClock(1.7e9)
+    os.environ['SMS_QUEUE_URL'] = QUEUE_URL
+    os.environ['SNS_TOPIC_ARN'] = 'arn:aws:sns:us-east-1:123456789012:smartdoor-notifications-dev'
+
+    queue = LocalQueue(clock, latency_ms=8)
+    tables = {
+        'smartdoor-visitors-dev': MemoryTable(clock, ('faceId',), 6),
+        'smartdoor-visitor-photos-dev': MemoryTable(clock, ('faceId', 'photoAt'), 6),
+        'smartdoor-passcodes-v2-dev': MemoryTable(clock, ('doorId', 'otp'), 6),
+        'smartdoor-cooldowns-dev': MemoryTable(clock, ('cooldownKey',), 6)
+    }
+    for name, table in tables.items():
+        registry.override('table', name, table)
+    registry.override('client', 'sqs', queue)
+    registry.override('client', 'rekognition', SimulatedRekognition(clock, 120))
+    common.cooldown.time = clock
+    common.digest.time = clock
+    common.outbox.time = clock
+
+    lf2 = load_script('lf2_index', 'lambda/lf2-visitor-registration/index.py')
+    dispatcher = load_script('lf4_index', 'lambda/lf4-sms-dispatcher/index.py')
+    dispatcher.time = clock
+    dispatcher.sms_limiter.clock = clock.time
+
+    print(f"LF2 POST /visitor latency ({args.requests} requests per row, simulated)")
+    print(f"{'SNS':<22} {'direct p50':>11} {'p99':>8} {'errors':>7}   {'outbox p50':>11} {'p99':>8} {'errors':>7}")
+    for label, latency_ms, throttle_ratio in (('40 ms', 40, 0.0), ('400 ms', 400, 0.0),
+                                              ('2000 ms', 2000, 0.0), ('40 ms, 30% throttled', 40, 0.3)):
+        row = []
+        for queue_url in (None, QUEUE_URL):
+            sns = SimulatedSns(clock, latency_ms, account_rate=10 ** 6, throttle_ratio=throttle_ratio)
+            registry.override('client', 'sns', sns)
+            lf2.sms_outbox.queue_url = queue_url
+            row.append(registration_latency(lf2, clock, sns, args.requests))
+            queue.messages.clear()
+        print(f"{label:<22} {row[0]['p50']:>8.0f} ms {row[0]['p99']:>5.0f} ms {row[0]['errors']:>7}   "
+              f"{row[1]['p50']:>8.0f} ms {row[1]['p99']:>5.0f} ms {row[1]['errors']:>7}")
+
+    events = workload(args.visitors, args.owner_alerts, args.duplicates, args.burst_seconds)
+    invalid = {phone for _, phone, _, _ in random.sample(events, 3) if phone != OWNER_PHONE}
+    sns = SimulatedSns(clock, 40, account_rate=args.sns_rate, throttle_ratio=0.02, invalid_numbers=invalid)
+    registry.override('client', 'sns', sns)
+    for _, _, _, passcode in events:
+        if passcode:
+            tables['smartdoor-passcodes-v2-dev'].items[('front', passcode['otp'])] = {
+                **passcode, 'ttl': int(clock.now) + 3600
+            }
+    outbox = common.outbox.SmsOutbox(QUEUE_URL, queue, sns)
+    arrivals = {(phone, message): start for start, phone, message, _ in reversed(events)}
+    result = drain(dispatcher, outbox, queue, clock, events, horizon=3600)
+
+    distinct = len({(phone, message) for _, phone, message, _ in events})
+    delivered = Counter((phone, message) for _, phone, message in sns.delivered)
+    first = min(t for t, _, _ in sns.delivered)
+    per_second = Counter(int(t - first) for t, _, _ in sns.delivered)
+    per_minute = defaultdict(Counter)
+    delays = defaultdict(list)
+    for at, phone, message in sns.delivered:
+        per_minute[phone][int((at - first) // 60)] += 1
+        kind = 'owner' if phone == OWNER_PHONE else 'visitor'
+        delays[kind].append(at - first - arrivals[(phone, message)])
+    undeliverable = {passcode['otp'] for _, phone, _, passcode in events if phone in invalid}
+    revoked = sum(('front', otp) not in tables['smartdoor-passcodes-v2-dev'].items for otp in undeliverable)
+
+    print()
+    print(f"Dispatcher drain: {len(events)} SMS enqueued over {args.burst_seconds:g}s "
+          f"({distinct} distinct, {len(invalid)} undeliverable numbers), SNS {args.sns_rate:g}/s, 2% throttled")
+    print(f"  drained in {result['elapsed']:.0f}s simulated, {result['invocations']} invocations, "
+          f"{result['requeues']} rate-limit requeues, {result['deferrals']} SNS retries, "
+          f"SNS errors {dict(sns.errors)}")
+    print(f"  highest receive count {result['max_receives']} (dead-lettered after 25)")
+    print(f"  delivered {sum(delivered.values())} ({max(delivered.values())} max per distinct SMS), "
+          f"undeliverable OTPs revoked: {revoked} of {len(undeliverable)}")
+    print(f"  peak SNS rate {max(per_second.values())}/s; peak per number "
+          f"{max(max(minutes.values()) for minutes in per_minute.values())}/min")
+    for kind in ('visitor', 'owner'):
+        print(f"  {kind:<7} delivery delay p50 {statistics.median(delays[kind]):6.1f}s  "
+              f"p95 {percentile(delays[kind], 95):6.1f}s  max {max(delays[kind]):6.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Simulation of /validate brute-force shedding (common.limiter)
+Replays thousands of requests per second of guessing, botnet and real visitor
+traffic on a simulated clock against several warm LF3 containers that share
+an in-memory counter store, and counts what still reaches the passcodes table
+
+Usage: ./sim-validate-limiter.py [--seconds 120] [--rate 5000] [--containers 4]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lambda'))
+
+from common.limiter import Limit, RateLimiter  # noqa: E402
+from standins import CounterStore  # noqa: E402
+
+
+class SimClock:
+    def __init__(self, start: float):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+
+def traffic(seconds: int, rate: int, attackers: int, botnet: int, visitors: int, start: float):
+    """
+    Yield (time, ip, kind) for attacker, botnet and visitor requests
+    Attackers share 80% of the load; a botnet of low-rate IPs sends the rest,
+    and real visitors submit a valid code now and then
+    """
+    attacker_ips = [f'203.0.113.{i}' for i in range(attackers)]
+    botnet_ips = [f'198.51.{i // 256}.{i % 256}' for i in range(botnet)]
+    visitor_ips = [f'192.0.2.{i}' for i in range(visitors)]
+    step = 1.0 / rate
+    for i in range(seconds * rate):
+        now = start + i * step
+        roll = random.random()
+        if roll < 0.0005:
+            yield now, random.choice(visitor_ips), 'visitor'
+        elif roll < 0.8:
+            yield now, random.choice(attacker_ips), 'attacker'
+        else:
+            yield now, random.choice(botnet_ips), 'botnet'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=int, default=120)
+    parser.add_argument('--rate', type=int, default=5000, help='Requests per simulated second')
+    parser.add_argument('--containers', type=int, default=4, help='Warm LF3 containers behind the API')
+    parser.add_argument('--attackers', type=int, default=20)
+    parser.add_argument('--botnet', type=int, default=2000)
+    parser.add_argument('--visitors', type=int, default=50)
+    args = parser.parse_args()
+
+    random.seed(528)
+    start = 1.7e9
+    clock = SimClock(start)
+    store = CounterStore()
+    limits = {
+        'ip': Limit(rate=1, burst=5, window_seconds=60, window_max=20, lockout=True),
+        'door': Limit(rate=1000, burst=2000, window_seconds=60, window_max=10 ** 7)
+    }
+    containers = [RateLimiter(store, limits, clock=clock) for _ in range(args.containers)]
+
+    outcomes = Counter()
+    lookups = Counter()
+    total = Counter()
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for now, ip, kind in traffic(args.seconds, args.rate, args.attackers, args.botnet, args.visitors, start):
+            clock.now = now
+            limiter = random.choice(containers)
+            total[kind] += 1
+            reason, _ = limiter.check({'ip': ip, 'door': 'front'})
+            if reason:
+                outcomes[(kind, reason)] += 1
+                continue
+            # Admitted: this is where LF3 would consume the code
+            lookups[kind] += 1
+            if kind == 'visitor':
+                outcomes[(kind, 'granted')] += 1
+                limiter.record_success('ip', ip)
+            else:
+                outcomes[(kind, 'invalid')] += 1
+                limiter.record_failure('ip', ip)
+    elapsed = time.perf_counter() - started
+
+    requests = sum(total.values())
+    print(f"{requests:,} requests over {args.seconds}s simulated ({args.rate:,}/s), "
+          f"{args.containers} containers, simulated in {elapsed:.1f}s ({requests / elapsed:,.0f} req/s)")
+    print()
+    print(f"{'traffic':<10} {'requests':>10} {'passcode lookups':>17} {'rate limited':>13} {'locked':>9} {'granted':>8}")
+    for kind in ('attacker', 'botnet', 'visitor'):
+        print(f"{kind:<10} {total[kind]:>10,} {lookups[kind]:>17,} {outcomes[(kind, 'rate_limited')]:>13,} "
+              f"{outcomes[(kind, 'locked')]:>9,} {outcomes[(kind, 'granted')]:>8,}")
+    print()
+    print(f"passcode table lookups: {sum(lookups.values()):,} of {requests:,} "
+          f"({sum(lookups.values()) / requests:.2%}); counter store writes: {store.calls:,}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Simulation of LF1's visitor directory cache (common.visitor_cache)
+A household's visitors arrive, change phone numbers, join and leave over
+simulated days. Counts visitor-table reads and stale phone numbers served
+with no cache, a TTL cache, and the cache fed by the table's stream with
+and without a preloaded snapshot; then compares slotted and dict entries
+
+Usage: ./sim-visitor-cache.py [--days 7] [--household 12] [--visits 40] [--changes 3] [--recycle-hours 6]
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from itertools import takewhile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+import common.visitor_cache  # noqa: E402
+from common.visitor_cache import CachedVisitor, VisitorCache, VisitorChangeFeed  # noqa: E402
+
+ITERATOR_LIFETIME = 15 * 60  # DynamoDB Streams shard iterators expire after 15 minutes
+STREAM_LAG = 0.5  # Seconds before a write is visible on the stream
+
+
+class SimClock:
+    """
+    Stands in for the time module's monotonic clock
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+class SimVisitors:
+    """
+    The visitors table and its NEW_IMAGE stream (one shard)
+    """
+
+    def __init__(self, clock: SimClock):
+        self.clock = clock
+        self.items = {}
+        self.records = []  # (visible at, record)
+        self.calls = Counter()
+        self.items_read = 0
+
+    def write(self, face_id: str, name: str = None, phone_number: str = None):
+        sequence_number = str(len(self.records) + 1).zfill(21)
+        change = {'Keys': {'faceId': {'S': face_id}}, 'SequenceNumber': sequence_number}
+        if phone_number is None:
+            self.items.pop(face_id, None)
+            event = 'REMOVE'
+        else:
+            event = 'MODIFY' if face_id in self.items else 'INSERT'
+            self.items[face_id] = {'faceId': face_id, 'name': name, 'phoneNumber': phone_number}
+            change['NewImage'] = {key: {'S': value} for key, value in self.items[face_id].items()}
+        self.records.append((self.clock.now + STREAM_LAG, {'eventName': event, 'dynamodb': change}))
+
+    # Table
+    def batch_get(self, face_ids: list) -> dict:
+        self.calls['BatchGetItem'] += 1
+        self.items_read += len(face_ids)
+        return {face_id: dict(self.items[face_id]) for face_id in face_ids if face_id in self.items}
+
+    def scan(self, **kwargs):
+        self.calls['Scan'] += 1
+        self.items_read += len(self.items)
+        return {'Items': [dict(item) for item in self.items.values()]}
+
+    # Stream
+    def describe_stream(self, StreamArn, **kwargs):
+        self.calls['DescribeStream'] += 1
+        return {'StreamDescription': {'Shards': [{'ShardId': 'shard-0', 'SequenceNumberRange': {}}]}}
+
+    def get_shard_iterator(self, StreamArn, ShardId, ShardIteratorType, SequenceNumber=None):
+        self.calls['GetShardIterator'] += 1
+        visible = sum(1 for at, _ in self.records if at <= self.clock.now)
+        position = {
+            'LATEST': visible,
+            'TRIM_HORIZON': 0,
+            'AFTER_SEQUENCE_NUMBER': int(SequenceNumber or 0)
+        }[ShardIteratorType]
+        return {'ShardIterator': (position, self.clock.now + ITERATOR_LIFETIME)}
+
+    def get_records(self, ShardIterator, Limit):
+        self.calls['GetRecords'] += 1
+        position, expires_at = ShardIterator
+        if self.clock.now >= expires_at:
+            raise ClientError({'Error': {'Code': 'ExpiredIteratorException', 'Message': 'expired'}}, 'GetRecords')
+        visible = takewhile(lambda entry: entry[0] <= self.clock.now, self.records[position:position + Limit])
+        page = [record for _, record in visible]
+        return {'Records': page, 'NextShardIterator': (position + len(page), self.clock.now + ITERATOR_LIFETIME)}
+
+
+def events(args, rng: random.Random) -> list:
+    """
+    (time, kind) over the simulated days: visits by approved visitors,
+    phone changes, new visitors, removals, and container recycles
+    """
+    horizon = args.days * 86400
+    timeline = []
+    for kind, per_day in (('visit', args.visits), ('change', args.changes), ('join', 0.5), ('leave', 0.3)):
+        at = rng.expovariate(per_day / 86400)
+        while at < horizon:
+            timeline.append((at, kind))
+            at += rng.expovariate(per_day / 86400)
+    at = args.recycle_hours * 3600
+    while at < horizon:
+        timeline.append((at, 'recycle'))
+        at += args.recycle_hours * 3600
+    return sorted(timeline)
+
+
+def run(mode: str, args) -> dict:
+    rng = random.Random(23)
+    clock = SimClock()
+    common.visitor_cache.time = clock
+    table = SimVisitors(clock)
+    for number in range(args.household):
+        table.write(f'face-{number}', f'Visitor {number}', f'+1202555{number:04d}')
+    joined = args.household
+
+    def container():
+        if mode == 'none':
+            return None
+        feed = VisitorChangeFeed(table, 'arn:visitors-stream') if mode.startswith('stream') else None
+        return VisitorCache(
+            table, 21600 if feed else 60, 1000, feed, args.household * 4 if mode == 'stream+snapshot' else 0
+        )
+
+    cache = container()
+    lookups = stale = 0
+    for at, kind in events(args, rng):
+        clock.now = at
+        if kind == 'recycle':
+            cache = container()
+        elif kind == 'join':
+            table.write(f'face-{joined}', f'Visitor {joined}', f'+1202555{joined:04d}')
+            joined += 1
+        elif kind in ('change', 'leave') and table.items:
+            face_id = rng.choice(sorted(table.items))
+            if kind == 'leave':
+                table.write(face_id)
+            else:
+                table.write(face_id, table.items[face_id]['name'], f'+1303555{rng.randrange(10000):04d}')
+        elif kind == 'visit' and table.items:
+            face_id = rng.choice(sorted(table.items))
+            lookups += 1
+            if cache is None:
+                visitor = table.batch_get([face_id]).get(face_id)
+            else:
+                visitor = cache.get_many([face_id], table.batch_get).get(face_id)
+            truth = table.items.get(face_id)
+            stale += (visitor or {}).get('phoneNumber') != (truth or {}).get('phoneNumber')
+    common.visitor_cache.time = time
+
+    stream_calls = sum(table.calls[op] for op in ('DescribeStream', 'GetShardIterator', 'GetRecords'))
+    return {
+        'lookups': lookups,
+        'reads': table.calls['BatchGetItem'] + table.calls['Scan'],
+        'items_read': table.items_read,
+        'stream_calls': stream_calls,
+        'stale': stale
+    }
+
+
+def entry_bytes(count: int = 1000) -> tuple:
+    """
+    Bytes per cached visitor: a CachedVisitor vs the item dict it replaces
+    """
+    sizes = []
+    for make in (
+        lambda n: CachedVisitor(f'face-{n:08d}', f'Visitor {n}', f'+1202555{n % 10000:04d}', 1.0),
+        lambda n: {'faceId': f'face-{n:08d}', 'name': f'Visitor {n}', 'phoneNumber': f'+1202555{n % 10000:04d}',
+                   'expiresAt': 1.0}
+    ):
+        tracemalloc.start()
+        entries = [make(n) for n in range(count)]
+        sizes.append(tracemalloc.get_traced_memory()[0] / count)
+        tracemalloc.stop()
+        del entries
+    return tuple(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--household', type=int, default=12, help='Approved visitors at the start')
+    parser.add_argument('--visits', type=float, default=40, help='Known-visitor lookups per day')
+    parser.add_argument('--changes', type=float, default=3, help='Phone number changes per day')
+    parser.add_argument('--recycle-hours', type=float, default=6, help='Lifetime of an LF1 container')
+    args = parser.parse_args()
+
+    print(f"{args.days} simulated days, {args.household} visitors, {args.visits:g} visits/day, "
+          f"{args.changes:g} phone changes/day, containers recycled every {args.recycle_hours:g}h")
+    print(f"{'mode':<16} {'lookups':>8} {'table reads':>12} {'per lookup':>11} {'items read':>11} "
+          f"{'stream calls':>13} {'stale':>6}")
+    for mode in ('none', 'ttl', 'stream', 'stream+snapshot'):
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run(mode, args)
+        print(f"{mode:<16} {result['lookups']:>8} {result['reads']:>12} "
+              f"{result['reads'] / result['lookups']:>11.2f} {result['items_read']:>11} "
+              f"{result['stream_calls']:>13} {result['stale']:>6}")
+
+    slotted, item = entry_bytes()
+    print(f"\nBytes per cached visitor: {slotted:.0f} slotted vs {item:.0f} as an item dict")
+
+
+if __name__ == '__main__':
+    main()
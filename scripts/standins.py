@@ -0,0 +1,326 @@
+"""
+In-memory stand-ins shared by the simulation and benchmark scripts
+A simulated clock, DynamoDB tables (CounterStore evaluates the update and
+condition expressions the common helpers issue), an SQS queue and SNS, and
+a builder for synthetic KVS fragments of MJPEG frames. Nothing is sent to AWS.
+"""
+import io
+import os
+import random
+import re
+import sys
+from collections import Counter
+
+LF1_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'lf1-stream-processor')
+if LF1_DIR not in sys.path:
+    sys.path.append(LF1_DIR)
+
+from botocore.exceptions import ClientError  # noqa: E402
+
+import mkv  # noqa: E402
+
+
+class SimClock:
+    """
+    Stands in for the time module: sleeping advances the simulated clock
+    """
+
+    def __init__(self, start: float):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += max(0.0, seconds)
+
+
+def client_error(code: str, operation: str):
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+class CounterStore:
+    """
+    In-memory stand-in for the cooldowns table supporting the SET/ADD/REMOVE
+    updates (including list_append, if_not_exists and sets), conditional puts
+    and deletes, and the simple conditions the shared helpers issue
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.calls = 0
+
+    def key(self, key: dict):
+        return key['cooldownKey']
+
+    def get_item(self, Key, **kwargs):
+        self.calls += 1
+        item = self.items.get(self.key(Key))
+        return {'Item': dict(item)} if item else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        self.calls += 1
+        existing = self.items.get(self.key(Item), {})
+        self._check(ConditionExpression, existing, ExpressionAttributeNames, ExpressionAttributeValues, 'PutItem')
+        self.items[self.key(Item)] = dict(Item)
+        return {}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues=None):
+        self.calls += 1
+        existing = self.items.get(self.key(Key), {})
+        self._check(ConditionExpression, existing, ExpressionAttributeNames, ExpressionAttributeValues, 'DeleteItem')
+        self.items.pop(self.key(Key), None)
+        return {'Attributes': dict(existing)} if ReturnValues == 'ALL_OLD' and existing else {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None,
+                    ExpressionAttributeNames=None, ExpressionAttributeValues=None, ReturnValues=None):
+        self.calls += 1
+        names = ExpressionAttributeNames or {}
+        values = ExpressionAttributeValues or {}
+        item = self.items.get(self.key(Key), {})
+        self._check(ConditionExpression, item, names, values, 'UpdateItem')
+
+        item = dict(item, **Key)
+        for action, body in re.findall(r'(SET|ADD|REMOVE)\s+(.*?)(?=\s+(?:SET|ADD|REMOVE)\s|$)', UpdateExpression):
+            for clause in re.split(r',\s*(?![^(]*\))', body):
+                clause = clause.strip()
+                if action == 'SET':
+                    name, value = (part.strip() for part in clause.split('=', 1))
+                    appended = re.fullmatch(r'list_append\((.+),\s*(\S+)\)', value)
+                    defaulted = re.fullmatch(r'if_not_exists\((\S+),\s*(\S+)\)', value)
+                    if appended:
+                        item[names.get(name, name)] = item.get(names.get(name, name), []) + values[appended.group(2)]
+                    elif defaulted:
+                        path = names.get(defaulted.group(1), defaulted.group(1))
+                        item[names.get(name, name)] = item.get(path, values[defaulted.group(2)])
+                    else:
+                        item[names.get(name, name)] = values[value]
+                elif action == 'ADD':
+                    name, value = clause.split()
+                    current = item.get(names.get(name, name), set() if isinstance(values[value], set) else 0)
+                    item[names.get(name, name)] = current | values[value] if isinstance(current, set) \
+                        else current + values[value]
+                else:
+                    item.pop(names.get(clause, clause), None)
+        self.items[self.key(Key)] = item
+        return {'Attributes': dict(item)} if ReturnValues == 'ALL_NEW' else {}
+
+    def _check(self, expression, item, names, values, operation):
+        if expression and not self._condition(expression, item, names or {}, values or {}):
+            response = {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'failed'}}
+            if item:
+                response['Item'] = {name: {'N': str(value)} for name, value in item.items()
+                                    if isinstance(value, (int, float))}
+            raise ClientError(response, operation)
+
+    def _condition(self, expression, item, names, values):
+        for alternative in expression.split(' OR '):
+            if all(self._atom(atom.strip(), item, names, values) for atom in alternative.split(' AND ')):
+                return True
+        return False
+
+    def _atom(self, atom, item, names, values):
+        match = re.fullmatch(r'attribute_(not_exists|exists)\((\S+)\)', atom)
+        if match:
+            return (names.get(match.group(2), match.group(2)) in item) == (match.group(1) == 'exists')
+        match = re.fullmatch(r'(NOT )?contains\((\S+),\s*(\S+)\)', atom)
+        if match:
+            found = values[match.group(3)] in item.get(names.get(match.group(2), match.group(2)), ())
+            return found != bool(match.group(1))
+        name, operator, value = atom.split()
+        current = item.get(names.get(name, name))
+        if current is None:
+            return False
+        return {
+            '=': current == values[value], '<': current < values[value], '<=': current <= values[value],
+            '>': current > values[value], '>=': current >= values[value]
+        }[operator]
+
+
+class MemoryTable(CounterStore):
+    """
+    In-memory DynamoDB table with any key schema; every call takes one
+    simulated round trip
+    """
+
+    def __init__(self, clock: SimClock, key_names: tuple, latency_ms: float):
+        super().__init__()
+        self.clock = clock
+        self.key_names = key_names
+        self.latency_ms = latency_ms
+
+    def key(self, item: dict):
+        return tuple(item[name] for name in self.key_names)
+
+    def get_item(self, **kwargs):
+        self.clock.sleep(self.latency_ms / 1000)
+        return super().get_item(**kwargs)
+
+    def put_item(self, **kwargs):
+        self.clock.sleep(self.latency_ms / 1000)
+        return super().put_item(**kwargs)
+
+    def delete_item(self, **kwargs):
+        self.clock.sleep(self.latency_ms / 1000)
+        return super().delete_item(**kwargs)
+
+    def update_item(self, **kwargs):
+        self.clock.sleep(self.latency_ms / 1000)
+        return super().update_item(**kwargs)
+
+
+class LocalQueue:
+    """
+    SQS stand-in with per-message visibility timeouts and receive counts
+    """
+
+    def __init__(self, clock: SimClock, latency_ms: float, visibility_timeout: int = 180):
+        self.clock = clock
+        self.latency_ms = latency_ms
+        self.visibility_timeout = visibility_timeout
+        self.messages = {}  # messageId -> {'body', 'visibleAt', 'receives'}
+        self.sent = 0
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0, **kwargs):
+        self.clock.sleep(self.latency_ms / 1000)
+        self.sent += 1
+        message_id = f'msg-{self.sent}'
+        self.messages[message_id] = {'body': MessageBody, 'visibleAt': self.clock.now + DelaySeconds, 'receives': 0}
+        return {'MessageId': message_id}
+
+    def receive(self, max_messages: int = 10) -> list:
+        """
+        Take up to max_messages visible messages as Lambda SQS event records
+        """
+        visible = [
+            message_id for message_id, message in self.messages.items()
+            if message['visibleAt'] <= self.clock.now
+        ][:max_messages]
+        records = []
+        for message_id in visible:
+            message = self.messages[message_id]
+            message['receives'] += 1
+            message['visibleAt'] = self.clock.now + self.visibility_timeout
+            records.append({
+                'messageId': message_id,
+                'receiptHandle': f"{message_id}#{message['receives']}",
+                'body': message['body'],
+                'attributes': {'ApproximateReceiveCount': str(message['receives'])}
+            })
+        return records
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        message = self.messages.get(ReceiptHandle.split('#')[0])
+        if message:
+            message['visibleAt'] = self.clock.now + VisibilityTimeout
+        return {}
+
+    def delete(self, message_id: str):
+        self.messages.pop(message_id, None)
+
+    def next_visible(self):
+        return min((message['visibleAt'] for message in self.messages.values()), default=None)
+
+
+class SimulatedSns:
+    """
+    SNS stand-in: fixed latency, an account-wide SMS rate (throttles above
+    it), random throttling and numbers that are permanently undeliverable
+    """
+
+    def __init__(self, clock: SimClock, latency_ms: float, account_rate: float = 20,
+                 throttle_ratio: float = 0.0, invalid_numbers=()):
+        self.clock = clock
+        self.latency_ms = latency_ms
+        self.account_rate = account_rate
+        self.throttle_ratio = throttle_ratio
+        self.invalid_numbers = set(invalid_numbers)
+        self.tokens = account_rate
+        self.updated = clock.now
+        self.delivered = []  # (time, phone number, message)
+        self.errors = Counter()
+
+    def publish(self, PhoneNumber=None, Message=None, **kwargs):
+        self.clock.sleep(self.latency_ms / 1000)
+        now = self.clock.now
+        self.tokens = min(self.account_rate, self.tokens + (now - self.updated) * self.account_rate)
+        self.updated = now
+        if self.tokens < 1 or random.random() < self.throttle_ratio:
+            self.errors['Throttling'] += 1
+            raise client_error('Throttling', 'Publish')
+        if PhoneNumber in self.invalid_numbers:
+            self.errors['InvalidParameter'] += 1
+            raise client_error('InvalidParameter', 'Publish')
+        self.tokens -= 1
+        self.delivered.append((now, PhoneNumber, Message))
+        return {'MessageId': f'sns-{len(self.delivered)}'}
+
+
+def ebml_id(element_id):
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big')
+
+
+def ebml_size(size):
+    if size is None:
+        return b'\x01\xff\xff\xff\xff\xff\xff\xff'  # Unknown size
+    for length in range(1, 9):
+        if size < (1 << (7 * length)) - 1:
+            return ((1 << (7 * length)) | size).to_bytes(length, 'big')
+    raise ValueError('Size too large')
+
+
+def element(element_id, payload=b'', unknown_size=False):
+    return ebml_id(element_id) + ebml_size(None if unknown_size else len(payload)) + payload
+
+
+def uint(value):
+    return value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'big')
+
+
+def simple_block(track, timecode, keyframe, data):
+    header = bytes([0x80 | track]) + timecode.to_bytes(2, 'big', signed=True)
+    return element(mkv.SIMPLE_BLOCK, header + bytes([0x80 if keyframe else 0x00]) + data)
+
+
+def jpeg_frame(width: int, height: int) -> bytes:
+    """
+    A decodable JPEG with camera-like detail: coarse noise scaled up to the
+    frame size, so decode, crop and re-encode do real work
+    """
+    from PIL import Image
+
+    noise = Image.frombytes('RGB', (width // 16, height // 16), os.urandom(width // 16 * (height // 16) * 3))
+    output = io.BytesIO()
+    noise.resize((width, height), Image.BICUBIC).save(output, format='JPEG', quality=85)
+    return output.getvalue()
+
+
+def synthetic_fragment(fragment_number: str, frames: int = 150) -> bytes:
+    """
+    Build a KVS-like fragment: EBML header, unknown-size Segment, fragment
+    number tag, video + audio tracks and one Cluster of MJPEG frames
+    """
+    frame = jpeg_frame(640, 480)
+    tags = element(mkv.TAGS, element(mkv.TAG, element(mkv.SIMPLE_TAG,
+        element(mkv.TAG_NAME, mkv.FRAGMENT_NUMBER_TAG.encode()) +
+        element(mkv.TAG_STRING, fragment_number.encode())
+    )))
+    tracks = element(mkv.TRACKS,
+        element(mkv.TRACK_ENTRY,
+            element(mkv.TRACK_NUMBER, uint(1)) + element(mkv.TRACK_TYPE, uint(1)) +
+            element(mkv.CODEC_ID, mkv.MJPEG_CODEC.encode()) +
+            element(mkv.VIDEO, element(mkv.PIXEL_WIDTH, uint(640)) + element(mkv.PIXEL_HEIGHT, uint(480)))
+        ) +
+        element(mkv.TRACK_ENTRY,
+            element(mkv.TRACK_NUMBER, uint(2)) + element(mkv.TRACK_TYPE, uint(2)) +
+            element(mkv.CODEC_ID, b'A_AAC')
+        )
+    )
+    blocks = [element(mkv.CLUSTER_TIMECODE, uint(0)), simple_block(2, 0, True, os.urandom(512))]
+    for i in range(frames):
+        blocks.append(simple_block(1, i * 33, i == 0, frame))
+    cluster = ebml_id(mkv.CLUSTER) + ebml_size(None) + b''.join(blocks)
+    segment = ebml_id(mkv.SEGMENT) + ebml_size(None) + tags + tracks + cluster
+    return element(mkv.EBML_HEADER, element(0x4282, b'matroska')) + segment